@@ -0,0 +1,760 @@
+#!/usr/bin/env python3
+"""
+ComfyUI 异步客户端
+基于 aiohttp 连接池，单个事件循环即可同时驱动大量任务
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import time
+import uuid
+from typing import Optional, Dict, Any, List, Callable, Awaitable
+from urllib.parse import urlparse
+
+import aiohttp
+
+from metrics import Metrics, endpoint_label
+from upload_cache import UploadCache, file_digest, content_filename
+from journal import JobJournal
+from preprocess import guess_mime_type
+from history_tracker import AsyncHistoryTracker
+from progress import NodeProfiler, ProgressCallback
+from retry_policy import RetryPolicy, RetryBudget, CircuitBreaker, DEFAULT_POLICIES, UNSENT_REASONS
+from main import (
+    COMPRESS_MIN_BYTES,
+    ComfyUIExecutionError,
+    _remaining,
+    _check_deadline,
+    collect_output_filenames,
+    dumps_compact,
+    find_load_image_node,
+    load_workflow_from_file,
+    prompt_request_body,
+    update_workflow_parameters,
+)
+
+
+class AsyncCircuitOpenError(aiohttp.ClientConnectionError):
+    """服务器处于熔断状态，请求没有发出"""
+
+
+def _failure_reason(error: BaseException) -> Optional[str]:
+    """与main._failure_reason相同的归类: connect（未送达）、timeout、connection，不可重试时返回None"""
+    if isinstance(error, AsyncCircuitOpenError):
+        return None
+    if isinstance(error, aiohttp.ClientConnectorError):
+        return 'connect'
+    if isinstance(error, asyncio.TimeoutError):
+        return 'timeout'
+    if isinstance(error, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)):
+        return 'connection'
+    return None
+
+
+def _retry_after(response: aiohttp.ClientResponse) -> Optional[float]:
+    try:
+        return float(response.headers['Retry-After'])
+    except (KeyError, ValueError):
+        return None
+
+
+class AsyncComfyUIAPI:
+    def __init__(self, server_address="127.0.0.1:8188", timeout=30, use_websocket=True,
+                 max_connections=100, upload_cache: Optional[UploadCache] = None,
+                 metrics: Optional[Metrics] = None, journal: Optional[JobJournal] = None,
+                 on_progress: Optional[ProgressCallback] = None,
+                 retry_policies: Optional[Dict[str, RetryPolicy]] = None,
+                 breaker: Optional[CircuitBreaker] = None, compress_requests: bool = False):
+        self.server_address = server_address
+        self.client_id = str(uuid.uuid4())
+        self.timeout = timeout
+        self.use_websocket = use_websocket
+        # gzip压缩 /prompt 请求体，服务器返回415时自动关闭
+        self.compress_requests = compress_requests
+        self.max_connections = max_connections
+        self.upload_cache = upload_cache
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.journal = journal
+        # 进度回调在WebSocket监听任务中同步调用，不应阻塞事件循环
+        self.on_progress = on_progress
+        self.profiler = NodeProfiler(self.metrics)
+
+        # 确保server_address格式正确
+        if not server_address.startswith(('http://', 'https://')):
+            self.base_url = f"http://{server_address}"
+        else:
+            self.base_url = server_address.rstrip('/')
+            # 从URL中提取host:port
+            parsed = urlparse(self.base_url)
+            self.server_address = f"{parsed.hostname}:{parsed.port or 80}"
+
+        # session需要在事件循环内创建，首次请求时初始化
+        self.session: Optional[aiohttp.ClientSession] = None
+
+        # 按操作类型重试，策略与熔断同ComfyUIAPI
+        self.retry_policies = dict(DEFAULT_POLICIES, **(retry_policies or {}))
+        self.retry_budget = RetryBudget()
+        self.breaker = breaker or CircuitBreaker(self.server_address, metrics=self.metrics)
+        self.accepts_prompt_id: Optional[bool] = None
+
+        # 共享WebSocket监听任务及按prompt_id登记的等待者
+        self._ws_task: Optional[asyncio.Task] = None
+        self._ws_ready: Optional[asyncio.Future] = None
+        self._waiters: Dict[str, asyncio.Future] = {}
+        # execution_start事件到达的时间，用于区分排队和执行耗时
+        self._started_at: Dict[str, float] = {}
+        # 轮询模式下共享的状态查询
+        self._tracker: Optional[AsyncHistoryTracker] = None
+
+        # 同一内容的并发上传只执行一次
+        self._upload_locks: Dict[str, asyncio.Lock] = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """获取共享的连接池session"""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections)
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                trace_configs=[self._trace_config()],
+            )
+        return self.session
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        """记录每个HTTP请求的耗时（到收到响应头为止）、状态码以及请求体和响应体的字节数
+
+        on_response_chunk_received只在读取整个响应体（read/json）时触发，
+        流式下载的字节数由download_output按分块计数。
+        """
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            ctx.start = time.perf_counter()
+
+        async def on_request_end(session, ctx, params):
+            endpoint = endpoint_label(str(params.url))
+            self.metrics.observe('comfyui_client_request_seconds', time.perf_counter() - ctx.start,
+                                 method=params.method, endpoint=endpoint)
+            self.metrics.inc('comfyui_client_requests_total', method=params.method, endpoint=endpoint,
+                             status=params.response.status)
+
+        async def on_request_chunk_sent(session, ctx, params):
+            self.metrics.inc('comfyui_client_sent_bytes_total', len(params.chunk),
+                             endpoint=endpoint_label(str(params.url)))
+
+        async def on_response_chunk_received(session, ctx, params):
+            self.metrics.inc('comfyui_client_received_bytes_total', len(params.chunk),
+                             endpoint=endpoint_label(str(params.url)))
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_chunk_sent.append(on_request_chunk_sent)
+        trace_config.on_response_chunk_received.append(on_response_chunk_received)
+        return trace_config
+
+    async def _send(self, operation: str, method: str, url: str, **kwargs) -> aiohttp.ClientResponse:
+        """发送一次请求，返回的响应由调用方用async with释放；熔断和失败计数同ComfyUIAPI._send"""
+        if not self.breaker.allow():
+            self.metrics.inc('comfyui_client_circuit_rejected_total', server=self.server_address,
+                             operation=operation)
+            raise AsyncCircuitOpenError(f"服务器 {self.server_address} 处于熔断状态: {method} {endpoint_label(url)}")
+        if callable(kwargs.get('data')):
+            # FormData只能发送一次，重试时重新生成
+            kwargs = dict(kwargs, data=kwargs['data']())
+        try:
+            response = await self._get_session().request(method, url, **kwargs)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.breaker.record_failure()
+            raise
+        if response.status >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    async def _retry_allowed(self, operation: str, attempt: int, reason: str, url: str,
+                             retry_after: Optional[float] = None,
+                             should_retry: Optional[Callable[[str], Awaitable[bool]]] = None) -> bool:
+        """第attempt次请求失败后是否重试，允许时计数并等待退避时间"""
+        policy = self.retry_policies[operation]
+        if attempt >= policy.max_attempts or (should_retry is not None and not await should_retry(reason)):
+            return False
+        if not self.retry_budget.withdraw():
+            self.metrics.inc('comfyui_client_retry_budget_exhausted_total', server=self.server_address,
+                             operation=operation)
+            return False
+        self.metrics.inc('comfyui_client_http_retries_total', operation=operation,
+                         endpoint=endpoint_label(url), reason=reason)
+        await asyncio.sleep(policy.backoff(attempt, retry_after))
+        return True
+
+    async def _request(self, operation: str, method: str, url: str,
+                       should_retry: Optional[Callable[[str], Awaitable[bool]]] = None,
+                       **kwargs) -> aiohttp.ClientResponse:
+        """按操作类型的策略发送请求，重试用尽后返回最后的响应或抛出最后的异常"""
+        policy = self.retry_policies[operation]
+        self.retry_budget.deposit()
+        attempt = 1
+        while True:
+            try:
+                response = await self._send(operation, method, url, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                reason = _failure_reason(e)
+                if reason is None or not await self._retry_allowed(operation, attempt, reason, url,
+                                                                   should_retry=should_retry):
+                    raise
+            else:
+                if response.status not in policy.retry_statuses:
+                    return response
+                if not await self._retry_allowed(operation, attempt, str(response.status), url,
+                                                 _retry_after(response), should_retry):
+                    return response
+                response.release()
+            attempt += 1
+
+    def _record_wait(self, prompt_id: str, start: float):
+        """记录等待耗时，收到execution_start时拆分为排队和执行两段
+
+        空闲的服务器可能在开始等待之前就已开始执行，此时排队耗时为0。
+        """
+        end = time.perf_counter()
+        started = self._started_at.pop(prompt_id, None)
+        if started is not None and started <= end:
+            started = max(started, start)
+            self.metrics.record_span('queue_wait', start, started - start, prompt_id)
+            self.metrics.record_span('execute', started, end - started, prompt_id)
+        else:
+            self.metrics.record_span('wait', start, end - start, prompt_id)
+
+    @property
+    def ws_url(self) -> str:
+        """事件推送通道地址: ws(s)://host:port/ws?clientId=..."""
+        scheme = 'wss' if self.base_url.startswith('https://') else 'ws'
+        return f"{scheme}://{self.base_url.split('://', 1)[1]}/ws?clientId={self.client_id}"
+
+    async def test_connection(self) -> bool:
+        """测试与ComfyUI服务器的连接"""
+        try:
+            print(f"测试连接到: {self.base_url}")
+            async with await self._request('probe', 'GET', f"{self.base_url}/queue",
+                                           timeout=aiohttp.ClientTimeout(total=10)) as response:
+                if response.status == 200:
+                    print("✅ 连接成功")
+                    return True
+                print(f"❌ 连接失败，状态码: {response.status}")
+                return False
+        except aiohttp.ClientConnectionError as e:
+            print(f"❌ 连接错误: {e}")
+            return False
+        except asyncio.TimeoutError:
+            print("❌ 连接超时")
+            return False
+        except Exception as e:
+            print(f"❌ 连接测试失败: {e}")
+            return False
+
+    async def _post_json(self, operation: str, url: str, body: bytes,
+                         should_retry: Optional[Callable[[str], Awaitable[bool]]] = None) -> aiohttp.ClientResponse:
+        """发送已序列化的JSON请求体，开启压缩且足够大时使用gzip，服务器返回415时改为不压缩"""
+        headers = {'Content-Type': 'application/json'}
+        if self.compress_requests and len(body) >= COMPRESS_MIN_BYTES:
+            response = await self._request(operation, 'POST', url, data=gzip.compress(body, compresslevel=5),
+                                           headers=dict(headers, **{'Content-Encoding': 'gzip'}),
+                                           should_retry=should_retry)
+            if response.status != 415:
+                return response
+            response.release()
+            print("⚠️  服务器不接受gzip压缩的请求体，改为不压缩发送")
+            self.compress_requests = False
+        return await self._request(operation, 'POST', url, data=body, headers=headers, should_retry=should_retry)
+
+    async def queue_prompt(self, prompt: Dict[str, Any], output_dir: Optional[str] = None,
+                           prompt_json: Optional[bytes] = None,
+                           journal_fields: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """提交工作流到队列，配置了任务日志时记录prompt_id、服务器和output_dir
+
+        prompt_json为已序列化的prompt（WorkflowTemplate.encode），提供时不再重新序列化。
+        journal_fields为任务日志中额外记录的字段（如批量任务的job_id和结果文件）。
+
+        与ComfyUIAPI.queue_prompt相同，提交结果未知时确认服务器上没有该prompt_id才重新提交。
+        """
+        # 提交前建立WebSocket连接，否则会错过开始执行时的事件，节点耗时不完整
+        if self.use_websocket:
+            await self._ensure_listener()
+        prompt_id = str(uuid.uuid4())
+        accepted = []
+        # 空闲的服务器在/prompt返回前就开始执行，先登记才能收到最初的节点事件
+        if self.use_websocket:
+            self.profiler.register(prompt_id, prompt)
+
+        async def should_retry(reason: str) -> bool:
+            if reason in UNSENT_REASONS:
+                return True
+            if not self.accepts_prompt_id:
+                return False
+            found = await self.find_prompt(prompt_id)
+            if found:
+                accepted.append(prompt_id)
+            return found is False  # 查询失败时无法排除重复，不重试
+
+        try:
+            body = prompt_request_body(prompt_json or dumps_compact(prompt),
+                                       {"client_id": self.client_id, "prompt_id": prompt_id})
+            async with await self._post_json('submit', f"{self.base_url}/prompt", body,
+                                             should_retry) as response:
+                if not accepted:
+                    response.raise_for_status()
+                    result = await response.json()
+                    self.accepts_prompt_id = result.get('prompt_id') == prompt_id
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if not accepted:
+                print(f"提交工作流失败: {e}")
+                self.profiler.pop(prompt_id)
+                raise
+        if accepted:
+            print(f"提交结果未知，但服务器上已有该任务，不再重复提交: {prompt_id}")
+            result = {'prompt_id': prompt_id, 'number': None, 'node_errors': {}}
+        if self.use_websocket and result.get('prompt_id') != prompt_id:
+            # 旧版服务器忽略客户端的prompt_id，改为登记服务器返回的ID
+            self.profiler.pop(prompt_id)
+            if 'prompt_id' in result:
+                self.profiler.register(result['prompt_id'], prompt)
+        if self.journal and 'prompt_id' in result:
+            self.journal.record(result['prompt_id'], 'submitted', server=self.base_url, output_dir=output_dir,
+                                **(journal_fields or {}))
+        return result
+
+    async def find_prompt(self, prompt_id: str) -> Optional[bool]:
+        """任务是否在服务器的队列或历史中，查询失败时返回None"""
+        try:
+            queue = await self.get_queue()
+            if any(item[1] == prompt_id for key in ('queue_running', 'queue_pending')
+                   for item in queue.get(key, [])):
+                return True
+            return prompt_id in await self.get_history(prompt_id)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return None
+
+    def mark_downloaded(self, prompt_id: str, outputs: List[str]):
+        """输出已全部下载，任务日志中不再需要恢复"""
+        if self.journal:
+            self.journal.record(prompt_id, 'downloaded', outputs=outputs)
+
+    def pop_node_profile(self, prompt_id: str) -> List[Dict[str, Any]]:
+        """取走任务各节点的执行耗时（仅WebSocket模式下有记录）"""
+        return self.profiler.pop(prompt_id)
+
+    async def get_history(self, prompt_id: str) -> Dict[str, Any]:
+        """获取执行历史"""
+        try:
+            async with await self._request('read', 'GET', f"{self.base_url}/history/{prompt_id}") as response:
+                response.raise_for_status()
+                return await response.json()
+        except aiohttp.ClientError as e:
+            print(f"获取历史失败: {e}")
+            raise
+
+    async def get_recent_history(self, max_items: int) -> Dict[str, Any]:
+        """获取最近完成的max_items个任务的执行历史"""
+        try:
+            async with await self._request('read', 'GET', f"{self.base_url}/history",
+                                           params={'max_items': max_items}) as response:
+                response.raise_for_status()
+                return await response.json()
+        except aiohttp.ClientError as e:
+            print(f"获取历史失败: {e}")
+            raise
+
+    async def get_queue(self) -> Dict[str, Any]:
+        """获取队列状态"""
+        try:
+            async with await self._request('read', 'GET', f"{self.base_url}/queue") as response:
+                response.raise_for_status()
+                return await response.json()
+        except aiohttp.ClientError as e:
+            print(f"获取队列状态失败: {e}")
+            raise
+
+    async def wait_for_completion(self, prompt_id: str, check_interval: float = 2,
+                                  timeout: Optional[float] = None, events: bool = True) -> Dict[str, Any]:
+        """等待任务完成
+
+        与ComfyUIAPI.wait_for_completion行为一致：优先监听WebSocket事件，断开后退化为轮询。
+        同一client_id在服务器端只对应一个连接，因此所有等待者共享一个WebSocket监听任务。
+        events为False时直接轮询，用于其他客户端（如崩溃前的进程）提交的任务，收不到它的事件。
+        """
+        print(f"等待任务完成，ID: {prompt_id}")
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        start = time.perf_counter()
+
+        try:
+            if self.use_websocket and events:
+                history = await self._wait_via_websocket(prompt_id, deadline)
+                if history is not None:
+                    self._record_wait(prompt_id, start)
+                    return history
+                print("WebSocket不可用，改为轮询任务状态")
+
+            history = await self._poll_for_completion(prompt_id, check_interval, deadline)
+            self._record_wait(prompt_id, start)
+            return history
+        except ComfyUIExecutionError as e:
+            if self.journal:
+                self.journal.record(prompt_id, 'failed', error=str(e))
+            raise
+        finally:
+            self._started_at.pop(prompt_id, None)
+
+    async def _ensure_listener(self) -> bool:
+        """确保共享的WebSocket监听任务在运行，返回连接是否可用"""
+        if self._ws_task is None or self._ws_task.done():
+            self._ws_ready = asyncio.get_running_loop().create_future()
+            self._ws_task = asyncio.ensure_future(self._listen())
+        return await asyncio.shield(self._ws_ready)
+
+    async def _listen(self):
+        """读取事件并分发给对应prompt_id的等待者"""
+        try:
+            ws = await self._get_session().ws_connect(self.ws_url, heartbeat=30)
+        except Exception as e:
+            print(f"WebSocket连接失败: {e}")
+            self._ws_ready.set_result(False)
+            return
+
+        self._ws_ready.set_result(True)
+        try:
+            async for message in ws:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    continue  # 二进制帧为预览图，忽略
+
+                event = json.loads(message.data)
+                event_type = event.get('type')
+                data = event.get('data') or {}
+                progress = self.profiler.handle(event_type, data)
+                if progress is not None and self.on_progress is not None:
+                    try:
+                        self.on_progress(progress)
+                    except Exception as e:
+                        print(f"进度回调出错: {e}")
+                # 本连接只收到本客户端提交的任务的事件；开始执行可能早于等待者登记
+                if event_type == 'execution_start' and data.get('prompt_id'):
+                    self._started_at[data['prompt_id']] = time.perf_counter()
+                waiter = self._waiters.get(data.get('prompt_id'))
+                if waiter is None or waiter.done():
+                    continue
+
+                if event_type == 'executing' and data.get('node') is None:
+                    waiter.set_result(True)
+                elif event_type == 'execution_success':
+                    waiter.set_result(True)
+                elif event_type == 'execution_error':
+                    waiter.set_exception(ComfyUIExecutionError(
+                        data['prompt_id'], data.get('exception_message', '未知错误'), data.get('node_id')))
+                elif event_type == 'execution_interrupted':
+                    waiter.set_exception(ComfyUIExecutionError(data['prompt_id'], '任务被中断',
+                                                               data.get('node_id')))
+        except Exception as e:
+            print(f"WebSocket连接中断: {e}")
+        finally:
+            await ws.close()
+            # 连接丢失，通知仍在等待的任务改为轮询
+            for waiter in self._waiters.values():
+                if not waiter.done():
+                    waiter.set_result(False)
+
+    async def _wait_via_websocket(self, prompt_id: str, deadline: Optional[float]) -> Optional[Dict[str, Any]]:
+        """等待共享监听任务的完成通知，连接失败或断开时返回None"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[prompt_id] = waiter
+        try:
+            if not await self._ensure_listener():
+                return None
+
+            # 连接建立前任务可能已经结束，先查一次history
+            entry = await self._finished_history(prompt_id)
+            if entry is not None:
+                return entry
+
+            while True:
+                _check_deadline(prompt_id, deadline)
+                try:
+                    completed = await asyncio.wait_for(asyncio.shield(waiter),
+                                                       min(self.timeout, _remaining(deadline)))
+                except asyncio.TimeoutError:
+                    # 长时间没有事件时确认一次history，防止漏掉完成事件
+                    entry = await self._finished_history(prompt_id)
+                    if entry is not None:
+                        return entry
+                    continue
+                if not completed:
+                    return None
+                break
+        finally:
+            self._waiters.pop(prompt_id, None)
+
+        # 完成事件先于history写入，短间隔等待history可读，查询失败时逐渐拉长间隔
+        interval = 0.1
+        while True:
+            entry = await self._finished_history(prompt_id)
+            if entry is not None:
+                return entry
+            _check_deadline(prompt_id, deadline)
+            await asyncio.sleep(min(interval, _remaining(deadline)))
+            interval = min(interval * 2, 2.0)
+
+    async def _finished_history(self, prompt_id: str) -> Optional[Dict[str, Any]]:
+        """返回已完成任务的history，未完成或查询失败时返回None，与ComfyUIAPI._finished_history相同"""
+        try:
+            history = await self.get_history(prompt_id)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"检查状态时出错: {e}")
+            return None
+        if prompt_id not in history:
+            return None
+        print("任务完成！")
+        return history[prompt_id]
+
+    async def _poll_for_completion(self, prompt_id: str, check_interval: float,
+                                   deadline: Optional[float]) -> Dict[str, Any]:
+        """轮询直到任务完成，所有等待者共享同一个AsyncHistoryTracker的 /queue 和 /history 请求"""
+        if self._tracker is None:
+            self._tracker = AsyncHistoryTracker(self, initial_interval=check_interval)
+        return await self._tracker.wait(prompt_id, deadline)
+
+    async def upload_image(self, image_path: str, server_filename: Optional[str] = None,
+                           overwrite: bool = False) -> bool:
+        """上传图片到ComfyUI，server_filename为服务器端文件名（默认使用原文件名）"""
+        if not os.path.exists(image_path):
+            print(f"图片文件不存在: {image_path}")
+            return False
+
+        try:
+            content = await asyncio.to_thread(_read_bytes, image_path)
+            filename = server_filename or os.path.basename(image_path)
+
+            def make_form() -> aiohttp.FormData:
+                form = aiohttp.FormData()
+                form.add_field('image', content, filename=filename, content_type=guess_mime_type(filename))
+                if overwrite:
+                    form.add_field('overwrite', 'true')
+                return form
+
+            async with await self._request(
+                    'upload', 'POST',
+                    f"{self.base_url}/upload/image",
+                    data=make_form,
+                    timeout=aiohttp.ClientTimeout(total=60)  # 上传文件使用更长的超时时间
+            ) as response:
+                if response.status == 200:
+                    print(f"✅ 图片上传成功: {image_path}")
+                    return True
+                print(f"❌ 上传失败，状态码: {response.status}")
+                print(f"响应内容: {await response.text()}")
+                return False
+        except asyncio.TimeoutError:
+            print("❌ 上传超时，请检查网络连接或尝试更小的图片")
+            return False
+        except Exception as e:
+            print(f"❌ 上传图片失败: {e}")
+            return False
+
+    async def image_exists(self, filename: str) -> bool:
+        """通过HEAD /view检查服务器input目录中是否已有该文件"""
+        try:
+            async with await self._request('read', 'HEAD', f"{self.base_url}/view",
+                                           params={'filename': filename, 'type': 'input'},
+                                           timeout=aiohttp.ClientTimeout(total=10)) as response:
+                return response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+    async def ensure_image(self, image_path: str) -> Optional[str]:
+        """按内容哈希上传图片，服务器已有相同内容时跳过上传，返回服务器端文件名"""
+        if not os.path.exists(image_path):
+            print(f"图片文件不存在: {image_path}")
+            return None
+
+        cache = self.upload_cache
+        digest = await asyncio.to_thread(cache.digest if cache else file_digest, image_path)
+        filename = content_filename(digest, image_path)
+
+        async with self._upload_locks.setdefault(digest, asyncio.Lock()):
+            # 索引命中或其他客户端已上传过相同内容时，只需一次HEAD确认
+            known = cache.lookup(self.server_address, digest) if cache else None
+            if await self.image_exists(known or filename):
+                if cache and not known:
+                    cache.record(self.server_address, digest, filename)
+                return known or filename
+            if cache and known:
+                cache.forget(self.server_address, digest)
+
+            if not await self.upload_image(image_path, server_filename=filename, overwrite=True):
+                return None
+            if cache:
+                cache.record(self.server_address, digest, filename)
+            return filename
+
+    async def download_output(self, filename: str, output_path: str = "./output/",
+                              chunk_size: int = 1024 * 1024) -> Optional[str]:
+        """下载生成的输出文件，分块写入.part临时文件，中断时按download策略退避后Range续传"""
+        try:
+            os.makedirs(output_path, exist_ok=True)
+
+            url = f"{self.base_url}/view"
+            params = {'filename': filename, 'type': 'output'}
+            output_file = os.path.join(output_path, filename)
+            part_file = output_file + '.part'
+
+            max_attempts = self.retry_policies['download'].max_attempts
+            retry_statuses = self.retry_policies['download'].retry_statuses
+            self.retry_budget.deposit()
+            attempt = 1
+            while True:
+                offset = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+                headers = {'Range': f'bytes={offset}-'} if offset else {}
+                retry_after = None
+                try:
+                    # 大视频的整体下载时间不设上限，只限制连接和两次读取之间的间隔
+                    async with await self._send('download', 'GET', url, params=params, headers=headers,
+                                                timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.timeout,
+                                                                              sock_read=120)) as response:
+                        if response.status == 416:
+                            # 临时文件已完整
+                            break
+                        if response.status in retry_statuses:
+                            reason, retry_after = str(response.status), _retry_after(response)
+                            error = aiohttp.ClientResponseError(response.request_info, response.history,
+                                                                status=response.status, message=response.reason)
+                        else:
+                            response.raise_for_status()
+                            # 服务器不支持Range时返回200，需要从头写入
+                            mode = 'ab' if offset and response.status == 206 else 'wb'
+                            with open(part_file, mode) as f:
+                                async for chunk in response.content.iter_chunked(chunk_size):
+                                    f.write(chunk)
+                                    self.metrics.inc('comfyui_client_received_bytes_total', len(chunk),
+                                                     endpoint='/view')
+                            break
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    reason, error = _failure_reason(e), e
+                    if reason is None:
+                        raise
+
+                if not await self._retry_allowed('download', attempt, reason, url, retry_after):
+                    raise error
+                print(f"下载中断，准备续传 ({attempt}/{max_attempts}): {error}")
+                attempt += 1
+
+            os.replace(part_file, output_file)
+            print(f"文件已保存到: {output_file}")
+            return output_file
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"下载文件失败: {e}")
+            return None
+        except Exception as e:
+            print(f"下载文件时出错: {e}")
+            return None
+
+    async def close(self):
+        """关闭WebSocket监听任务和session，保存上传索引"""
+        if self._ws_task is not None and not self._ws_task.done():
+            self._ws_task.cancel()
+            try:
+                await self._ws_task
+            except asyncio.CancelledError:
+                pass
+        if self.session is not None:
+            await self.session.close()
+        if self.upload_cache:
+            self.upload_cache.save()
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+async def execute_workflow(
+        api: AsyncComfyUIAPI,
+        workflow_path: str,
+        image_path: Optional[str] = None,
+        updates: Optional[Dict[str, Any]] = None,
+        output_dir: str = "./output/",
+        wait_timeout: Optional[float] = None
+) -> Optional[str]:
+    """异步执行工作流，流程与main.execute_workflow一致"""
+
+    if not await api.test_connection():
+        print("无法连接到ComfyUI服务器")
+        return None
+
+    workflow = load_workflow_from_file(workflow_path)
+    updates = dict(updates) if updates else {}
+
+    if image_path:
+        image_filename = await api.ensure_image(image_path)
+        if not image_filename:
+            print("图片上传失败")
+            return None
+
+        # 查找LoadImage节点并更新
+        load_image_node = find_load_image_node(workflow)
+        if load_image_node:
+            updates[f'node_{load_image_node}_inputs_image'] = image_filename
+
+    if updates:
+        workflow = update_workflow_parameters(workflow, updates)
+
+    try:
+        result = await api.queue_prompt(workflow, output_dir=output_dir)
+        if 'prompt_id' not in result:
+            print(f"提交任务失败: {result}")
+            return None
+
+        prompt_id = result['prompt_id']
+        print(f"任务已提交，ID: {prompt_id}")
+        history = await api.wait_for_completion(prompt_id, timeout=wait_timeout)
+
+        filenames = collect_output_filenames(history)
+        output_files = await asyncio.gather(*(api.download_output(name, output_dir) for name in filenames))
+        if filenames and all(output_files):
+            api.mark_downloaded(prompt_id, output_files)
+        output_files = [path for path in output_files if path]
+
+        if output_files:
+            print(f"生成了 {len(output_files)} 个文件")
+            return output_files[0]  # 返回第一个文件
+        print("未找到生成的文件")
+        return None
+
+    except Exception as e:
+        print(f"执行工作流时出错: {e}")
+        return None
+
+
+async def execute_workflows(
+        api: AsyncComfyUIAPI,
+        jobs: List[Dict[str, Any]],
+        concurrency: int = 8
+) -> List[Optional[str]]:
+    """并发执行多个任务，最多concurrency个同时在途
+
+    jobs中每项为execute_workflow的关键字参数（workflow_path、image_path、updates等），
+    返回值与jobs一一对应。
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(job: Dict[str, Any]) -> Optional[str]:
+        async with semaphore:
+            return await execute_workflow(api, **job)
+
+    return await asyncio.gather(*(run(job) for job in jobs))
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+批量执行模式
+从JSONL任务文件读取任务，在一个进程内以固定的在途窗口提交，结果逐行写入JSONL，
+进程崩溃后重新运行会跳过已成功的任务。
+
+任务文件每行一个JSON对象，例如:
+  {"id": "girl-42", "updates": {"node_52_inputs_seed": 42}, "image": "my_image.png", "output": "./output/42/"}
+updates也可以写成命令行格式的列表: ["node_52_inputs_seed=42"]
+可选字段 workflow 覆盖命令行指定的工作流文件。
+"""
+
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import Future
+from typing import Optional, Dict, Any, Iterable, Iterator, List, Set
+
+from async_client import AsyncComfyUIAPI
+from journal import JobJournal, TERMINAL_STATES
+from metrics import Metrics
+from postprocess import PostProcessor
+from preprocess import ImagePreprocessor, target_size
+from result_cache import ResultCache, canonical_prompt_hash
+from upload_cache import UploadCache, file_digest, content_filename
+from main import (
+    collect_output_filenames,
+    find_load_image_node,
+    parse_updates,
+)
+from workflow_template import WorkflowTemplate
+
+
+def load_jobs(jobs_path: str) -> Iterator[Dict[str, Any]]:
+    """逐行读取任务，未指定id时使用行号
+
+    格式错误的行不中断整批任务：生成带invalid字段的任务（id为line-行号），由执行器记为失败。
+    """
+    with open(jobs_path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                job = json.loads(line)
+                if not isinstance(job, dict):
+                    raise ValueError("应为JSON对象")
+                job['id'] = str(job.get('id') or job.get('job_id') or f"line-{line_no}")
+                updates = job.get('updates') or {}
+                if isinstance(updates, list):
+                    updates = parse_updates(updates)
+                job['updates'] = updates
+            except ValueError as e:
+                # json.JSONDecodeError也是ValueError
+                message = f"任务文件第 {line_no} 行格式错误: {e}"
+                print(f"⚠️  {message}")
+                job = {'id': f"line-{line_no}", 'updates': {}, 'invalid': message}
+            yield job
+
+
+def load_completed_ids(results_path: str) -> Set[str]:
+    """读取结果文件中已成功的任务ID，用于断点续跑"""
+    completed = set()
+    if not os.path.exists(results_path):
+        return completed
+    with open(results_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 崩溃时可能留下半行
+            if record.get('status') == 'success':
+                completed.add(record['id'])
+    return completed
+
+
+def write_result(f, record: Dict[str, Any]):
+    """追加一行结果并落盘"""
+    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    f.flush()
+    os.fsync(f.fileno())
+
+
+class BatchRunner:
+    """在一个事件循环内驱动整批任务"""
+
+    def __init__(self, api, workflow_path: str, results_path: str,
+                 output_dir: str = "./output/", max_in_flight: int = 4,
+                 wait_timeout: Optional[float] = None, result_cache: Optional[ResultCache] = None,
+                 postprocessor: Optional[PostProcessor] = None,
+                 image_preprocessor: Optional[ImagePreprocessor] = None,
+                 object_info: Optional[Dict[str, Any]] = None):
+        self.api = api
+        self.workflow_path = workflow_path
+        self.results_path = results_path
+        self.output_dir = output_dir
+        self.max_in_flight = max_in_flight
+        self.wait_timeout = wait_timeout
+        self.result_cache = result_cache
+        self.postprocessor = postprocessor
+        self.image_preprocessor = image_preprocessor
+        self.object_info = object_info
+        self._templates: Dict[str, WorkflowTemplate] = {}
+        # 任务日志中本服务器上按job_id记录的提交，重新运行时接上而不是重复提交
+        self._journaled: Dict[str, Dict[str, Any]] = {}
+        self.succeeded = 0
+        self.failed = 0
+
+    def _get_template(self, workflow_path: str) -> WorkflowTemplate:
+        """每个工作流文件只解析、编译一次"""
+        if workflow_path not in self._templates:
+            self._templates[workflow_path] = WorkflowTemplate.from_file(workflow_path, object_info=self.object_info)
+        return self._templates[workflow_path]
+
+    async def _find_previous(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """进程退出前提交过、仍可接上的任务日志记录；服务器上已不存在时返回None
+
+        无法确认服务器上是否还有该任务时抛出异常，任务记为失败，避免重复生成。
+        """
+        entry = self._journaled.pop(job_id, None)
+        if entry is None:
+            return None
+        if entry.get('state') == 'downloaded':
+            outputs = entry.get('outputs') or []
+            return entry if outputs and all(os.path.exists(path) for path in outputs) else None
+        if entry.get('state') in TERMINAL_STATES:
+            return None
+        found = await self.api.find_prompt(entry['prompt_id'])
+        if found is None:
+            raise RuntimeError(f"无法确认服务器上是否仍有上次提交的任务 {entry['prompt_id']}")
+        if not found:
+            print(f"⚠️  [{job_id}] 服务器上找不到上次提交的任务 {entry['prompt_id']}，重新提交")
+            self.api.journal.record(entry['prompt_id'], 'lost')
+            return None
+        return entry
+
+    async def run_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """执行单个任务并记录各阶段耗时"""
+        timings = {}
+        record = {'id': job['id'], 'status': 'failed', 'prompt_id': None, 'outputs': [], 'error': None}
+        if 'params' in job:
+            record['params'] = job['params']
+        started = time.perf_counter()
+        stage_started = started
+        trace_id = job['id']
+
+        def mark(stage, record_span=True):
+            nonlocal stage_started
+            now = time.perf_counter()
+            timings[stage] = round(now - stage_started, 3)
+            if record_span:
+                self.api.metrics.record_span(stage, stage_started, now - stage_started, trace_id)
+            stage_started = now
+
+        try:
+            if job.get('invalid'):
+                raise ValueError(job['invalid'])
+            template = self._get_template(job.get('workflow') or self.workflow_path)
+            updates = dict(job['updates'])
+            # 提前校验更新键，无效任务不占用上传和队列
+            for key in updates:
+                template.slot(key)
+
+            # 图片按内容哈希命名，上传前即可生成最终prompt
+            image_path = job.get('image')
+            image_digest = None
+            if image_path and self.image_preprocessor:
+                image_path = await asyncio.to_thread(self.image_preprocessor.prepare, image_path,
+                                                     target_size(template.workflow, updates))
+            if image_path:
+                upload_cache = self.api.upload_cache
+                image_digest = await asyncio.to_thread(upload_cache.digest if upload_cache else file_digest,
+                                                       image_path)
+                load_image_node = find_load_image_node(template.workflow)
+                if load_image_node:
+                    updates[f'node_{load_image_node}_inputs_image'] = content_filename(image_digest, image_path)
+            prompt = template.render(updates)
+
+            output_dir = job.get('output') or self.output_dir
+            previous = await self._find_previous(job['id'])
+            if previous and previous.get('state') == 'downloaded':
+                # 上次运行已下载完输出，只是结果没来得及写入
+                record.update(status='success', prompt_id=previous['prompt_id'], outputs=previous['outputs'],
+                              resumed=True)
+                mark('resume')
+                return record
+
+            cache_key = None
+            if self.result_cache:
+                cache_key = canonical_prompt_hash(prompt, [image_digest] if image_digest else [])
+                cached_files = None if previous else await asyncio.to_thread(self.result_cache.lookup,
+                                                                             cache_key, output_dir)
+                if cached_files:
+                    record.update(status='success', outputs=cached_files, cached=True)
+                    mark('cache')
+                    return record
+
+            if previous:
+                # 上次运行提交的任务仍在服务器上，接上等待，不重复提交
+                record.update(prompt_id=previous['prompt_id'], resumed=True)
+                print(f"[{job['id']}] 接上进程退出前提交的任务 {record['prompt_id']}")
+            else:
+                if image_path and not await self.api.ensure_image(image_path):
+                    raise RuntimeError(f"图片上传失败: {image_path}")
+                mark('upload')
+
+                result = await self.api.queue_prompt(
+                    prompt, output_dir=output_dir, prompt_json=template.encode(prompt),
+                    journal_fields={'job_id': job['id'], 'results_path': os.path.abspath(self.results_path)})
+                if 'prompt_id' not in result:
+                    raise RuntimeError(f"提交任务失败: {result}")
+                record['prompt_id'] = result['prompt_id']
+                mark('queue')
+
+            # 接上的任务由已退出的客户端提交，收不到它的WebSocket事件
+            history = await self.api.wait_for_completion(record['prompt_id'], timeout=self.wait_timeout,
+                                                         events=not previous)
+            # 排队和执行耗时由wait_for_completion记录到metrics
+            mark('wait', record_span=False)
+            nodes = self.api.pop_node_profile(record['prompt_id'])
+            if nodes:
+                record['nodes'] = nodes
+
+            filenames = collect_output_filenames(history)
+            paths = await asyncio.gather(*(self.api.download_output(name, output_dir) for name in filenames))
+            record['outputs'] = [path for path in paths if path]
+            mark('download')
+
+            if len(record['outputs']) != len(filenames) or not filenames:
+                raise RuntimeError("未找到生成的文件或部分文件下载失败")
+            self.api.mark_downloaded(record['prompt_id'], record['outputs'])
+            record['status'] = 'success'
+            if self.result_cache:
+                await asyncio.to_thread(self.result_cache.store, cache_key, record['outputs'])
+        except Exception as e:
+            record['error'] = str(e)
+        finally:
+            elapsed = time.perf_counter() - started
+            timings['total'] = round(elapsed, 3)
+            record['timings'] = timings
+            self.api.metrics.record_span('total', started, elapsed, trace_id, status=record['status'])
+        return record
+
+    async def _finish_postprocess(self, f, record: Dict[str, Any], futures: List[Future]):
+        """后处理完成后再写结果，续跑时未完成后处理的任务会重新执行"""
+        results = await asyncio.gather(*(asyncio.wrap_future(future) for future in futures),
+                                       return_exceptions=True)
+        record['postprocess'] = [
+            result if isinstance(result, dict) else {'error': str(result)} for result in results
+        ]
+        errors = [result['error'] for result in record['postprocess'] if result.get('error')]
+        if errors:
+            record.update(status='failed', error=f"后处理失败: {'; '.join(errors)}")
+        else:
+            record['outputs'] = [result['path'] for result in record['postprocess']]
+        self._write_result(f, record)
+
+    def _write_result(self, f, record: Dict[str, Any]):
+        """逐行追加结果并落盘，保证崩溃后可续跑"""
+        write_result(f, record)
+        if record['status'] == 'success':
+            self.succeeded += 1
+            print(f"✅ [{record['id']}] 完成，用时 {record['timings']['total']}s")
+        else:
+            self.failed += 1
+            print(f"❌ [{record['id']}] 失败: {record['error']}")
+
+    async def run(self, jobs_path: str) -> int:
+        """执行任务文件中的全部任务，返回失败任务数"""
+        return await self.run_jobs(load_jobs(jobs_path))
+
+    async def run_jobs(self, jobs: Iterable[Dict[str, Any]]) -> int:
+        """按需从任务迭代器取任务执行（不预先展开），返回失败任务数"""
+        completed = load_completed_ids(self.results_path)
+        skipped = 0
+        if self.api.journal:
+            results_path = os.path.abspath(self.results_path)
+            self._journaled = {job_id: entry for job_id, entry in self.api.journal.jobs(self.api.base_url).items()
+                               if job_id not in completed and entry.get('results_path') == results_path}
+
+        def pending_jobs(all_jobs):
+            nonlocal skipped
+            for job in all_jobs:
+                if job['id'] in completed:
+                    skipped += 1
+                    continue
+                yield job
+
+        jobs = pending_jobs(jobs)
+
+        results_dir = os.path.dirname(self.results_path)
+        if results_dir:
+            os.makedirs(results_dir, exist_ok=True)
+
+        with open(self.results_path, 'a', encoding='utf-8') as f:
+            postprocessing = []
+
+            async def worker():
+                # 多个worker共享同一个任务迭代器，在途任务数不超过max_in_flight
+                for job in jobs:
+                    record = await self.run_job(job)
+                    # 命中结果缓存的输出与新生成的一样经过后处理（如store到存储目录）
+                    if self.postprocessor and record['status'] == 'success':
+                        # 后处理不占用在途窗口；进程池积压时submit阻塞，worker暂停提交新任务
+                        futures = [await asyncio.to_thread(self.postprocessor.submit, path)
+                                   for path in record['outputs']]
+                        postprocessing.append(asyncio.ensure_future(self._finish_postprocess(f, record, futures)))
+                    else:
+                        self._write_result(f, record)
+
+            await asyncio.gather(*(worker() for _ in range(self.max_in_flight)))
+            await asyncio.gather(*postprocessing)
+
+        if skipped:
+            print(f"跳过已完成的任务: {skipped} 个")
+        print(f"批量执行结束: 成功 {self.succeeded} 个，失败 {self.failed} 个")
+        return self.failed
+
+
+async def run_batch(
+        server_address: str,
+        jobs_path: str,
+        workflow_path: str,
+        results_path: str,
+        output_dir: str = "./output/",
+        max_in_flight: int = 4,
+        timeout: int = 30,
+        wait_timeout: Optional[float] = None,
+        use_websocket: bool = True,
+        upload_cache: Optional[UploadCache] = None,
+        result_cache: Optional[ResultCache] = None,
+        metrics: Optional[Metrics] = None,
+        journal: Optional[JobJournal] = None,
+        postprocessor: Optional[PostProcessor] = None,
+        image_preprocessor: Optional[ImagePreprocessor] = None,
+        object_info: Optional[Dict[str, Any]] = None,
+        compress_requests: bool = False
+) -> int:
+    """连接服务器并执行整批任务，返回退出码"""
+    async with AsyncComfyUIAPI(server_address, timeout=timeout, use_websocket=use_websocket,
+                               max_connections=max(max_in_flight * 2, 10),
+                               upload_cache=upload_cache, metrics=metrics, journal=journal,
+                               compress_requests=compress_requests) as api:
+        if not await api.test_connection():
+            print("无法连接到ComfyUI服务器")
+            return 1
+
+        runner = BatchRunner(api, workflow_path, results_path, output_dir=output_dir,
+                             max_in_flight=max_in_flight, wait_timeout=wait_timeout,
+                             result_cache=result_cache, postprocessor=postprocessor,
+                             image_preprocessor=image_preprocessor, object_info=object_info)
+        failed = await runner.run(jobs_path)
+        return 0 if failed == 0 else 1
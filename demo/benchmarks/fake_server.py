@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+模拟的ComfyUI服务器，用于客户端压测
+实现 /prompt、/queue、/history、/history/{id}、/upload/image、/view、/ws、/interrupt，
+执行耗时、输出文件大小和并行执行的"GPU"数量均可配置。
+
+用法（在demo目录下）:
+  python benchmarks/fake_server.py --port 8188 --delay 2 --output-size 5000000
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from typing import Optional, Dict, Any, List
+
+from aiohttp import web
+
+
+class FakeComfyUI:
+    """按ComfyUI的事件顺序模拟执行：execution_start → executing(各节点) → progress →
+    executed → execution_success → 写入history → executing(node=None)"""
+
+    def __init__(self, delay: float = 1.0, output_size: int = 1024 * 1024, workers: int = 1,
+                 steps: int = 4):
+        self.delay = delay
+        self.output_size = output_size
+        self.workers = workers
+        self.steps = steps
+        self.queue: List[Dict[str, Any]] = []
+        self.running: Dict[str, Dict[str, Any]] = {}
+        self.history: Dict[str, Dict[str, Any]] = {}
+        self.uploads: Dict[str, bytes] = {}
+        self.sockets: Dict[str, web.WebSocketResponse] = {}
+        self.number = 0
+        self.requests = 0
+        self._work_available: Optional[asyncio.Condition] = None
+        self._output_data = bytes(range(256)) * (output_size // 256) + bytes(output_size % 256)
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=1024 ** 3, middlewares=[self._count_requests])
+        app.router.add_get('/queue', self.handle_queue)
+        app.router.add_post('/queue', self.handle_queue_delete)
+        app.router.add_post('/prompt', self.handle_prompt)
+        app.router.add_get('/history', self.handle_history_all)
+        app.router.add_get('/history/{prompt_id}', self.handle_history)
+        app.router.add_post('/upload/image', self.handle_upload)
+        app.router.add_get('/view', self.handle_view)
+        app.router.add_post('/interrupt', self.handle_interrupt)
+        app.router.add_get('/ws', self.handle_ws)
+        app.on_startup.append(self._start_workers)
+        return app
+
+    @web.middleware
+    async def _count_requests(self, request, handler):
+        self.requests += 1
+        return await handler(request)
+
+    async def _start_workers(self, app):
+        self._work_available = asyncio.Condition()
+        for _ in range(self.workers):
+            asyncio.ensure_future(self._worker())
+
+    async def _send(self, client_id: Optional[str], event_type: str, data: Dict[str, Any]):
+        ws = self.sockets.get(client_id)
+        if ws is not None and not ws.closed:
+            try:
+                await ws.send_str(json.dumps({'type': event_type, 'data': data}))
+            except ConnectionError:
+                pass
+
+    async def _worker(self):
+        while True:
+            async with self._work_available:
+                await self._work_available.wait_for(lambda: self.queue)
+                item = self.queue.pop(0)
+            await self._execute(item)
+
+    async def _execute(self, item: Dict[str, Any]):
+        prompt_id, client_id, prompt = item['prompt_id'], item['client_id'], item['prompt']
+        self.running[prompt_id] = item
+        base = {'prompt_id': prompt_id}
+        await self._send(client_id, 'execution_start', dict(base, timestamp=int(time.time() * 1000)))
+        await self._send(client_id, 'execution_cached', dict(base, nodes=[]))
+        interrupted = False
+        for node_id in prompt:
+            await self._send(client_id, 'executing', dict(base, node=node_id, display_node=node_id))
+        for step in range(1, self.steps + 1):
+            await asyncio.sleep(self.delay / self.steps)
+            if item.get('interrupted'):
+                interrupted = True
+                break
+            await self._send(client_id, 'progress', dict(base, value=step, max=self.steps, node=None))
+        self.running.pop(prompt_id, None)
+
+        if interrupted:
+            await self._send(client_id, 'execution_interrupted', dict(base, node_id=None, executed=[]))
+            self.history[prompt_id] = {'prompt': [item['number'], prompt_id, prompt, {}, []], 'outputs': {},
+                                       'status': {'status_str': 'error', 'completed': False, 'messages': []}}
+            return
+
+        outputs = {}
+        for node_id, node in prompt.items():
+            if str(node.get('class_type', '')).startswith(('VHS_VideoCombine', 'SaveImage')):
+                prefix = node.get('inputs', {}).get('filename_prefix', 'ComfyUI')
+                filename = f"{prefix}_{prompt_id[:8]}.mp4"
+                key = 'gifs' if node['class_type'].startswith('VHS') else 'images'
+                outputs[node_id] = {key: [{'filename': filename, 'subfolder': '', 'type': 'output'}]}
+                await self._send(client_id, 'executed', dict(base, node=node_id, output=outputs[node_id]))
+        if not outputs:
+            filename = f"ComfyUI_{prompt_id[:8]}.png"
+            outputs['0'] = {'images': [{'filename': filename, 'subfolder': '', 'type': 'output'}]}
+
+        await self._send(client_id, 'execution_success', dict(base, timestamp=int(time.time() * 1000)))
+        self.history[prompt_id] = {
+            'prompt': [item['number'], prompt_id, prompt, {}, list(outputs)],
+            'outputs': outputs,
+            'status': {'status_str': 'success', 'completed': True, 'messages': []},
+        }
+        await self._send(client_id, 'executing', dict(base, node=None))
+
+    def _queue_entry(self, item):
+        return [item['number'], item['prompt_id'], item['prompt'], {'client_id': item['client_id']}, []]
+
+    async def handle_queue(self, request):
+        return web.json_response({
+            'queue_running': [self._queue_entry(item) for item in self.running.values()],
+            'queue_pending': [self._queue_entry(item) for item in self.queue],
+        })
+
+    async def handle_queue_delete(self, request):
+        body = await request.json()
+        if body.get('clear'):
+            self.queue.clear()
+        delete = set(body.get('delete', []))
+        self.queue[:] = [item for item in self.queue if item['prompt_id'] not in delete]
+        return web.Response(status=200)
+
+    async def handle_prompt(self, request):
+        body = await request.json()
+        prompt_id = body.get('prompt_id') or str(uuid.uuid4())
+        self.number += 1
+        item = {'prompt_id': prompt_id, 'client_id': body.get('client_id'), 'prompt': body['prompt'],
+                'number': self.number}
+        async with self._work_available:
+            if body.get('front'):
+                self.queue.insert(0, item)
+            else:
+                self.queue.append(item)
+            self._work_available.notify()
+        return web.json_response({'prompt_id': prompt_id, 'number': self.number, 'node_errors': {}})
+
+    async def handle_history(self, request):
+        prompt_id = request.match_info['prompt_id']
+        if prompt_id in self.history:
+            return web.json_response({prompt_id: self.history[prompt_id]})
+        return web.json_response({})
+
+    async def handle_history_all(self, request):
+        max_items = request.query.get('max_items')
+        items = list(self.history.items())
+        if max_items:
+            items = items[-int(max_items):]
+        return web.json_response(dict(items))
+
+    async def handle_upload(self, request):
+        form = await request.post()
+        image = form['image']
+        self.uploads[image.filename] = image.file.read()
+        return web.json_response({'name': image.filename, 'subfolder': '', 'type': 'input'})
+
+    async def handle_view(self, request):
+        filename = request.query.get('filename', '')
+        if request.query.get('type') == 'input':
+            if filename not in self.uploads:
+                raise web.HTTPNotFound()
+            data = self.uploads[filename]
+        else:
+            data = self._output_data
+
+        range_header = request.headers.get('Range')
+        if range_header and range_header.startswith('bytes='):
+            start = int(range_header[len('bytes='):].split('-')[0])
+            if start >= len(data):
+                raise web.HTTPRequestRangeNotSatisfiable()
+            return web.Response(status=206, body=data[start:],
+                                headers={'Content-Range': f'bytes {start}-{len(data) - 1}/{len(data)}'})
+        return web.Response(body=data, headers={'Accept-Ranges': 'bytes'})
+
+    async def handle_interrupt(self, request):
+        body = await request.json() if request.can_read_body else {}
+        target = body.get('prompt_id')
+        for prompt_id, item in self.running.items():
+            if target is None or target == prompt_id:
+                item['interrupted'] = True
+        return web.Response(status=200)
+
+    async def handle_ws(self, request):
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        client_id = request.query.get('clientId') or uuid.uuid4().hex
+        self.sockets[client_id] = ws
+        await ws.send_str(json.dumps({'type': 'status', 'data': {
+            'status': {'exec_info': {'queue_remaining': len(self.queue) + len(self.running)}}, 'sid': client_id}}))
+        async for _ in ws:
+            pass
+        if self.sockets.get(client_id) is ws:
+            del self.sockets[client_id]
+        return ws
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟的ComfyUI服务器")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8188)
+    parser.add_argument('--delay', type=float, default=1.0, help='每个任务的执行耗时(秒)')
+    parser.add_argument('--output-size', type=int, default=1024 * 1024, help='输出文件大小(字节)')
+    parser.add_argument('--workers', type=int, default=1, help='并行执行的任务数（模拟GPU数量）')
+    args = parser.parse_args()
+
+    server = FakeComfyUI(delay=args.delay, output_size=args.output_size, workers=args.workers)
+    web.run_app(server.build_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+客户端压测
+启动 fake_server.py 子进程（或指定 --server 压测已有服务器），分别以同步客户端（多线程）、
+异步客户端和批量模式在不同并发下执行任务，报告吞吐、延迟分位数、客户端CPU/内存占用以及每个任务的收发字节数。
+
+用法（在demo目录下）:
+  python benchmarks/load_test.py --jobs 200 --concurrency 1,8,32 --delay 0.5
+  python benchmarks/load_test.py --modes async --concurrency 64 --output-size 20000000 --json result.json
+  python benchmarks/load_test.py --modes batch --long-prompts --compress
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEMO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, DEMO_DIR)
+
+from main import ComfyUIAPI, execute_workflow  # noqa: E402
+from async_client import AsyncComfyUIAPI, execute_workflow as async_execute_workflow  # noqa: E402
+from batch import BatchRunner  # noqa: E402
+from metrics import Metrics  # noqa: E402
+
+DEFAULT_WORKFLOW = os.path.join(DEMO_DIR, 'workflows', 'text_to_video_workflow.json')
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def rss_mb() -> float:
+    """当前进程的常驻内存(MB)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def start_fake_server(delay: float, output_size: int, workers: int) -> (subprocess.Popen, str):
+    """在子进程中启动模拟服务器，避免服务器的CPU计入客户端"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    process = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, 'fake_server.py'), '--port', str(port),
+        '--delay', str(delay), '--output-size', str(output_size), '--workers', str(workers),
+    ])
+    address = f"127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(f"http://{address}/queue", timeout=1)
+            return process, address
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("模拟服务器启动失败")
+
+
+# 模拟批量生产中的长提示词（数KB），每个任务只改末尾的编号
+LONG_PROMPT = " ".join([
+    "A beautiful anime girl with long flowing black hair and captivating brown eyes,",
+    "wearing an elegant black dress with a choker necklace, standing in an ornate vintage room.",
+] * 40)
+
+
+def job_updates(i: int, long_prompts: bool = False) -> Dict[str, Any]:
+    updates = {'node_27_inputs_seed': i, 'node_30_inputs_filename_prefix': f'bench_{i}'}
+    if long_prompts:
+        updates['node_16_inputs_positive_prompt'] = f"{LONG_PROMPT} #{i}"
+    return updates
+
+
+def run_sync(server: str, jobs: int, concurrency: int, workflow: str, output_dir: str,
+             client_kwargs: Dict[str, Any], long_prompts: bool) -> List[Optional[float]]:
+    """同步客户端：线程池中共享一个ComfyUIAPI"""
+    api = ComfyUIAPI(server, **client_kwargs)
+    api.session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency * 2))
+
+    def one(i):
+        start = time.perf_counter()
+        ok = execute_workflow(api, workflow, updates=job_updates(i, long_prompts), output_dir=output_dir)
+        return time.perf_counter() - start if ok else None
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(one, range(jobs)))
+    finally:
+        api.close()
+
+
+def run_async(server: str, jobs: int, concurrency: int, workflow: str, output_dir: str,
+              client_kwargs: Dict[str, Any], long_prompts: bool) -> List[Optional[float]]:
+    """异步客户端：一个事件循环，信号量限制并发"""
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+        async with AsyncComfyUIAPI(server, max_connections=concurrency * 2, **client_kwargs) as api:
+            async def one(i):
+                async with semaphore:
+                    start = time.perf_counter()
+                    ok = await async_execute_workflow(api, workflow, updates=job_updates(i, long_prompts),
+                                                      output_dir=output_dir)
+                    return time.perf_counter() - start if ok else None
+
+            return await asyncio.gather(*(one(i) for i in range(jobs)))
+
+    return asyncio.run(main())
+
+
+def run_batch_mode(server: str, jobs: int, concurrency: int, workflow: str, output_dir: str,
+                   client_kwargs: Dict[str, Any], long_prompts: bool) -> List[Optional[float]]:
+    """批量模式：JSONL任务文件 + BatchRunner"""
+    jobs_path = os.path.join(output_dir, 'jobs.jsonl')
+    results_path = os.path.join(output_dir, 'results.jsonl')
+    with open(jobs_path, 'w', encoding='utf-8') as f:
+        for i in range(jobs):
+            f.write(json.dumps({'id': f'bench-{i}', 'updates': job_updates(i, long_prompts)}) + '\n')
+
+    async def main():
+        async with AsyncComfyUIAPI(server, max_connections=concurrency * 2, **client_kwargs) as api:
+            runner = BatchRunner(api, workflow, results_path, output_dir=output_dir, max_in_flight=concurrency)
+            await runner.run(jobs_path)
+
+    asyncio.run(main())
+    latencies = []
+    with open(results_path, encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            latencies.append(record['timings']['total'] if record['status'] == 'success' else None)
+    return latencies
+
+
+MODES = {'sync': run_sync, 'async': run_async, 'batch': run_batch_mode}
+
+
+def measure(mode: str, server: str, jobs: int, concurrency: int, workflow: str,
+            compress: bool = False, long_prompts: bool = False) -> Dict[str, Any]:
+    """执行一轮压测并统计结果"""
+    metrics = Metrics()
+    client_kwargs = {'metrics': metrics, 'compress_requests': compress}
+    with tempfile.TemporaryDirectory(prefix='comfyui-bench-') as output_dir:
+        peak_rss = [rss_mb()]
+        stop = threading.Event()
+
+        def sample_rss():
+            while not stop.wait(0.05):
+                peak_rss[0] = max(peak_rss[0], rss_mb())
+
+        sampler = threading.Thread(target=sample_rss, daemon=True)
+        sampler.start()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        # 客户端打印的状态信息不计入终端输出
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            latencies = MODES[mode](server, jobs, concurrency, workflow, output_dir, client_kwargs, long_prompts)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        stop.set()
+        sampler.join()
+
+    succeeded = [latency for latency in latencies if latency is not None]
+    return {
+        'mode': mode,
+        'concurrency': concurrency,
+        'jobs': jobs,
+        'failed': len(latencies) - len(succeeded),
+        'jobs_per_sec': len(succeeded) / wall if wall else 0.0,
+        'p50': percentile(succeeded, 0.5),
+        'p95': percentile(succeeded, 0.95),
+        'p99': percentile(succeeded, 0.99),
+        'cpu_sec': cpu,
+        'cpu_ms_per_job': cpu / max(len(succeeded), 1) * 1000,
+        'peak_rss_mb': peak_rss[0],
+        'sent_kb_per_job': metrics.counter_totals('comfyui_client_sent_bytes_total').get((), 0.0) / 1024 / jobs,
+        'received_kb_per_job': metrics.counter_totals('comfyui_client_received_bytes_total').get((), 0.0) / 1024 / jobs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ComfyUI客户端压测")
+    parser.add_argument('--server', help='压测已有服务器；不指定时启动模拟服务器')
+    parser.add_argument('-w', '--workflow', default=DEFAULT_WORKFLOW)
+    parser.add_argument('--jobs', type=int, default=100, help='每轮任务数')
+    parser.add_argument('--concurrency', default='1,8,32', help='并发数列表，逗号分隔')
+    parser.add_argument('--modes', default='sync,async,batch', help='客户端模式: sync,async,batch')
+    parser.add_argument('--delay', type=float, default=0.5, help='模拟服务器每个任务的执行耗时(秒)')
+    parser.add_argument('--output-size', type=int, default=1024 * 1024, help='模拟输出文件大小(字节)')
+    parser.add_argument('--server-workers', type=int, default=64,
+                        help='模拟服务器并行执行数，足够大时瓶颈在客户端')
+    parser.add_argument('--compress', action='store_true', help='客户端gzip压缩提交的工作流')
+    parser.add_argument('--long-prompts', action='store_true', help='每个任务使用数KB的正向提示词')
+    parser.add_argument('--json', help='将结果写入JSON文件，便于对比回归')
+    args = parser.parse_args()
+
+    process = None
+    server = args.server
+    if not server:
+        process, server = start_fake_server(args.delay, args.output_size, args.server_workers)
+        print(f"模拟服务器: {server} (delay={args.delay}s, output={args.output_size}B, "
+              f"workers={args.server_workers})")
+
+    results = []
+    try:
+        for mode in args.modes.split(','):
+            for concurrency in (int(c) for c in args.concurrency.split(',')):
+                result = measure(mode, server, args.jobs, concurrency, args.workflow,
+                                 compress=args.compress, long_prompts=args.long_prompts)
+                results.append(result)
+                print(f"{mode:<6} c={concurrency:<4} {result['jobs_per_sec']:8.2f} jobs/s  "
+                      f"p50={result['p50']:.3f}s p95={result['p95']:.3f}s p99={result['p99']:.3f}s  "
+                      f"cpu={result['cpu_ms_per_job']:.1f}ms/job  rss={result['peak_rss_mb']:.0f}MB  "
+                      f"sent={result['sent_kb_per_job']:.1f}KB/job  recv={result['received_kb_per_job']:.0f}KB/job  "
+                      f"failed={result['failed']}")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"结果已写入: {args.json}")
+    return 0 if all(result['failed'] == 0 for result in results) else 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+工作流参数更新微基准
+对比 update_workflow_parameters（整体深拷贝）与 WorkflowTemplate.render（只复制修改的节点）的单任务耗时，
+以及 json.dumps 与 WorkflowTemplate.encode（复用未修改节点和重复提示词的JSON片段）的序列化耗时和请求体大小
+
+用法（在demo目录下）:
+  python benchmarks/template_bench.py --jobs 20000
+"""
+
+import argparse
+import contextlib
+import gzip
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import load_workflow_from_file, update_workflow_parameters, dumps_compact  # noqa: E402
+from workflow_template import WorkflowTemplate  # noqa: E402
+
+DEMO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 与text_to_video_example.py相当长度的提示词
+POSITIVE_PROMPT = " ".join([
+    "A beautiful anime girl with long flowing black hair and captivating brown eyes,",
+    "wearing an elegant black dress with a choker necklace, standing in an ornate vintage room.",
+] * 20)
+NEGATIVE_PROMPT = "bad quality video, blurry, distorted face, deformed hands, choppy animation, " * 10
+
+
+def job_updates(i: int):
+    """text_to_video_workflow.json中典型的单任务更新"""
+    return {
+        'node_16_inputs_positive_prompt': POSITIVE_PROMPT,
+        'node_16_inputs_negative_prompt': NEGATIVE_PROMPT,
+        'node_27_inputs_seed': i,
+        'node_27_inputs_steps': 15,
+        'node_27_inputs_cfg': 7.5,
+        'node_37_inputs_width': 720,
+        'node_37_inputs_height': 1024,
+        'node_30_inputs_filename_prefix': f'bench_{i}',
+    }
+
+
+def measure(render, jobs: int) -> float:
+    """返回平均每个任务的耗时(微秒)"""
+    start = time.perf_counter()
+    for i in range(jobs):
+        render(job_updates(i))
+    return (time.perf_counter() - start) / jobs * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="工作流参数更新微基准")
+    parser.add_argument('-w', '--workflow',
+                        default=os.path.join(DEMO_DIR, 'workflows', 'text_to_video_workflow.json'))
+    parser.add_argument('--jobs', type=int, default=20000)
+    args = parser.parse_args()
+
+    workflow = load_workflow_from_file(args.workflow)
+    template = WorkflowTemplate(workflow, job_updates(0).keys())
+
+    # update_workflow_parameters每次更新都会打印，计时时丢弃输出
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        baseline = measure(lambda updates: update_workflow_parameters(workflow, updates), args.jobs)
+    compiled = measure(template.render, args.jobs)
+
+    print(f"任务数: {args.jobs}")
+    print(f"update_workflow_parameters: {baseline:8.2f} µs/任务")
+    print(f"WorkflowTemplate.render:    {compiled:8.2f} µs/任务")
+    print(f"加速比: {baseline / compiled:.1f}x")
+
+    # 序列化：预先渲染，只计时编码本身
+    prompts = [template.render(job_updates(i)) for i in range(min(args.jobs, 2000))]
+    start = time.perf_counter()
+    for prompt in prompts:
+        json.dumps(prompt)
+    dumps_time = (time.perf_counter() - start) / len(prompts) * 1e6
+    start = time.perf_counter()
+    for prompt in prompts:
+        template.encode(prompt)
+    encode_time = (time.perf_counter() - start) / len(prompts) * 1e6
+    print(f"json.dumps:                 {dumps_time:8.2f} µs/任务")
+    print(f"WorkflowTemplate.encode:    {encode_time:8.2f} µs/任务")
+
+    sample = prompts[-1]
+    print(f"请求体大小: json.dumps {len(json.dumps(sample).encode())}B, "
+          f"紧凑 {len(dumps_compact(sample))}B, gzip {len(gzip.compress(template.encode(sample), 5))}B")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+多工作流串联（DAG）
+上游阶段的输出直接作为下游工作流LoadImage节点的输入：LoadImage接受 "文件名 [output]" 形式的
+服务器端引用，从服务器的输出目录读取，中间结果不需要下载到客户端再上传回同一台服务器。
+因此整条链在同一个服务器上执行；互不依赖的阶段并发提交，其余阶段在上游完成后立即提交。
+
+串联文件为JSON，例如:
+  {"stages": [
+    {"id": "still", "workflow": "workflows/text_to_image.json", "updates": {"node_3_inputs_seed": 42}},
+    {"id": "video", "workflow": "workflows/image_to_video_workflow.json", "image_from": "still"},
+    {"id": "video-7", "workflow": "workflows/image_to_video_workflow.json",
+     "inputs": {"node_42_inputs_image": {"stage": "still", "index": 0}}, "updates": ["node_52_inputs_seed=7"]}
+  ]}
+image_from 把上游的第一个输出填入工作流的第一个LoadImage节点；inputs 按更新键指定上游输出，
+取值为阶段ID（第一个输出）或 {"stage": 阶段ID, "index": 第几个输出}；after 列出没有数据传递、
+只需先完成的阶段。image 为本地输入图片，按内容哈希上传一次。
+默认只下载没有下游阶段的输出，download 为true/false时覆盖；output 覆盖输出目录。
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Optional, Dict, Any, List, Tuple
+
+import aiohttp
+
+from async_client import AsyncComfyUIAPI
+from journal import JobJournal
+from metrics import Metrics
+from upload_cache import UploadCache
+from main import collect_output_files, find_load_image_node, parse_updates
+from workflow_template import WorkflowTemplate
+
+
+def output_reference(file_info: Dict[str, Any]) -> str:
+    """history中的输出文件 -> LoadImage可直接读取的服务器端引用，如 "sub/ComfyUI_00001_.png [output]" """
+    name = file_info['filename']
+    if file_info.get('subfolder'):
+        name = f"{file_info['subfolder']}/{name}"
+    return f"{name} [{file_info.get('type') or 'output'}]"
+
+
+def _parse_source(value: Any, where: str) -> Tuple[str, int]:
+    """inputs的取值: 阶段ID 或 {"stage": 阶段ID, "index": n}"""
+    if isinstance(value, str):
+        return value, 0
+    if isinstance(value, dict) and isinstance(value.get('stage'), str):
+        index = value.get('index', 0)
+        if isinstance(index, int) and not isinstance(index, bool) and index >= 0:
+            return value['stage'], index
+    raise ValueError(f"{where} 应为阶段ID或 {{\"stage\": 阶段ID, \"index\": n}}: {value!r}")
+
+
+def load_chain(chain_path: str) -> List[Dict[str, Any]]:
+    """读取串联文件并按依赖关系排序，阶段ID重复、引用不存在的阶段或有环时抛出ValueError"""
+    with open(chain_path, 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+    stages = spec.get('stages') if isinstance(spec, dict) else spec
+    if not isinstance(stages, list) or not stages:
+        raise ValueError("串联文件应包含非空的 stages 列表")
+
+    by_id: Dict[str, Dict[str, Any]] = {}
+    for n, stage in enumerate(stages, 1):
+        stage = dict(stage)
+        stage['id'] = str(stage.get('id') or f"stage-{n}")
+        if stage['id'] in by_id:
+            raise ValueError(f"阶段ID重复: {stage['id']}")
+        if not stage.get('workflow'):
+            raise ValueError(f"阶段 {stage['id']} 没有指定 workflow")
+        updates = stage.get('updates') or {}
+        stage['updates'] = parse_updates(updates) if isinstance(updates, list) else dict(updates)
+        stage['inputs'] = {key: _parse_source(value, f"阶段 {stage['id']} 的 {key}")
+                           for key, value in (stage.get('inputs') or {}).items()}
+        if stage.get('image_from'):
+            stage['image_from'] = _parse_source(stage['image_from'], f"阶段 {stage['id']} 的 image_from")
+        sources = [source for source, _ in stage['inputs'].values()]
+        if stage.get('image_from'):
+            sources.append(stage['image_from'][0])
+        stage['depends'] = list(dict.fromkeys(sources + [str(s) for s in stage.get('after') or []]))
+        by_id[stage['id']] = stage
+
+    for stage in by_id.values():
+        for dependency in stage['depends']:
+            if dependency not in by_id:
+                raise ValueError(f"阶段 {stage['id']} 引用了不存在的阶段: {dependency}")
+            if dependency == stage['id']:
+                raise ValueError(f"阶段 {stage['id']} 依赖自身")
+
+    # 拓扑排序，剩余的阶段在环上
+    ordered, done = [], set()
+    while len(ordered) < len(by_id):
+        ready = [stage for stage in by_id.values()
+                 if stage['id'] not in done and all(d in done for d in stage['depends'])]
+        if not ready:
+            cycle = sorted(stage_id for stage_id in by_id if stage_id not in done)
+            raise ValueError(f"阶段之间存在循环依赖: {', '.join(cycle)}")
+        ordered.extend(ready)
+        done.update(stage['id'] for stage in ready)
+
+    # 默认只下载终点阶段的输出，中间结果留在服务器上
+    downstream = {d for stage in ordered for d in stage['depends']}
+    for stage in ordered:
+        if stage.get('download') is None:
+            stage['download'] = stage['id'] not in downstream
+    return ordered
+
+
+class ChainRunner:
+    """在一个服务器上执行整条串联，每个阶段等待各自的上游，互不依赖的阶段同时在途"""
+
+    def __init__(self, api: AsyncComfyUIAPI, output_dir: str = "./output/",
+                 wait_timeout: Optional[float] = None, object_info: Optional[Dict[str, Any]] = None):
+        self.api = api
+        self.output_dir = output_dir
+        self.wait_timeout = wait_timeout
+        self.object_info = object_info
+        self._templates: Dict[str, WorkflowTemplate] = {}
+
+    def _get_template(self, workflow_path: str) -> WorkflowTemplate:
+        """同一工作流在多个阶段中只解析、编译一次"""
+        if workflow_path not in self._templates:
+            self._templates[workflow_path] = WorkflowTemplate.from_file(workflow_path, object_info=self.object_info)
+        return self._templates[workflow_path]
+
+    async def run_stage(self, stage: Dict[str, Any], upstream: Dict[str, asyncio.Task]) -> Dict[str, Any]:
+        """等待上游完成后执行单个阶段，上游失败时跳过"""
+        record = {'id': stage['id'], 'status': 'failed', 'prompt_id': None, 'outputs': [], 'error': None}
+        parents = {stage_id: await upstream[stage_id] for stage_id in stage['depends']}
+        failed = [stage_id for stage_id, parent in parents.items() if parent['status'] != 'success']
+        if failed:
+            record.update(status='skipped', error=f"上游阶段未完成: {', '.join(failed)}")
+            return record
+
+        timings = {}
+        started = time.perf_counter()
+        stage_started = started
+
+        def mark(name, record_span=True):
+            nonlocal stage_started
+            now = time.perf_counter()
+            timings[name] = round(now - stage_started, 3)
+            if record_span:
+                self.api.metrics.record_span(name, stage_started, now - stage_started, stage['id'])
+            stage_started = now
+
+        try:
+            template = self._get_template(stage['workflow'])
+            updates = dict(stage['updates'])
+            handoff = dict(stage['inputs'])
+            load_image_node = find_load_image_node(template.workflow)
+            if stage.get('image_from') or stage.get('image'):
+                if not load_image_node:
+                    raise ValueError(f"工作流中没有LoadImage节点: {stage['workflow']}")
+                image_key = f'node_{load_image_node}_inputs_image'
+                if stage.get('image_from'):
+                    handoff[image_key] = stage['image_from']
+                else:
+                    image_filename = await self.api.ensure_image(stage['image'])
+                    if not image_filename:
+                        raise RuntimeError(f"图片上传失败: {stage['image']}")
+                    updates[image_key] = image_filename
+            mark('upload')
+
+            # 上游输出以服务器端引用传入，不经过客户端
+            for key, (source, index) in handoff.items():
+                files = parents[source]['files']
+                if index >= len(files):
+                    raise RuntimeError(f"阶段 {source} 只有 {len(files)} 个输出，无法取第 {index} 个")
+                updates[key] = output_reference(files[index])
+            if handoff:
+                record['inputs'] = {key: updates[key] for key in handoff}
+            prompt = template.render(updates)
+
+            output_dir = stage.get('output') or self.output_dir
+            result = await self.api.queue_prompt(prompt, output_dir=output_dir if stage['download'] else None,
+                                                 prompt_json=template.encode(prompt))
+            if 'prompt_id' not in result:
+                raise RuntimeError(f"提交任务失败: {result}")
+            record['prompt_id'] = result['prompt_id']
+            print(f"[{stage['id']}] 已提交，ID: {record['prompt_id']}")
+            mark('queue')
+
+            history = await self.api.wait_for_completion(record['prompt_id'], timeout=self.wait_timeout)
+            # 排队和执行耗时由wait_for_completion记录到metrics
+            mark('wait', record_span=False)
+            nodes = self.api.pop_node_profile(record['prompt_id'])
+            if nodes:
+                record['nodes'] = nodes
+
+            record['files'] = collect_output_files(history)
+            if not record['files']:
+                raise RuntimeError("未找到生成的文件")
+            if stage['download']:
+                paths = await asyncio.gather(*(self.api.download_output(file_info['filename'], output_dir)
+                                               for file_info in record['files']))
+                record['outputs'] = [path for path in paths if path]
+                mark('download')
+                if len(record['outputs']) != len(record['files']):
+                    raise RuntimeError("部分文件下载失败")
+            # 中间阶段的输出留在服务器上，任务日志中同样不需要恢复
+            self.api.mark_downloaded(record['prompt_id'], record['outputs'])
+            record['status'] = 'success'
+        except Exception as e:
+            record['error'] = str(e)
+        finally:
+            if record['status'] != 'skipped':
+                elapsed = time.perf_counter() - started
+                timings['total'] = round(elapsed, 3)
+                record['timings'] = timings
+                self.api.metrics.record_span('total', started, elapsed, stage['id'], status=record['status'])
+        if record['status'] == 'success':
+            print(f"✅ [{stage['id']}] 完成，用时 {record['timings']['total']}s")
+        else:
+            print(f"❌ [{stage['id']}] 失败: {record['error']}")
+        return record
+
+    async def run(self, stages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """stages需已按依赖排序（load_chain），返回与stages对应的结果"""
+        tasks: Dict[str, asyncio.Task] = {}
+        for stage in stages:
+            tasks[stage['id']] = asyncio.ensure_future(self.run_stage(stage, tasks))
+        return list(await asyncio.gather(*tasks.values()))
+
+
+async def pick_server(servers: List[str], timeout: int = 30) -> Optional[str]:
+    """多个服务器时选排队最少的一个；串联的中间结果只存在于执行它的服务器上"""
+    if len(servers) == 1:
+        return servers[0]
+
+    async def depth(server: str) -> Optional[int]:
+        """服务器当前的排队数，无法连接时返回None"""
+        async with AsyncComfyUIAPI(server, timeout=timeout, use_websocket=False) as api:
+            try:
+                queue = await api.get_queue()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                print(f"⚠️  服务器 {server} 无法连接，跳过")
+                return None
+            if 'queue_running' not in queue:
+                return None
+            return len(queue['queue_running']) + len(queue.get('queue_pending', []))
+
+    depths = await asyncio.gather(*(depth(server) for server in servers))
+    available = [(d, server) for server, d in zip(servers, depths) if d is not None]
+    if not available:
+        print(f"❌ 所有服务器都无法连接: {', '.join(servers)}")
+        return None
+    queued, server = min(available)
+    print(f"串联任务在 {server} 上执行（排队 {queued} 个）")
+    return server
+
+
+def print_chain_table(stages: List[Dict[str, Any]], records: List[Dict[str, Any]]):
+    """按执行顺序打印 阶段 → 状态 → 耗时 → 输出"""
+    print("\n=== 串联结果 ===")
+    for stage, record in zip(stages, records):
+        total = record.get('timings', {}).get('total')
+        elapsed = f"{total:.1f}s" if total is not None else '-'
+        if record['status'] == 'success':
+            outputs = ', '.join(record['outputs']) or \
+                f"(服务器端) {', '.join(output_reference(f) for f in record['files'])}"
+        else:
+            outputs = record['error']
+        print(f"{stage['id']:<16} {record['status']:<8} {elapsed:>8}  {outputs}")
+
+
+async def run_chain(
+        servers: List[str],
+        chain_path: str,
+        results_path: str,
+        output_dir: str = "./output/",
+        timeout: int = 30,
+        wait_timeout: Optional[float] = None,
+        use_websocket: bool = True,
+        upload_cache: Optional[UploadCache] = None,
+        metrics: Optional[Metrics] = None,
+        journal: Optional[JobJournal] = None,
+        object_info: Optional[Dict[str, Any]] = None,
+        compress_requests: bool = False
+) -> int:
+    """在一个服务器上执行串联文件中的全部阶段，结果写入results_path，返回退出码"""
+    try:
+        stages = load_chain(chain_path)
+    except (OSError, ValueError) as e:
+        print(f"错误: 无法加载串联文件: {e}")
+        return 1
+    print(f"串联阶段: {' → '.join(stage['id'] for stage in stages)}")
+
+    server = await pick_server(servers, timeout)
+    if not server:
+        return 1
+
+    async with AsyncComfyUIAPI(server, timeout=timeout, use_websocket=use_websocket,
+                               upload_cache=upload_cache, metrics=metrics, journal=journal,
+                               compress_requests=compress_requests) as api:
+        if not await api.test_connection():
+            print("无法连接到ComfyUI服务器")
+            return 1
+        runner = ChainRunner(api, output_dir=output_dir, wait_timeout=wait_timeout, object_info=object_info)
+        records = await runner.run(stages)
+
+    results_dir = os.path.dirname(results_path)
+    if results_dir:
+        os.makedirs(results_dir, exist_ok=True)
+    with open(results_path, 'a', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    print_chain_table(stages, records)
+    return 0 if all(record['status'] == 'success' for record in records) else 1
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+优先级/截止时间调度
+ComfyUI的队列是先进先出的，几秒钟的交互式预览会排在一批81帧渲染后面。
+调度器在本地按 (优先级, 截止时间) 保存任务，只有服务器 /queue 中等待的任务数低于水位线时
+才提交下一个，让服务器队列保持很短；紧急任务用front直接插到服务器队首。
+超过截止时间的任务：尚未提交的直接丢弃，已提交的从服务器队列删除或中断。
+
+命令行: --batch 任务文件 --priority-lanes，任务可带 priority（越小越先）、deadline（秒）、urgent 字段:
+  {"id": "preview-1", "updates": {"node_52_inputs_steps": 4}, "priority": 0, "deadline": 60, "urgent": true}
+"""
+
+import functools
+import heapq
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Optional, Dict, Any, List, Union, Callable
+
+from main import ComfyUIAPI, _remaining, collect_output_filenames, find_load_image_node
+from result_cache import ResultCache, canonical_prompt_hash
+from upload_cache import file_digest, content_filename
+
+
+class DispatchJob:
+    """调度中的任务，future在完成时返回history（设置了on_complete时为其返回值）
+
+    on_complete(job, history)在等待线程中执行（下载、后处理），不阻塞其他任务。
+    """
+
+    def __init__(self, prompt: Dict[str, Any], priority: int, deadline: Optional[float],
+                 image_path: Optional[str], urgent: bool, output_dir: Optional[str] = None,
+                 journal_fields: Optional[Dict[str, Any]] = None,
+                 on_complete: Optional[Callable[['DispatchJob', Dict[str, Any]], Any]] = None):
+        self.prompt = prompt
+        self.priority = priority
+        self.deadline = deadline
+        self.image_path = image_path
+        self.urgent = urgent
+        self.output_dir = output_dir
+        self.journal_fields = journal_fields
+        self.on_complete = on_complete
+        self.prompt_id: Optional[str] = None
+        self.api: Optional[ComfyUIAPI] = None
+        self.future: Future = Future()
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+
+class PriorityDispatcher:
+    """按优先级和截止时间向一个或多个ComfyUI服务器投递任务
+
+    priority越小越先执行；watermark为每个服务器允许的等待任务数；
+    wait_timeout为提交后等待完成的最长时间，超过时从服务器删除或中断。
+    """
+
+    def __init__(self, apis: Union[ComfyUIAPI, List[ComfyUIAPI]], watermark: int = 1,
+                 poll_interval: float = 0.5, max_waiting: int = 32, wait_timeout: Optional[float] = None):
+        self.apis = apis if isinstance(apis, list) else [apis]
+        self.watermark = watermark
+        self.poll_interval = poll_interval
+        self.wait_timeout = wait_timeout
+        self._heap: List[tuple] = []
+        self._sequence = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._waiters = ThreadPoolExecutor(max_workers=max_waiting)
+        self.dispatched = 0
+        self.expired = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt: Dict[str, Any], priority: int = 0, deadline: Optional[float] = None,
+               image_path: Optional[str] = None, urgent: bool = False) -> Future:
+        """加入本地队列，deadline为距现在的秒数；返回的future在完成时得到history，超时抛出TimeoutError"""
+        return self.submit_job(prompt, priority, deadline, image_path, urgent).future
+
+    def submit_job(self, prompt: Dict[str, Any], priority: int = 0, deadline: Optional[float] = None,
+                   image_path: Optional[str] = None, urgent: bool = False, output_dir: Optional[str] = None,
+                   journal_fields: Optional[Dict[str, Any]] = None,
+                   on_complete: Optional[Callable[[DispatchJob, Dict[str, Any]], Any]] = None) -> DispatchJob:
+        """与submit相同，返回DispatchJob，完成后可从job.api下载输出
+
+        output_dir和journal_fields记入任务日志（--resume恢复时使用），on_complete见DispatchJob。
+        """
+        job = DispatchJob(prompt, priority, time.monotonic() + deadline if deadline is not None else None,
+                          image_path, urgent, output_dir, journal_fields, on_complete)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("调度器已关闭")
+            # 紧急任务排在最前，其余按优先级、截止时间、提交顺序
+            key = (0 if urgent else 1, priority,
+                   job.deadline if job.deadline is not None else float('inf'), self._sequence)
+            self._sequence += 1
+            heapq.heappush(self._heap, (key, job))
+            self._cond.notify()
+        return job
+
+    @property
+    def pending(self) -> int:
+        """本地尚未提交的任务数"""
+        with self._cond:
+            return len(self._heap)
+
+    def _queue_depths(self) -> Dict[int, int]:
+        """各服务器 /queue 中等待的任务数，查询失败的服务器不参与本轮投递"""
+        depths = {}
+        for index, api in enumerate(self.apis):
+            try:
+                depths[index] = len(api.get_queue().get('queue_pending', []))
+            except Exception:
+                continue
+        return depths
+
+    def _expire(self, job: DispatchJob):
+        self.expired += 1
+        print(f"任务超过截止时间，未提交即丢弃 (priority={job.priority})")
+        job.future.set_exception(TimeoutError("任务超过截止时间，未提交"))
+
+    def _prune_expired(self):
+        """丢弃本地队列中所有已超过截止时间的任务，不只是队首（需持有_cond）"""
+        expired = [job for _, job in self._heap if job.expired]
+        if not expired:
+            return
+        self._heap = [entry for entry in self._heap if not entry[1].expired]
+        heapq.heapify(self._heap)
+        for job in expired:
+            self._expire(job)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap and not self._closed:
+                    self._cond.wait()
+                if self._closed and not self._heap:
+                    return
+
+            depths = self._queue_depths()
+            assignments = []
+            with self._cond:
+                self._prune_expired()
+                while self._heap and depths:
+                    job = self._heap[0][1]
+                    if job.expired:
+                        heapq.heappop(self._heap)
+                        self._expire(job)
+                        continue
+                    index = min(depths, key=depths.get)
+                    if depths[index] >= self.watermark and not job.urgent:
+                        break
+                    heapq.heappop(self._heap)
+                    depths[index] += 1
+                    assignments.append((self.apis[index], job))
+
+            for api, job in assignments:
+                self._dispatch(api, job)
+
+            with self._cond:
+                if self._heap and not assignments:
+                    self._cond.wait(self.poll_interval)
+
+    def _dispatch(self, api: ComfyUIAPI, job: DispatchJob):
+        try:
+            if job.image_path and not api.ensure_image(job.image_path):
+                raise RuntimeError(f"图片上传失败: {job.image_path}")
+            result = api.queue_prompt(job.prompt, front=job.urgent, output_dir=job.output_dir,
+                                      journal_fields=job.journal_fields)
+            if 'prompt_id' not in result:
+                raise RuntimeError(f"提交任务失败: {result}")
+        except Exception as e:
+            job.future.set_exception(e)
+            return
+        job.api = api
+        job.prompt_id = result['prompt_id']
+        self.dispatched += 1
+        print(f"任务 {job.prompt_id} 已提交到 {api.server_address} (priority={job.priority}"
+              f"{', front' if job.urgent else ''})")
+        self._waiters.submit(self._wait, job)
+
+    def _wait(self, job: DispatchJob):
+        timeouts = [timeout for timeout in (_remaining(job.deadline) if job.deadline is not None else None,
+                                            self.wait_timeout) if timeout is not None]
+        try:
+            history = job.api.wait_for_completion(job.prompt_id, timeout=min(timeouts) if timeouts else None)
+        except TimeoutError as e:
+            # 截止时间已过或等待超时，不再为它占用GPU
+            if job.expired:
+                self.expired += 1
+            job.api.cancel(job.prompt_id)
+            job.future.set_exception(e)
+            return
+        except Exception as e:
+            job.future.set_exception(e)
+            return
+        try:
+            job.future.set_result(job.on_complete(job, history) if job.on_complete else history)
+        except Exception as e:
+            job.future.set_exception(e)
+
+    def close(self, wait: bool = True):
+        """停止接收新任务；wait为True时等待本地队列清空且已提交的任务结束"""
+        with self._cond:
+            self._closed = True
+            if not wait:
+                for _, job in self._heap:
+                    job.future.cancel()
+                self._heap.clear()
+            self._cond.notify()
+        if wait:
+            self._thread.join()
+        self._waiters.shutdown(wait=wait)
+
+
+def run_priority_batch(apis: List[ComfyUIAPI], jobs_path: str, workflow_path: str, results_path: str,
+                       output_dir: str = "./output/", watermark: int = 1, wait_timeout: Optional[float] = None,
+                       result_cache: Optional[ResultCache] = None,
+                       object_info: Optional[Dict[str, Any]] = None, postprocessor=None) -> int:
+    """按任务的priority/deadline/urgent字段调度整个任务文件，结果按完成顺序写入results_path，返回失败任务数
+
+    下载和后处理在调度器的等待线程中进行；提交时在任务日志中记录job_id和结果文件，--resume可补写结果行。
+    """
+    from batch import load_jobs, load_completed_ids, write_result
+    from main import postprocess_output
+    from workflow_template import WorkflowTemplate
+
+    completed = load_completed_ids(results_path)
+    results_dir = os.path.dirname(results_path)
+    if results_dir:
+        os.makedirs(results_dir, exist_ok=True)
+
+    def postprocess(outputs: List[str]) -> List[str]:
+        if postprocessor:
+            outputs = [postprocess_output(postprocessor, path) for path in outputs]
+            if not all(outputs):
+                raise RuntimeError("后处理失败")
+        return outputs
+
+    def finish(cache_key: Optional[str], dispatch_job: DispatchJob, history: Dict[str, Any]) -> List[str]:
+        """等待线程中下载输出、写入结果缓存并后处理，返回最终文件"""
+        filenames = collect_output_filenames(history)
+        outputs = [path for path in dispatch_job.api.download_outputs(filenames, dispatch_job.output_dir) if path]
+        if not filenames or len(outputs) != len(filenames):
+            raise RuntimeError("未找到生成的文件或部分文件下载失败")
+        dispatch_job.api.mark_downloaded(dispatch_job.prompt_id, outputs)
+        if result_cache:
+            result_cache.store(cache_key, outputs)
+        return postprocess(outputs)
+
+    templates: Dict[str, WorkflowTemplate] = {}
+    dispatcher = PriorityDispatcher(apis, watermark=watermark, wait_timeout=wait_timeout)
+    submitted = {}
+    succeeded = failed = 0
+    with open(results_path, 'a', encoding='utf-8') as f:
+        try:
+            for job in load_jobs(jobs_path):
+                if job['id'] in completed:
+                    continue
+                record = {'id': job['id'], 'status': 'failed', 'prompt_id': None, 'outputs': [], 'error': None}
+                try:
+                    if job.get('invalid'):
+                        raise ValueError(job['invalid'])
+                    path = job.get('workflow') or workflow_path
+                    if path not in templates:
+                        templates[path] = WorkflowTemplate.from_file(path, object_info=object_info)
+                    template = templates[path]
+                    updates = dict(job['updates'])
+                    image_path = job.get('image')
+                    image_digest = file_digest(image_path) if image_path else None
+                    load_image_node = find_load_image_node(template.workflow)
+                    if image_path and load_image_node:
+                        updates[f'node_{load_image_node}_inputs_image'] = content_filename(image_digest, image_path)
+                    prompt = template.render(updates)
+                    job_output_dir = job.get('output') or output_dir
+
+                    cache_key = None
+                    if result_cache:
+                        cache_key = canonical_prompt_hash(prompt, [image_digest] if image_digest else [])
+                        cached_files = result_cache.lookup(cache_key, job_output_dir)
+                        if cached_files:
+                            record.update(status='success', outputs=postprocess(cached_files), cached=True)
+                            write_result(f, record)
+                            succeeded += 1
+                            print(f"✅ [{job['id']}] 命中结果缓存")
+                            continue
+
+                    deadline = job.get('deadline')
+                    dispatch_job = dispatcher.submit_job(
+                        prompt, priority=int(job.get('priority', 0)),
+                        deadline=float(deadline) if deadline is not None else None,
+                        image_path=image_path, urgent=bool(job.get('urgent')), output_dir=job_output_dir,
+                        journal_fields={'job_id': job['id'], 'results_path': os.path.abspath(results_path)},
+                        on_complete=functools.partial(finish, cache_key))
+                except Exception as e:
+                    record['error'] = str(e)
+                    write_result(f, record)
+                    failed += 1
+                    print(f"❌ [{job['id']}] 失败: {e}")
+                    continue
+                submitted[dispatch_job.future] = (dispatch_job, record)
+
+            for future in as_completed(submitted):
+                dispatch_job, record = submitted[future]
+                record['prompt_id'] = dispatch_job.prompt_id
+                try:
+                    record.update(status='success', outputs=future.result())
+                    succeeded += 1
+                    print(f"✅ [{record['id']}] 完成")
+                except Exception as e:
+                    record['error'] = str(e) or type(e).__name__
+                    failed += 1
+                    print(f"❌ [{record['id']}] 失败: {record['error']}")
+                write_result(f, record)
+        finally:
+            dispatcher.close(wait=False)
+
+    print(f"优先级批量执行结束: 成功 {succeeded} 个，失败 {failed} 个（其中超过截止时间 {dispatcher.expired} 个）")
+    return failed
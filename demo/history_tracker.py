@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+批量查询任务状态
+轮询模式下每个等待者各自请求 /history/{prompt_id} 和 /queue，200个在途任务每个间隔就是400个请求。
+同一服务器的所有等待者共享一个跟踪器：每个间隔只请求一次 /queue，有等待的任务离开队列时
+再请求一次 /history?max_items=N，把结果分发给各个等待者；轮询间隔随观测到的任务耗时自动调整。
+状态请求数因此只与服务器数量有关，与任务数无关。
+
+每条history都包含完整的prompt，N按上次轮询以来离开队列的任务数（即新写入history的条数）取，
+而不是按在途任务数，流量只随完成的任务数增长。
+"""
+
+import asyncio
+import threading
+import time
+from typing import Optional, Dict, Any, List, Set
+
+
+class _PollSchedule:
+    """根据已完成任务的耗时调整轮询间隔：任务越长，轮询越稀疏"""
+
+    def __init__(self, initial_interval: float = 2.0, min_interval: float = 0.5,
+                 max_interval: float = 10.0, fraction: float = 0.05):
+        self.interval = initial_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        # 间隔取平均任务耗时的fraction，完成时间的平均延迟约为其一半
+        self.fraction = fraction
+        self.average_duration: Optional[float] = None
+
+    def observe(self, duration: float):
+        if self.average_duration is None:
+            self.average_duration = duration
+        else:
+            self.average_duration = 0.8 * self.average_duration + 0.2 * duration
+        self.interval = min(max(self.average_duration * self.fraction, self.min_interval), self.max_interval)
+
+
+def _active_ids(queue: Dict[str, Any]) -> Set[str]:
+    return {item[1] for item in queue.get('queue_running', []) + queue.get('queue_pending', [])}
+
+
+def _max_items(left: int, departed: int) -> int:
+    """本次需要读取的最近history条数
+
+    left为离开队列的等待中任务数，departed为上次轮询以来离开队列的所有任务数（包括其他客户端的）。
+    两次轮询之间提交并完成的其他任务不在其中，被挤出的任务由单独查询兜底。
+    """
+    return max(left, departed, 1)
+
+
+def _split(prompt_ids: List[str], history: Dict[str, Any]):
+    """将离开队列的prompt分为已完成(在最近history中)和需要单独确认的"""
+    finished = {prompt_id: history[prompt_id] for prompt_id in prompt_ids if prompt_id in history}
+    unknown = [prompt_id for prompt_id in prompt_ids if prompt_id not in finished]
+    return finished, unknown
+
+
+class _Tracked:
+    def __init__(self):
+        self.registered_at = time.monotonic()
+        self.done = threading.Event()
+        self.history: Optional[Dict[str, Any]] = None
+
+
+class HistoryTracker:
+    """同步客户端的共享状态轮询，后台线程在有等待者时运行"""
+
+    def __init__(self, api, initial_interval: float = 2.0, min_interval: float = 0.5,
+                 max_interval: float = 10.0):
+        self.api = api
+        self.schedule = _PollSchedule(initial_interval, min_interval, max_interval)
+        self._tracked: Dict[str, _Tracked] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        # 上次轮询时队列中的所有prompt
+        self._last_active: Set[str] = set()
+        self.polls = 0
+
+    def wait(self, prompt_id: str, deadline: Optional[float] = None) -> Dict[str, Any]:
+        """等待任务出现在history中，deadline为time.monotonic()时间，超过时抛出TimeoutError"""
+        tracked = _Tracked()
+        with self._lock:
+            self._tracked[prompt_id] = tracked
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        try:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not tracked.done.wait(remaining):
+                raise TimeoutError(f"等待任务 {prompt_id} 超时")
+        finally:
+            with self._lock:
+                self._tracked.pop(prompt_id, None)
+        print("任务完成！")
+        return tracked.history
+
+    def _run(self):
+        while True:
+            with self._lock:
+                prompt_ids = list(self._tracked)
+                if not prompt_ids:
+                    self._thread = None
+                    return
+            try:
+                self.poll(prompt_ids)
+            except Exception as e:
+                print(f"检查状态时出错: {e}")
+            time.sleep(self.schedule.interval)
+
+    def poll(self, prompt_ids: List[str]):
+        """一次 /queue，有任务离开队列时一次 /history?max_items=N，必要时单独确认少数不在最近history中的任务"""
+        self.polls += 1
+        # 先查队列再查history：查队列时已不在队列中的任务，此时一定已写入history
+        queue = self.api.get_queue()
+        active = _active_ids(queue)
+        left = [prompt_id for prompt_id in prompt_ids if prompt_id not in active]
+        departed = len(self._last_active - active)
+        self._last_active = active
+        if active:
+            print(f"队列中剩余任务: {len(active)}")
+        if not left:
+            return
+
+        history = self.api.get_recent_history(_max_items(len(left), departed))
+        finished, unknown = _split(left, history)
+        for prompt_id in unknown:
+            single = self.api.get_history(prompt_id)
+            if prompt_id in single:
+                finished[prompt_id] = single[prompt_id]
+        self._finish(finished)
+
+    def _finish(self, finished: Dict[str, Dict[str, Any]]):
+        now = time.monotonic()
+        with self._lock:
+            for prompt_id, entry in finished.items():
+                tracked = self._tracked.get(prompt_id)
+                if tracked is None or tracked.done.is_set():
+                    continue
+                tracked.history = entry
+                tracked.done.set()
+                self.schedule.observe(now - tracked.registered_at)
+
+
+class AsyncHistoryTracker:
+    """异步客户端的共享状态轮询，后台任务在有等待者时运行"""
+
+    def __init__(self, api, initial_interval: float = 2.0, min_interval: float = 0.5,
+                 max_interval: float = 10.0):
+        self.api = api
+        self.schedule = _PollSchedule(initial_interval, min_interval, max_interval)
+        self._futures: Dict[str, asyncio.Future] = {}
+        self._registered_at: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._last_active: Set[str] = set()
+        self.polls = 0
+
+    async def wait(self, prompt_id: str, deadline: Optional[float] = None) -> Dict[str, Any]:
+        future = asyncio.get_running_loop().create_future()
+        self._futures[prompt_id] = future
+        self._registered_at[prompt_id] = time.monotonic()
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        try:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            history = await asyncio.wait_for(asyncio.shield(future), remaining)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"等待任务 {prompt_id} 超时") from None
+        finally:
+            self._futures.pop(prompt_id, None)
+            self._registered_at.pop(prompt_id, None)
+        print("任务完成！")
+        return history
+
+    async def _run(self):
+        while self._futures:
+            try:
+                await self.poll(list(self._futures))
+            except Exception as e:
+                print(f"检查状态时出错: {e}")
+            await asyncio.sleep(self.schedule.interval)
+
+    async def poll(self, prompt_ids: List[str]):
+        self.polls += 1
+        queue = await self.api.get_queue()
+        active = _active_ids(queue)
+        left = [prompt_id for prompt_id in prompt_ids if prompt_id not in active]
+        departed = len(self._last_active - active)
+        self._last_active = active
+        if not left:
+            return
+
+        history = await self.api.get_recent_history(_max_items(len(left), departed))
+        finished, unknown = _split(left, history)
+        singles = await asyncio.gather(*(self.api.get_history(prompt_id) for prompt_id in unknown))
+        for prompt_id, single in zip(unknown, singles):
+            if prompt_id in single:
+                finished[prompt_id] = single[prompt_id]
+
+        now = time.monotonic()
+        for prompt_id, entry in finished.items():
+            future = self._futures.get(prompt_id)
+            if future is not None and not future.done():
+                future.set_result(entry)
+                self.schedule.observe(now - self._registered_at.get(prompt_id, now))
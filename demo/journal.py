@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+任务日志
+客户端进程在等待过程中退出时，服务器上的任务仍在执行，但prompt_id随之丢失，输出也不会被下载。
+每次提交和状态变化都追加一行到JSONL日志：写入后立即flush（进程崩溃不丢失），
+fsync按时间间隔批量进行（减少磁盘同步次数）。--resume 重放日志，重新接上未完成的任务。
+批量任务同时记录job_id和结果文件：重新运行--batch时接上仍在执行的任务而不是重复提交，
+--resume恢复的批量任务补写结果行。
+
+多个进程默认共用同一个日志文件。压缩时用新文件替换日志，其他进程仍在向旧文件追加的记录会丢失，
+因此写入持有 {path}.lock 的共享锁、压缩持有排他锁，写入前发现文件已被替换时重新打开。
+没有fcntl的平台（Windows）不压缩。
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, Any, List
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DEFAULT_JOURNAL_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'comfyui-acs', 'journal.jsonl')
+
+# 进入这些状态后不再需要恢复
+TERMINAL_STATES = ('downloaded', 'failed', 'cancelled', 'lost')
+
+
+class JobJournal:
+    """追加写入的任务状态日志，每行一个状态变化，同一prompt_id以最后一行为准"""
+
+    def __init__(self, path: str = DEFAULT_JOURNAL_PATH, fsync_interval: float = 1.0,
+                 compact_bytes: int = 1024 * 1024):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._last_fsync = 0.0
+        self._dirty = False
+        self._file = None
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock_file = open(f"{path}.lock", 'a') if fcntl else None
+        # 日志过大时只保留未完成的任务
+        if os.path.exists(path) and os.path.getsize(path) > compact_bytes:
+            self.compact()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def record(self, prompt_id: str, state: str, **fields):
+        """追加一条状态记录"""
+        entry = dict(fields, prompt_id=prompt_id, state=state, ts=time.time())
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self._lock:
+            if self._file is None:
+                return
+            if self._lock_file is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_SH)
+            try:
+                self._reopen_if_replaced()
+                self._file.write(line)
+                self._file.flush()
+                self._dirty = True
+                now = time.monotonic()
+                if now - self._last_fsync >= self.fsync_interval:
+                    os.fsync(self._file.fileno())
+                    self._last_fsync = now
+                    self._dirty = False
+            finally:
+                if self._lock_file is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _reopen_if_replaced(self):
+        """其他进程压缩后日志已是新文件，改为向新文件追加"""
+        try:
+            replaced = os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            replaced = True
+        if replaced:
+            if self._dirty:
+                os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+    def replay(self) -> Dict[str, Dict[str, Any]]:
+        """读取日志，返回每个prompt_id合并后的最新状态"""
+        entries: Dict[str, Dict[str, Any]] = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # 崩溃时可能留下半行
+                merged = entries.setdefault(entry['prompt_id'], {})
+                if entry.get('state') == 'submitted':
+                    merged['submitted_ts'] = entry.get('ts', 0)
+                merged.update(entry)
+        return entries
+
+    def jobs(self, server: str) -> Dict[str, Dict[str, Any]]:
+        """该服务器上带批量任务ID(job_id)提交的任务，同一任务ID以最后一次提交为准"""
+        entries = sorted(self.replay().values(),
+                         key=lambda entry: entry.get('submitted_ts', entry.get('ts', 0)))
+        return {entry['job_id']: entry for entry in entries
+                if entry.get('job_id') and entry.get('server') == server}
+
+    def pending(self) -> List[Dict[str, Any]]:
+        """尚未完成下载、也未失败的任务"""
+        return [entry for entry in self.replay().values() if entry.get('state') not in TERMINAL_STATES]
+
+    def compact(self):
+        """重写日志，只保留未完成的任务；持有排他锁，其他进程的写入在此期间等待"""
+        if self._lock_file is None:
+            return
+        with self._lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                entries = self.pending()
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    for entry in entries:
+                        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+                if self._file is not None:
+                    self._file.close()
+                    self._file = open(self.path, 'a', encoding='utf-8')
+                    self._dirty = False
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            if self._dirty:
+                os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            if self._lock_file is not None:
+                self._lock_file.close()
@@ -1,22 +1,142 @@
 import requests
 import json
+import gzip
 import time
 import uuid
 import os
 import argparse
-from typing import Optional, Dict, Any
+import math
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Callable, Tuple
 import urllib3
 from urllib.parse import urlparse
 
+from metrics import Metrics, endpoint_label
+from retry_policy import RetryPolicy, RetryBudget, CircuitBreaker, DEFAULT_POLICIES, UNSENT_REASONS
+
+from upload_cache import UploadCache, DEFAULT_INDEX_PATH, file_digest, content_filename
+from result_cache import ResultCache, DEFAULT_RESULT_CACHE_DIR, canonical_prompt_hash
+from journal import JobJournal, DEFAULT_JOURNAL_PATH
+from preprocess import ImagePreprocessor, DEFAULT_IMAGE_CACHE_DIR, guess_mime_type, target_size
+from history_tracker import HistoryTracker
+from progress import NodeProfiler, ProgressCallback, print_node_profile, print_progress
+
+try:
+    import websocket  # websocket-client，可选依赖，缺失时退化为轮询
+except ImportError:
+    websocket = None
+
 # 禁用SSL警告
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 
+class ComfyUIExecutionError(Exception):
+    """服务器端执行工作流失败（execution_error / execution_interrupted）"""
+
+    def __init__(self, prompt_id: str, message: str, node_id: Optional[str] = None):
+        self.prompt_id = prompt_id
+        self.node_id = node_id
+        super().__init__(f"任务 {prompt_id} 执行失败" + (f"（节点 {node_id}）" if node_id else "") + f": {message}")
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """服务器处于熔断状态，请求没有发出"""
+
+
+def _failure_reason(error: requests.exceptions.RequestException) -> Optional[str]:
+    """将请求异常归类为重试原因: connect（未送达）、timeout、connection（连接中断），不可重试时返回None"""
+    if isinstance(error, CircuitOpenError):
+        return None
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return 'connect'
+    if isinstance(error, requests.exceptions.Timeout):
+        return 'timeout'
+    if isinstance(error, requests.exceptions.ConnectionError):
+        cause = error.args[0] if error.args else None
+        if isinstance(getattr(cause, 'reason', cause), urllib3.exceptions.NewConnectionError):
+            return 'connect'
+        return 'connection'
+    if isinstance(error, requests.exceptions.ChunkedEncodingError):
+        return 'connection'
+    return None
+
+
+# 请求体小于此大小时不压缩，gzip头部和CPU开销不划算
+COMPRESS_MIN_BYTES = 1024
+
+
+_COMPACT_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def dumps_compact(value: Any) -> bytes:
+    """紧凑的UTF-8 JSON（无多余空格、不转义非ASCII字符），服务器解析结果与默认格式相同"""
+    return _COMPACT_ENCODER.encode(value).encode('utf-8')
+
+
+def prompt_request_body(prompt_json: bytes, fields: Dict[str, Any]) -> bytes:
+    """在已序列化的prompt外拼接 /prompt 请求体的其余字段，不重新序列化prompt"""
+    return b'{"prompt":' + prompt_json + (b',' + dumps_compact(fields)[1:] if fields else b'}')
+
+
+def _preview(value: Any, limit: int = 80) -> str:
+    """日志中显示的取值，长文本（提示词）截断"""
+    text = str(value)
+    return text if len(text) <= limit else f"{text[:limit]}...（共{len(text)}字符）"
+
+
+def _retry_after(response: requests.Response) -> Optional[float]:
+    """429/503响应的Retry-After（秒数形式）"""
+    try:
+        return float(response.headers['Retry-After'])
+    except (KeyError, ValueError):
+        return None
+
+
+class _PromptWaiter:
+    """单个prompt的完成通知"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error: Optional[Exception] = None
+        self.lost = False
+
+    def finish(self, error: Optional[Exception] = None, lost: bool = False):
+        if self.done.is_set():
+            return
+        self.error = error
+        self.lost = lost
+        self.done.set()
+
+
 class ComfyUIAPI:
-    def __init__(self, server_address="127.0.0.1:8188", timeout=30):
+    def __init__(self, server_address="127.0.0.1:8188", timeout=30, use_websocket=True,
+                 upload_cache: Optional[UploadCache] = None, metrics: Optional[Metrics] = None,
+                 journal: Optional[JobJournal] = None, on_progress: Optional[ProgressCallback] = None,
+                 retry_policies: Optional[Dict[str, RetryPolicy]] = None,
+                 breaker: Optional[CircuitBreaker] = None, compress_requests: bool = False):
         self.server_address = server_address
         self.client_id = str(uuid.uuid4())
         self.timeout = timeout
+        self.use_websocket = use_websocket and websocket is not None
+        # gzip压缩 /prompt 请求体（ComfyUI的aiohttp服务端会自动解压），服务器返回415时自动关闭
+        self.compress_requests = compress_requests
+        self.upload_cache = upload_cache
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.journal = journal
+        # 进度回调在WebSocket监听线程中调用，应尽快返回
+        self.on_progress = on_progress
+        self.profiler = NodeProfiler(self.metrics)
+
+        # 共享WebSocket连接及按prompt_id登记的等待者
+        self._ws = None
+        self._ws_lock = threading.Lock()
+        self._waiters: Dict[str, _PromptWaiter] = {}
+        # execution_start事件到达的时间，用于区分排队和执行耗时
+        self._started_at: Dict[str, float] = {}
+        # 轮询模式下共享的状态查询
+        self._tracker: Optional[HistoryTracker] = None
 
         # 确保server_address格式正确
         if not server_address.startswith(('http://', 'https://')):
@@ -30,25 +150,114 @@ class ComfyUIAPI:
         # 创建session以复用连接
         self.session = requests.Session()
         self.session.timeout = timeout
+        self.session.hooks['response'].append(self._record_response)
 
-        # 设置重试策略
-        from requests.adapters import HTTPAdapter
-        from urllib3.util.retry import Retry
+        # 按操作类型重试（见retry_policy），session本身不重试，避免提交被重复执行
+        self.retry_policies = dict(DEFAULT_POLICIES, **(retry_policies or {}))
+        self.retry_budget = RetryBudget()
+        self.breaker = breaker or CircuitBreaker(self.server_address, metrics=self.metrics)
+        # 服务器是否使用客户端指定的prompt_id（较新的ComfyUI），确认前提交结果未知时不重试
+        self.accepts_prompt_id: Optional[bool] = None
 
-        retry_strategy = Retry(
-            total=3,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504],
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        self.session.mount("http://", adapter)
-        self.session.mount("https://", adapter)
+    def _record_response(self, response, *args, **kwargs):
+        """记录每个HTTP请求的耗时（到收到响应头为止）、状态码以及请求体和响应体的字节数
+
+        流式下载的响应体由download_output按实际收到的分块计数，不使用Content-Length。
+        """
+        endpoint = endpoint_label(response.url)
+        method = response.request.method
+        self.metrics.observe('comfyui_client_request_seconds', response.elapsed.total_seconds(),
+                             method=method, endpoint=endpoint)
+        self.metrics.inc('comfyui_client_requests_total', method=method, endpoint=endpoint,
+                         status=response.status_code)
+        body = response.request.body
+        if body:
+            self.metrics.inc('comfyui_client_sent_bytes_total',
+                             len(body.encode('utf-8') if isinstance(body, str) else body), endpoint=endpoint)
+        received = response.headers.get('Content-Length', '')
+        if received.isdigit() and not kwargs.get('stream'):
+            self.metrics.inc('comfyui_client_received_bytes_total', int(received), endpoint=endpoint)
+
+    def _send(self, operation: str, method: str, url: str, **kwargs) -> requests.Response:
+        """发送一次请求，熔断时直接抛出CircuitOpenError，连接失败、超时和5xx计入熔断器"""
+        if not self.breaker.allow():
+            self.metrics.inc('comfyui_client_circuit_rejected_total', server=self.server_address,
+                             operation=operation)
+            raise CircuitOpenError(f"服务器 {self.server_address} 处于熔断状态: {method} {endpoint_label(url)}")
+        kwargs.setdefault('timeout', self.timeout)
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            self.breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def _retry_allowed(self, operation: str, attempt: int, reason: str, url: str,
+                       retry_after: Optional[float] = None,
+                       should_retry: Optional[Callable[[str], bool]] = None) -> bool:
+        """第attempt次请求失败后是否重试：次数未用完、调用方同意且重试预算足够时计数并等待退避时间"""
+        policy = self.retry_policies[operation]
+        if attempt >= policy.max_attempts or (should_retry is not None and not should_retry(reason)):
+            return False
+        if not self.retry_budget.withdraw():
+            self.metrics.inc('comfyui_client_retry_budget_exhausted_total', server=self.server_address,
+                             operation=operation)
+            return False
+        self.metrics.inc('comfyui_client_http_retries_total', operation=operation,
+                         endpoint=endpoint_label(url), reason=reason)
+        time.sleep(policy.backoff(attempt, retry_after))
+        return True
+
+    def _request(self, operation: str, method: str, url: str,
+                 should_retry: Optional[Callable[[str], bool]] = None, **kwargs) -> requests.Response:
+        """按操作类型的策略发送请求
+
+        重试用尽后返回最后的响应（由调用方检查状态码）或抛出最后的异常。
+        should_retry(reason)可进一步限制重试，reason为connect、timeout、connection或状态码。
+        """
+        policy = self.retry_policies[operation]
+        self.retry_budget.deposit()
+        attempt = 1
+        while True:
+            try:
+                response = self._send(operation, method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                reason = _failure_reason(e)
+                if reason is None or not self._retry_allowed(operation, attempt, reason, url,
+                                                             should_retry=should_retry):
+                    raise
+            else:
+                if response.status_code not in policy.retry_statuses:
+                    return response
+                if not self._retry_allowed(operation, attempt, str(response.status_code), url,
+                                           _retry_after(response), should_retry):
+                    return response
+                response.close()
+            attempt += 1
+
+    def _record_wait(self, prompt_id: str, start: float):
+        """记录等待耗时，收到execution_start时拆分为排队和执行两段
+
+        空闲的服务器可能在开始等待之前就已开始执行，此时排队耗时为0。
+        """
+        end = time.perf_counter()
+        started = self._started_at.pop(prompt_id, None)
+        if started is not None and started <= end:
+            started = max(started, start)
+            self.metrics.record_span('queue_wait', start, started - start, prompt_id)
+            self.metrics.record_span('execute', started, end - started, prompt_id)
+        else:
+            self.metrics.record_span('wait', start, end - start, prompt_id)
 
     def test_connection(self) -> bool:
         """测试与ComfyUI服务器的连接"""
         try:
             print(f"测试连接到: {self.base_url}")
-            response = self.session.get(f"{self.base_url}/queue", timeout=10)
+            response = self._request('probe', 'GET', f"{self.base_url}/queue", timeout=10)
             if response.status_code == 200:
                 print("✅ 连接成功")
                 return True
@@ -65,28 +274,122 @@ class ComfyUIAPI:
             print(f"❌ 连接测试失败: {e}")
             return False
 
-    def queue_prompt(self, prompt: Dict[str, Any]) -> Dict[str, Any]:
-        """提交工作流到队列"""
+    def _post_json(self, operation: str, url: str, body: bytes,
+                   should_retry: Optional[Callable[[str], bool]] = None) -> requests.Response:
+        """发送已序列化的JSON请求体，开启压缩且足够大时使用gzip"""
+        headers = {'Content-Type': 'application/json'}
+        if self.compress_requests and len(body) >= COMPRESS_MIN_BYTES:
+            response = self._request(operation, 'POST', url, data=gzip.compress(body, compresslevel=5),
+                                     headers=dict(headers, **{'Content-Encoding': 'gzip'}),
+                                     should_retry=should_retry)
+            if response.status_code != 415:
+                return response
+            # 415表示请求未被处理（如前置代理不接受压缩的请求体），改为不压缩重新发送
+            print("⚠️  服务器不接受gzip压缩的请求体，改为不压缩发送")
+            self.compress_requests = False
+        return self._request(operation, 'POST', url, data=body, headers=headers, should_retry=should_retry)
+
+    def queue_prompt(self, prompt: Dict[str, Any], front: bool = False,
+                     output_dir: Optional[str] = None, prompt_json: Optional[bytes] = None,
+                     journal_fields: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """提交工作流到队列，front为True时插到队首
+
+        prompt_json为已序列化的prompt（WorkflowTemplate.encode），提供时不再重新序列化。
+        配置了任务日志时记录prompt_id、服务器和output_dir，进程退出后可用--resume恢复；
+        journal_fields为额外记录的字段（如批量任务的job_id和结果文件）。
+
+        提交时由客户端生成prompt_id。超时、连接中断或5xx时无法确定服务器是否已入队，
+        只有在服务器支持客户端prompt_id、且在队列和历史中都查不到该任务时才重新提交。
+        """
+        # 提交前建立WebSocket连接，否则会错过开始执行时的事件，节点耗时不完整
+        if self.use_websocket:
+            self._ensure_listener()
+        prompt_id = str(uuid.uuid4())
+        accepted = []
+        # 空闲的服务器在/prompt返回前就开始执行，先登记才能收到最初的节点事件
+        if self.use_websocket:
+            self.profiler.register(prompt_id, prompt)
+
+        def should_retry(reason: str) -> bool:
+            if reason in UNSENT_REASONS:
+                return True
+            if not self.accepts_prompt_id:
+                return False
+            found = self.find_prompt(prompt_id)
+            if found:
+                accepted.append(prompt_id)
+            return found is False  # 查询失败时无法排除重复，不重试
+
         try:
-            p = {"prompt": prompt, "client_id": self.client_id}
-            response = self.session.post(
-                f"{self.base_url}/prompt",
-                json=p,
-                timeout=self.timeout
-            )
+            fields = {"client_id": self.client_id, "prompt_id": prompt_id}
+            if front:
+                fields["front"] = True
+            body = prompt_request_body(prompt_json or dumps_compact(prompt), fields)
+            response = self._post_json('submit', f"{self.base_url}/prompt", body, should_retry)
+            if not accepted:
+                response.raise_for_status()
+                result = response.json()
+                self.accepts_prompt_id = result.get('prompt_id') == prompt_id
+        except requests.exceptions.RequestException as e:
+            if not accepted:
+                print(f"提交工作流失败: {e}")
+                self.profiler.pop(prompt_id)
+                raise
+        if accepted:
+            print(f"提交结果未知，但服务器上已有该任务，不再重复提交: {prompt_id}")
+            result = {'prompt_id': prompt_id, 'number': None, 'node_errors': {}}
+        if self.use_websocket and result.get('prompt_id') != prompt_id:
+            # 旧版服务器忽略客户端的prompt_id，改为登记服务器返回的ID
+            self.profiler.pop(prompt_id)
+            if 'prompt_id' in result:
+                self.profiler.register(result['prompt_id'], prompt)
+        if self.journal and 'prompt_id' in result:
+            self.journal.record(result['prompt_id'], 'submitted', server=self.base_url, output_dir=output_dir,
+                                **(journal_fields or {}))
+        return result
+
+    def find_prompt(self, prompt_id: str) -> Optional[bool]:
+        """任务是否在服务器的队列或历史中，查询失败时返回None"""
+        try:
+            queue = self.get_queue()
+            if any(item[1] == prompt_id for key in ('queue_running', 'queue_pending')
+                   for item in queue.get(key, [])):
+                return True
+            return prompt_id in self.get_history(prompt_id)
+        except requests.exceptions.RequestException:
+            return None
+
+    def mark_downloaded(self, prompt_id: str, outputs: List[str]):
+        """输出已全部下载，任务日志中不再需要恢复"""
+        if self.journal:
+            self.journal.record(prompt_id, 'downloaded', outputs=outputs)
+
+    def pop_node_profile(self, prompt_id: str) -> List[Dict[str, Any]]:
+        """取走任务各节点的执行耗时（仅WebSocket模式下有记录）"""
+        return self.profiler.pop(prompt_id)
+
+    def _notify_progress(self, event_type: str, data: Dict[str, Any]):
+        progress = self.profiler.handle(event_type, data)
+        if progress is not None and self.on_progress is not None:
+            try:
+                self.on_progress(progress)
+            except Exception as e:
+                print(f"进度回调出错: {e}")
+
+    def get_history(self, prompt_id: str) -> Dict[str, Any]:
+        """获取执行历史"""
+        try:
+            response = self._request('read', 'GET', f"{self.base_url}/history/{prompt_id}")
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
-            print(f"提交工作流失败: {e}")
+            print(f"获取历史失败: {e}")
             raise
 
-    def get_history(self, prompt_id: str) -> Dict[str, Any]:
-        """获取执行历史"""
+    def get_recent_history(self, max_items: int) -> Dict[str, Any]:
+        """获取最近完成的max_items个任务的执行历史"""
         try:
-            response = self.session.get(
-                f"{self.base_url}/history/{prompt_id}",
-                timeout=self.timeout
-            )
+            response = self._request('read', 'GET', f"{self.base_url}/history", params={'max_items': max_items})
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -96,38 +399,221 @@ class ComfyUIAPI:
     def get_queue(self) -> Dict[str, Any]:
         """获取队列状态"""
         try:
-            response = self.session.get(
-                f"{self.base_url}/queue",
-                timeout=self.timeout
-            )
+            response = self._request('read', 'GET', f"{self.base_url}/queue")
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
             print(f"获取队列状态失败: {e}")
             raise
 
-    def wait_for_completion(self, prompt_id: str, check_interval: int = 2) -> Dict[str, Any]:
-        """等待任务完成"""
+    def get_object_info(self, etag: Optional[str] = None) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """获取服务器上所有节点类型的输入输出定义，返回(定义, ETag)；etag未变化(304)时定义为None"""
+        try:
+            # 安装了大量自定义节点时响应有数MB，使用更长的超时时间
+            response = self._request('read', 'GET', f"{self.base_url}/object_info",
+                                     headers={'If-None-Match': etag} if etag else None,
+                                     timeout=max(self.timeout, 60))
+            if response.status_code == 304:
+                return None, etag
+            response.raise_for_status()
+            return response.json(), response.headers.get('ETag')
+        except requests.exceptions.RequestException as e:
+            print(f"获取节点定义失败: {e}")
+            raise
+
+    def interrupt(self, prompt_id: Optional[str] = None):
+        """中断正在执行的任务；较新的ComfyUI只在prompt_id匹配时中断，旧版本中断当前任务"""
+        response = self._request('control', 'POST', f"{self.base_url}/interrupt",
+                                 json={'prompt_id': prompt_id} if prompt_id else {})
+        response.raise_for_status()
+
+    def delete_queued(self, prompt_ids: List[str]):
+        """从等待队列中删除任务"""
+        response = self._request('control', 'POST', f"{self.base_url}/queue", json={'delete': prompt_ids})
+        response.raise_for_status()
+
+    def cancel(self, prompt_id: str) -> bool:
+        """取消任务：排队中的从队列删除，执行中的中断，返回是否找到该任务"""
+        try:
+            queue = self.get_queue()
+            if any(item[1] == prompt_id for item in queue.get('queue_pending', [])):
+                self.delete_queued([prompt_id])
+                print(f"已从队列删除任务: {prompt_id}")
+            elif any(item[1] == prompt_id for item in queue.get('queue_running', [])):
+                self.interrupt(prompt_id)
+                print(f"已中断任务: {prompt_id}")
+            else:
+                return False
+        except requests.exceptions.RequestException as e:
+            print(f"取消任务失败: {e}")
+            return False
+        if self.journal:
+            self.journal.record(prompt_id, 'cancelled')
+        return True
+
+    @property
+    def ws_url(self) -> str:
+        """事件推送通道地址: ws(s)://host:port/ws?clientId=..."""
+        scheme = 'wss' if self.base_url.startswith('https://') else 'ws'
+        return f"{scheme}://{self.base_url.split('://', 1)[1]}/ws?clientId={self.client_id}"
+
+    def wait_for_completion(self, prompt_id: str, check_interval: int = 2,
+                            timeout: Optional[float] = None) -> Dict[str, Any]:
+        """等待任务完成
+
+        优先通过WebSocket监听执行事件，连接断开时退化为轮询history/queue。
+        timeout为整体超时时间(秒)，超时抛出TimeoutError；执行失败抛出ComfyUIExecutionError。
+        """
         print(f"等待任务完成，ID: {prompt_id}")
-        while True:
-            try:
-                history = self.get_history(prompt_id)
-                if prompt_id in history:
-                    print("任务完成！")
-                    return history[prompt_id]
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        start = time.perf_counter()
+
+        try:
+            if self.use_websocket:
+                history = self._wait_via_websocket(prompt_id, deadline)
+                if history is not None:
+                    self._record_wait(prompt_id, start)
+                    return history
+                print("WebSocket不可用，改为轮询任务状态")
+
+            history = self._poll_for_completion(prompt_id, check_interval, deadline)
+            self._record_wait(prompt_id, start)
+            return history
+        except ComfyUIExecutionError as e:
+            if self.journal:
+                self.journal.record(prompt_id, 'failed', error=str(e))
+            raise
+        finally:
+            self._started_at.pop(prompt_id, None)
 
-                # 检查队列状态
-                queue = self.get_queue()
-                queue_remaining = len(queue.get('queue_running', [])) + len(queue.get('queue_pending', []))
-                print(f"队列中剩余任务: {queue_remaining}")
+    def _ensure_listener(self) -> bool:
+        """确保共享的WebSocket监听线程在运行，返回连接是否可用
 
-                time.sleep(check_interval)
+        服务器端每个clientId只保留一个连接，多线程共用同一个客户端时必须共享监听。
+        """
+        with self._ws_lock:
+            if self._ws is not None:
+                return True
+            try:
+                ws = websocket.create_connection(self.ws_url, timeout=self.timeout)
             except Exception as e:
-                print(f"检查状态时出错: {e}")
-                time.sleep(check_interval)
+                print(f"WebSocket连接失败: {e}")
+                return False
+            ws.settimeout(None)
+            self._ws = ws
+            threading.Thread(target=self._listen, args=(ws,), daemon=True).start()
+            return True
 
-    def upload_image(self, image_path: str) -> bool:
-        """上传图片到ComfyUI"""
+    def _listen(self, ws):
+        """读取事件并分发给对应prompt_id的等待者"""
+        try:
+            while True:
+                message = ws.recv()
+                if not message:
+                    break  # 连接关闭
+                if not isinstance(message, str):
+                    continue  # 二进制帧为预览图，忽略
+
+                event = json.loads(message)
+                event_type = event.get('type')
+                data = event.get('data') or {}
+                self._notify_progress(event_type, data)
+                # 本连接只收到本客户端提交的任务的事件；空闲时开始执行往往早于等待者登记
+                if event_type == 'execution_start' and data.get('prompt_id'):
+                    self._started_at[data['prompt_id']] = time.perf_counter()
+                waiter = self._waiters.get(data.get('prompt_id'))
+                if waiter is None:
+                    continue
+
+                if event_type == 'executing':
+                    if data.get('node') is None:
+                        waiter.finish()
+                    else:
+                        print(f"正在执行节点: {data['node']}")
+                elif event_type == 'executed':
+                    print(f"节点 {data.get('node')} 已输出")
+                elif event_type == 'execution_success':
+                    waiter.finish()
+                elif event_type == 'execution_error':
+                    waiter.finish(ComfyUIExecutionError(
+                        data['prompt_id'], data.get('exception_message', '未知错误'), data.get('node_id')))
+                elif event_type == 'execution_interrupted':
+                    waiter.finish(ComfyUIExecutionError(data['prompt_id'], '任务被中断', data.get('node_id')))
+        except Exception as e:
+            if self._ws is ws:
+                print(f"WebSocket连接中断: {e}")
+        finally:
+            with self._ws_lock:
+                if self._ws is ws:
+                    self._ws = None
+            ws.close()
+            # 连接丢失，通知仍在等待的任务改为轮询
+            for waiter in list(self._waiters.values()):
+                waiter.finish(lost=True)
+
+    def _wait_via_websocket(self, prompt_id: str, deadline: Optional[float]) -> Optional[Dict[str, Any]]:
+        """等待共享监听线程的完成通知，连接失败或断开时返回None"""
+        waiter = _PromptWaiter()
+        self._waiters[prompt_id] = waiter
+        try:
+            if not self._ensure_listener():
+                return None
+
+            # 连接建立前任务可能已经结束，先查一次history
+            entry = self._finished_history(prompt_id)
+            if entry is not None:
+                return entry
+
+            while not waiter.done.wait(min(self.timeout, _remaining(deadline))):
+                _check_deadline(prompt_id, deadline)
+                # 长时间没有事件时确认一次history，防止漏掉完成事件
+                entry = self._finished_history(prompt_id)
+                if entry is not None:
+                    return entry
+        finally:
+            self._waiters.pop(prompt_id, None)
+
+        if waiter.lost:
+            return None
+        if waiter.error is not None:
+            raise waiter.error
+
+        # 完成事件先于history写入，短间隔等待history可读，查询失败时逐渐拉长间隔
+        interval = 0.1
+        while True:
+            entry = self._finished_history(prompt_id)
+            if entry is not None:
+                return entry
+            _check_deadline(prompt_id, deadline)
+            time.sleep(min(interval, _remaining(deadline)))
+            interval = min(interval * 2, 2.0)
+
+    def _finished_history(self, prompt_id: str) -> Optional[Dict[str, Any]]:
+        """返回已完成任务的history，未完成或查询失败时返回None
+
+        长时间渲染期间的网络抖动或服务器重启不应中断等待，任务仍在GPU上执行。
+        """
+        try:
+            history = self.get_history(prompt_id)
+        except requests.exceptions.RequestException as e:
+            print(f"检查状态时出错: {e}")
+            return None
+        if prompt_id not in history:
+            return None
+        print("任务完成！")
+        return history[prompt_id]
+
+    def _poll_for_completion(self, prompt_id: str, check_interval: float,
+                             deadline: Optional[float]) -> Dict[str, Any]:
+        """轮询直到任务完成，所有等待者共享同一个HistoryTracker的 /queue 和 /history 请求"""
+        with self._ws_lock:
+            if self._tracker is None:
+                self._tracker = HistoryTracker(self, initial_interval=check_interval)
+        return self._tracker.wait(prompt_id, deadline)
+
+    def upload_image(self, image_path: str, server_filename: Optional[str] = None,
+                     overwrite: bool = False) -> bool:
+        """上传图片到ComfyUI，server_filename为服务器端文件名（默认使用原文件名）"""
         if not os.path.exists(image_path):
             print(f"图片文件不存在: {image_path}")
             return False
@@ -137,24 +623,30 @@ class ComfyUIAPI:
         print(f"图片文件大小: {file_size / 1024 / 1024:.2f} MB")
 
         try:
+            # multipart请求体本来就在内存中构造，先读出内容，重试时才能重新发送完整文件
             with open(image_path, 'rb') as f:
-                files = {'image': (os.path.basename(image_path), f, 'image/png')}
-
-                print(f"正在上传到: {self.base_url}/upload/image")
-                response = self.session.post(
-                    f"{self.base_url}/upload/image",
-                    files=files,
-                    timeout=60  # 上传文件使用更长的超时时间
-                )
-
-                print(f"上传响应状态码: {response.status_code}")
-                if response.status_code == 200:
-                    print("✅ 图片上传成功")
-                    return True
-                else:
-                    print(f"❌ 上传失败，状态码: {response.status_code}")
-                    print(f"响应内容: {response.text}")
-                    return False
+                content = f.read()
+            filename = server_filename or os.path.basename(image_path)
+            files = {'image': (filename, content, guess_mime_type(filename))}
+            data = {'overwrite': 'true'} if overwrite else None
+
+            print(f"正在上传到: {self.base_url}/upload/image")
+            response = self._request(
+                'upload', 'POST',
+                f"{self.base_url}/upload/image",
+                files=files,
+                data=data,
+                timeout=60  # 上传文件使用更长的超时时间
+            )
+
+            print(f"上传响应状态码: {response.status_code}")
+            if response.status_code == 200:
+                print("✅ 图片上传成功")
+                return True
+            else:
+                print(f"❌ 上传失败，状态码: {response.status_code}")
+                print(f"响应内容: {response.text}")
+                return False
 
         except requests.exceptions.ConnectionError as e:
             print(f"❌ 连接错误: {e}")
@@ -166,21 +658,98 @@ class ComfyUIAPI:
             print(f"❌ 上传图片失败: {e}")
             return False
 
-    def download_output(self, filename: str, output_path: str = "./output/") -> Optional[str]:
-        """下载生成的输出文件"""
+    def image_exists(self, filename: str) -> bool:
+        """通过HEAD /view检查服务器input目录中是否已有该文件"""
+        try:
+            response = self._request('read', 'HEAD', f"{self.base_url}/view",
+                                     params={'filename': filename, 'type': 'input'}, timeout=10)
+            return response.status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    def ensure_image(self, image_path: str) -> Optional[str]:
+        """按内容哈希上传图片，服务器已有相同内容时跳过上传，返回服务器端文件名"""
+        if not os.path.exists(image_path):
+            print(f"图片文件不存在: {image_path}")
+            return None
+
+        cache = self.upload_cache
+        digest = cache.digest(image_path) if cache else file_digest(image_path)
+        filename = content_filename(digest, image_path)
+
+        # 索引命中或其他客户端已上传过相同内容时，只需一次HEAD确认
+        known = cache.lookup(self.server_address, digest) if cache else None
+        if self.image_exists(known or filename):
+            print(f"服务器已有相同图片，跳过上传: {known or filename}")
+            if cache and not known:
+                cache.record(self.server_address, digest, filename)
+            return known or filename
+        if cache and known:
+            cache.forget(self.server_address, digest)
+
+        if not self.upload_image(image_path, server_filename=filename, overwrite=True):
+            return None
+        if cache:
+            cache.record(self.server_address, digest, filename)
+        return filename
+
+    def download_output(self, filename: str, output_path: str = "./output/",
+                        chunk_size: int = 1024 * 1024) -> Optional[str]:
+        """下载生成的输出文件
+
+        分块写入临时文件(.part)，完成后重命名为目标文件；传输中断或服务器暂时不可用时，
+        按download策略退避后通过HTTP Range从断点续传。
+        """
         try:
             os.makedirs(output_path, exist_ok=True)
 
             # 构建下载URL
-            url = f"{self.base_url}/view?filename={filename}&type=output"
-            print(f"下载URL: {url}")
-
-            response = self.session.get(url, timeout=120)
-            response.raise_for_status()
+            url = f"{self.base_url}/view"
+            params = {'filename': filename, 'type': 'output'}
+            print(f"下载URL: {url}?filename={filename}&type=output")
 
             output_file = os.path.join(output_path, filename)
-            with open(output_file, 'wb') as f:
-                f.write(response.content)
+            part_file = output_file + '.part'
+
+            max_attempts = self.retry_policies['download'].max_attempts
+            retry_statuses = self.retry_policies['download'].retry_statuses
+            self.retry_budget.deposit()
+            attempt = 1
+            while True:
+                offset = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+                headers = {'Range': f'bytes={offset}-'} if offset else {}
+                retry_after = None
+                try:
+                    with self._send('download', 'GET', url, params=params, headers=headers,
+                                    stream=True, timeout=120) as response:
+                        if response.status_code == 416:
+                            # 临时文件已完整
+                            break
+                        if response.status_code in retry_statuses:
+                            reason, retry_after = str(response.status_code), _retry_after(response)
+                            error = requests.exceptions.HTTPError(
+                                f"{response.status_code} Server Error: {response.reason}", response=response)
+                        else:
+                            response.raise_for_status()
+                            # 服务器不支持Range时返回200，需要从头写入
+                            mode = 'ab' if offset and response.status_code == 206 else 'wb'
+                            with open(part_file, mode) as f:
+                                for chunk in response.iter_content(chunk_size=chunk_size):
+                                    f.write(chunk)
+                                    self.metrics.inc('comfyui_client_received_bytes_total', len(chunk),
+                                                     endpoint='/view')
+                            break
+                except requests.exceptions.RequestException as e:
+                    reason, error = _failure_reason(e), e
+                    if reason is None:
+                        raise
+
+                if not self._retry_allowed('download', attempt, reason, url, retry_after):
+                    raise error
+                print(f"下载中断，准备续传 ({attempt}/{max_attempts}): {error}")
+                attempt += 1
+
+            os.replace(part_file, output_file)
             print(f"文件已保存到: {output_file}")
             return output_file
 
@@ -191,10 +760,63 @@ class ComfyUIAPI:
             print(f"下载文件时出错: {e}")
             return None
 
+    def download_outputs(self, filenames: List[str], output_path: str = "./output/",
+                         max_workers: int = 4) -> List[Optional[str]]:
+        """并行下载多个输出文件，返回值与filenames一一对应"""
+        if len(filenames) <= 1:
+            return [self.download_output(name, output_path) for name in filenames]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(filenames))) as executor:
+            return list(executor.map(lambda name: self.download_output(name, output_path), filenames))
+
     def close(self):
-        """关闭session"""
+        """关闭WebSocket、session并保存上传索引"""
+        with self._ws_lock:
+            ws, self._ws = self._ws, None
+        if ws is not None:
+            # 监听线程阻塞在recv中并持有读锁，close()会等待服务器的关闭帧而卡住；
+            # abort直接关闭socket唤醒监听线程，由其负责关闭连接
+            ws.abort()
         if hasattr(self, 'session'):
             self.session.close()
+        if self.upload_cache:
+            self.upload_cache.save()
+
+
+def _remaining(deadline: Optional[float]) -> float:
+    """距离截止时间的剩余秒数，无截止时间时返回inf"""
+    if deadline is None:
+        return float('inf')
+    return max(deadline - time.monotonic(), 0.0)
+
+
+def _check_deadline(prompt_id: str, deadline: Optional[float]):
+    """超过截止时间时抛出TimeoutError"""
+    if deadline is not None and time.monotonic() >= deadline:
+        raise TimeoutError(f"等待任务 {prompt_id} 超时")
+
+
+def find_load_image_node(workflow: Dict[str, Any]) -> Optional[str]:
+    """返回第一个LoadImage节点的ID"""
+    for node_id, node_data in workflow.items():
+        if node_data.get('class_type') == 'LoadImage':
+            return node_id
+    return None
+
+
+def collect_output_files(history: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """从执行历史中收集所有输出文件的信息（filename、subfolder、type）"""
+    return [
+        file_info
+        for node_output in history.get('outputs', {}).values()
+        # 检查各种输出类型
+        for output_type in ['images', 'gifs', 'videos']
+        for file_info in node_output.get(output_type, [])
+    ]
+
+
+def collect_output_filenames(history: Dict[str, Any]) -> List[str]:
+    """从执行历史中收集所有输出文件名"""
+    return [file_info['filename'] for file_info in collect_output_files(history)]
 
 
 def load_workflow_from_file(workflow_path: str) -> Dict[str, Any]:
@@ -237,7 +859,9 @@ def update_workflow_parameters(
                     if section not in updated_workflow[node_id]:
                         updated_workflow[node_id][section] = {}
                     updated_workflow[node_id][section][param_key] = value
-                    print(f"更新节点 {node_id}.{section}.{param_key} = {value}")
+                    print(f"更新节点 {node_id}.{section}.{param_key} = {_preview(value)}")
+                else:
+                    print(f"⚠️  工作流中不存在节点 {node_id}，已忽略: {key}")
 
     return updated_workflow
 
@@ -247,46 +871,80 @@ def execute_workflow(
         workflow_path: str,
         image_path: Optional[str] = None,
         updates: Optional[Dict[str, Any]] = None,
-        output_dir: str = "./output/"
+        output_dir: str = "./output/",
+        wait_timeout: Optional[float] = None,
+        result_cache: Optional[ResultCache] = None,
+        front: bool = False
 ) -> Optional[str]:
-    """执行工作流"""
+    """执行工作流，指定result_cache时相同的任务直接返回缓存的输出
 
-    # 1. 测试连接
-    if not api.test_connection():
-        print("无法连接到ComfyUI服务器")
-        return None
+    front为True时插到服务器队列最前面；超过wait_timeout的任务会从服务器队列删除或中断。
 
-    # 2. 加载工作流
+    各阶段耗时记录在api.metrics中（stage标签: load_workflow、prepare、cache_lookup、
+    connection_test、upload、submit、queue_wait/execute、download、total）。
+    """
+    trace_id = str(uuid.uuid4())
+    mark = api.metrics.stage_timer(trace_id)
+    started = time.perf_counter()
+
+    # 1. 加载工作流
     print(f"加载工作流: {workflow_path}")
     workflow = load_workflow_from_file(workflow_path)
+    mark('load_workflow')
 
-    # 3. 上传图片（如果需要）
+    # 2. 按内容哈希确定图片在服务器上的文件名（如果需要）
+    image_digest = None
     if image_path:
-        print("正在上传图片...")
-        image_filename = os.path.basename(image_path)
-        if not api.upload_image(image_path):
-            print("图片上传失败")
+        if not os.path.exists(image_path):
+            print(f"图片文件不存在: {image_path}")
             return None
+        image_digest = api.upload_cache.digest(image_path) if api.upload_cache else file_digest(image_path)
+        image_filename = content_filename(image_digest, image_path)
 
         # 自动更新LoadImage节点
         if not updates:
             updates = {}
 
         # 查找LoadImage节点并更新
-        for node_id, node_data in workflow.items():
-            if node_data.get('class_type') == 'LoadImage':
-                updates[f'node_{node_id}_inputs_image'] = image_filename
-                break
+        load_image_node = find_load_image_node(workflow)
+        if load_image_node:
+            updates[f'node_{load_image_node}_inputs_image'] = image_filename
 
-    # 4. 更新工作流参数
+    # 3. 更新工作流参数
     if updates:
         print("更新工作流参数...")
         workflow = update_workflow_parameters(workflow, updates)
+    mark('prepare')
+
+    # 4. 查询结果缓存
+    cache_key = None
+    if result_cache:
+        cache_key = canonical_prompt_hash(workflow, [image_digest] if image_digest else [])
+        cached_files = result_cache.lookup(cache_key, output_dir)
+        mark('cache_lookup')
+        if cached_files:
+            print(f"命中结果缓存，跳过生成: {cache_key[:16]}")
+            api.metrics.record_span('total', started, time.perf_counter() - started, trace_id, cached='true')
+            return cached_files[0]
+
+    # 5. 测试连接
+    if not api.test_connection():
+        print("无法连接到ComfyUI服务器")
+        return None
+    mark('connection_test')
+
+    # 6. 上传图片（服务器已有相同内容时跳过）
+    if image_path:
+        print("正在上传图片...")
+        if not api.ensure_image(image_path):
+            print("图片上传失败")
+            return None
+        mark('upload')
 
-    # 5. 提交任务
+    # 7. 提交任务
     print("提交生成任务...")
     try:
-        result = api.queue_prompt(workflow)
+        result = api.queue_prompt(workflow, front=front, output_dir=output_dir)
 
         if 'prompt_id' not in result:
             print(f"提交任务失败: {result}")
@@ -294,23 +952,28 @@ def execute_workflow(
 
         prompt_id = result['prompt_id']
         print(f"任务已提交，ID: {prompt_id}")
+        mark('submit')
 
-        # 6. 等待完成
-        history = api.wait_for_completion(prompt_id)
+        # 8. 等待完成（排队和执行耗时由wait_for_completion记录）
+        try:
+            history = api.wait_for_completion(prompt_id, timeout=wait_timeout)
+        except TimeoutError:
+            # 超时的任务不再占用GPU
+            api.cancel(prompt_id)
+            raise
+        mark(None)
+        print_node_profile(api.pop_node_profile(prompt_id))
 
-        # 7. 获取生成的文件
-        output_files = []
-        for node_id in history.get('outputs', {}):
-            node_output = history['outputs'][node_id]
+        # 9. 获取生成的文件
+        filenames = collect_output_filenames(history)
+        output_files = [path for path in api.download_outputs(filenames, output_dir) if path]
+        mark('download')
+        if output_files and len(output_files) == len(filenames):
+            api.mark_downloaded(prompt_id, output_files)
+        api.metrics.record_span('total', started, time.perf_counter() - started, trace_id)
 
-            # 检查各种输出类型
-            for output_type in ['images', 'gifs', 'videos']:
-                if output_type in node_output:
-                    for file_info in node_output[output_type]:
-                        filename = file_info['filename']
-                        output_path = api.download_output(filename, output_dir)
-                        if output_path:
-                            output_files.append(output_path)
+        if result_cache and output_files and len(output_files) == len(filenames):
+            result_cache.store(cache_key, output_files)
 
         if output_files:
             print(f"生成了 {len(output_files)} 个文件")
@@ -324,6 +987,141 @@ def execute_workflow(
         return None
 
 
+# 预览时按比例缩小的分辨率参数
+PREVIEW_SIZE_KEYS = ('generation_width', 'generation_height', 'width', 'height')
+
+
+def preview_updates(workflow: Dict[str, Any], scale: float = 0.5, max_frames: int = 33,
+                    steps_ratio: float = 0.6) -> Dict[str, Any]:
+    """生成低成本预览版本的参数更新：降低分辨率、帧数和采样步数，种子和提示词不变
+
+    分辨率取16的倍数，帧数取4n+1（WanVideo的要求），输出文件名加 _preview 后缀。
+    """
+    updates = {}
+    for node_id, node in workflow.items():
+        inputs = node.get('inputs', {})
+        for key, value in inputs.items():
+            if key == 'filename_prefix' and isinstance(value, str):
+                updates[f'node_{node_id}_inputs_{key}'] = f"{value}_preview"
+                continue
+            if isinstance(value, bool) or not isinstance(value, int):
+                continue
+            if key in PREVIEW_SIZE_KEYS:
+                new_value = max(int(value * scale) // 16 * 16, 16)
+            elif key == 'num_frames':
+                new_value = (min(value, max_frames) - 1) // 4 * 4 + 1
+            elif key == 'steps':
+                new_value = max(round(value * steps_ratio), 1)
+            else:
+                continue
+            if new_value != value:
+                updates[f'node_{node_id}_inputs_{key}'] = new_value
+    return updates
+
+
+def _collect_outputs(api: ComfyUIAPI, prompt_id: str, output_dir: str,
+                     wait_timeout: Optional[float]) -> List[str]:
+    """等待任务完成并下载全部输出，超时的任务从服务器取消"""
+    try:
+        history = api.wait_for_completion(prompt_id, timeout=wait_timeout)
+    except TimeoutError:
+        api.cancel(prompt_id)
+        raise
+    print_node_profile(api.pop_node_profile(prompt_id))
+    filenames = collect_output_filenames(history)
+    output_files = [path for path in api.download_outputs(filenames, output_dir) if path]
+    if not filenames or len(output_files) != len(filenames):
+        raise RuntimeError("未找到生成的文件或部分文件下载失败")
+    api.mark_downloaded(prompt_id, output_files)
+    return output_files
+
+
+def execute_preview_then_final(
+        api: ComfyUIAPI,
+        workflow_path: str,
+        image_path: Optional[str] = None,
+        updates: Optional[Dict[str, Any]] = None,
+        output_dir: str = "./output/",
+        wait_timeout: Optional[float] = None,
+        result_cache: Optional[ResultCache] = None,
+        accept: Optional[Callable[[str], bool]] = None,
+        preview_scale: float = 0.5,
+        preview_max_frames: int = 33,
+        preview_steps_ratio: float = 0.6
+) -> Tuple[Optional[str], Optional[str]]:
+    """两阶段执行：先渲染低分辨率预览，再以相同种子渲染完整版本，返回(预览文件, 最终文件)
+
+    accept为None时完整渲染紧跟在预览之后提交，不等待预览结果；
+    否则预览下载后调用accept(预览文件)，返回True才提交完整渲染。
+    """
+    trace_id = str(uuid.uuid4())
+    started = time.perf_counter()
+    try:
+        workflow = load_workflow_from_file(workflow_path)
+        updates = dict(updates) if updates else {}
+        image_digest = None
+        if image_path:
+            image_digest = api.upload_cache.digest(image_path) if api.upload_cache else file_digest(image_path)
+            load_image_node = find_load_image_node(workflow)
+            if load_image_node:
+                updates[f'node_{load_image_node}_inputs_image'] = content_filename(image_digest, image_path)
+        final_prompt = update_workflow_parameters(workflow, updates) if updates else workflow
+        preview_prompt = update_workflow_parameters(
+            final_prompt, preview_updates(final_prompt, preview_scale, preview_max_frames, preview_steps_ratio))
+
+        cache_key = None
+        if result_cache:
+            cache_key = canonical_prompt_hash(final_prompt, [image_digest] if image_digest else [])
+            cached_files = result_cache.lookup(cache_key, output_dir)
+            if cached_files:
+                print(f"命中结果缓存，跳过预览和生成: {cache_key[:16]}")
+                return None, cached_files[0]
+
+        if image_path and not api.ensure_image(image_path):
+            print("图片上传失败")
+            return None, None
+
+        # 预览插到队首，尽快返回给用户
+        preview_id = api.queue_prompt(preview_prompt, front=True, output_dir=output_dir)['prompt_id']
+        print(f"预览任务已提交，ID: {preview_id}")
+        final_id = None
+        if accept is None:
+            final_id = api.queue_prompt(final_prompt, output_dir=output_dir)['prompt_id']
+            print(f"完整渲染已提交，ID: {final_id}")
+
+        try:
+            with api.metrics.span('preview', trace_id):
+                preview_file = _collect_outputs(api, preview_id, output_dir, wait_timeout)[0]
+        except Exception as e:
+            print(f"预览失败: {e}")
+            if final_id:
+                api.cancel(final_id)
+            return None, None
+        print(f"🔍 预览文件: {preview_file}")
+
+        if final_id is None:
+            if not accept(preview_file):
+                print("未接受预览，跳过完整渲染")
+                return preview_file, None
+            final_id = api.queue_prompt(final_prompt, output_dir=output_dir)['prompt_id']
+            print(f"完整渲染已提交，ID: {final_id}")
+
+        try:
+            with api.metrics.span('final', trace_id):
+                output_files = _collect_outputs(api, final_id, output_dir, wait_timeout)
+        except Exception as e:
+            print(f"完整渲染失败: {e}")
+            return preview_file, None
+        if result_cache:
+            result_cache.store(cache_key, output_files)
+        return preview_file, output_files[0]
+    except Exception as e:
+        print(f"执行工作流时出错: {e}")
+        return None, None
+    finally:
+        api.metrics.record_span('total', started, time.perf_counter() - started, trace_id, mode='preview')
+
+
 def parse_arguments():
     """解析命令行参数"""
     parser = argparse.ArgumentParser(
@@ -333,12 +1131,16 @@ def parse_arguments():
 使用示例:
   python main.py -w workflow.json -i image.jpg --update node_49_inputs_positive_prompt="A woman smiling"
   python main.py -w workflow.json --server 192.168.1.100:8188 --update node_52_inputs_steps=20
+  python main.py -w workflow.json --batch jobs.jsonl --max-in-flight 8 --results ./output/results.jsonl
+  python main.py -w t2v.json --batch mixed_jobs.jsonl --server pod1:8188,pod2:8188 --max-in-flight 2
+  python main.py -w workflow.json -i image.jpg --preview --update node_52_inputs_seed=42
+  python main.py -w workflow.json --sweep node_27_inputs_seed=1..8 --sweep node_27_inputs_cfg=5..7..0.5
         """
     )
 
     # 必需参数
-    parser.add_argument('-w', '--workflow', required=True,
-                        help='工作流JSON文件路径')
+    parser.add_argument('-w', '--workflow',
+                        help='工作流JSON文件路径（--resume时不需要）')
 
     # 可选参数
     parser.add_argument('-i', '--image',
@@ -346,9 +1148,21 @@ def parse_arguments():
 
     # 服务器配置
     parser.add_argument('--server', default='127.0.0.1:8188',
-                        help='ComfyUI服务器地址 (默认: 127.0.0.1:8188)')
+                        help='ComfyUI服务器地址，多个地址用逗号分隔时按队列深度负载均衡 (默认: 127.0.0.1:8188)')
     parser.add_argument('--timeout', type=int, default=30,
                         help='请求超时时间(秒) (默认: 30)')
+    parser.add_argument('--wait-timeout', type=float,
+                        help='等待任务完成的整体超时时间(秒) (默认: 不限)')
+    parser.add_argument('--no-websocket', action='store_true',
+                        help='不使用WebSocket事件，轮询任务状态')
+    parser.add_argument('--compress-requests', action='store_true',
+                        help='gzip压缩提交的工作流（长提示词、大批量提交时减少上行流量）')
+    parser.add_argument('--front', action='store_true',
+                        help='插到服务器队列最前面（紧急任务）')
+    parser.add_argument('--preview', action='store_true',
+                        help='先渲染低分辨率、少帧数、少步数的预览，确认后再以相同种子完整渲染')
+    parser.add_argument('--preview-auto', action='store_true',
+                        help='与--preview一起使用：不等待确认，完整渲染紧跟预览提交')
 
     # 参数更新
     parser.add_argument('--update', action='append',
@@ -358,41 +1172,394 @@ def parse_arguments():
     parser.add_argument('-o', '--output', default='./output/',
                         help='输出目录 (默认: ./output/)')
 
+    # 批量执行
+    parser.add_argument('--batch',
+                        help='批量执行JSONL任务文件，每行包含id/updates/image/output；'
+                             '指定多个服务器时按模型分组调度，减少模型切换')
+    parser.add_argument('--max-in-flight', type=int, default=4,
+                        help='批量模式下同时在途的任务数，多服务器时为每个服务器的在途数 (默认: 4)')
+    parser.add_argument('--priority-lanes', action='store_true',
+                        help='批量模式下按任务的priority/deadline/urgent字段在本地排队，服务器等待数低于--watermark时才提交')
+    parser.add_argument('--watermark', type=int, default=1,
+                        help='--priority-lanes时每个服务器允许的等待任务数 (默认: 1)')
+    parser.add_argument('--sweep', action='append',
+                        help='参数扫描，可多次指定，格式: node_ID_section_key=1,2,3 或 start..stop[..step]')
+    parser.add_argument('--chain',
+                        help='多工作流串联文件(JSON)，上游阶段的输出在服务器端直接作为下游LoadImage的输入，'
+                             '各阶段自带工作流，不需要-w')
+    parser.add_argument('--results',
+                        help='批量模式结果文件，已成功的任务在重新运行时跳过 (默认: 输出目录/results.jsonl)')
+
+    # 任务日志
+    parser.add_argument('--journal', default=DEFAULT_JOURNAL_PATH,
+                        help=f'任务日志文件，记录已提交的任务以便进程退出后恢复 (默认: {DEFAULT_JOURNAL_PATH})')
+    parser.add_argument('--no-journal', action='store_true',
+                        help='不记录任务日志')
+    parser.add_argument('--resume', action='store_true',
+                        help='恢复任务日志中未完成的任务：重新接上仍在执行的任务并下载缺失的输出')
+
+    # 后处理
+    parser.add_argument('--postprocess',
+                        help='输出后处理步骤，逗号分隔，按顺序执行: checksum,thumbnail,remux,transcode,store')
+    parser.add_argument('--storage-dir',
+                        help='store步骤的存储根目录（如OSS存储卷的挂载点），文件放在其下的output/目录')
+    parser.add_argument('--postprocess-workers', type=int, default=2,
+                        help='后处理进程数 (默认: 2)')
+
+    # 上传缓存
+    parser.add_argument('--upload-index', default=DEFAULT_INDEX_PATH,
+                        help=f'已上传图片的本地索引文件 (默认: {DEFAULT_INDEX_PATH})')
+    parser.add_argument('--no-upload-cache', action='store_true',
+                        help='不使用本地上传索引（仍按内容哈希命名并检查服务器是否已有）')
+    parser.add_argument('--preprocess-image', action='store_true',
+                        help='上传前按工作流的generation_width/height缩小并重新编码输入图片（需要Pillow）')
+    parser.add_argument('--image-cache', default=DEFAULT_IMAGE_CACHE_DIR,
+                        help=f'预处理后图片的缓存目录 (默认: {DEFAULT_IMAGE_CACHE_DIR})')
+
+    # 结果缓存
+    parser.add_argument('--result-cache', default=DEFAULT_RESULT_CACHE_DIR,
+                        help=f'结果缓存目录，相同的任务直接返回缓存的输出 (默认: {DEFAULT_RESULT_CACHE_DIR})')
+    parser.add_argument('--result-cache-size', type=int, default=5120,
+                        help='结果缓存上限(MB) (默认: 5120)')
+    parser.add_argument('--no-result-cache', action='store_true',
+                        help='不使用结果缓存，总是重新生成')
+
+    # 耗时统计
+    parser.add_argument('--metrics-file',
+                        help='结束时写入Prometheus文本格式的耗时指标')
+    parser.add_argument('--trace-file',
+                        help='结束时写入JSON trace（Chrome trace格式）')
+    parser.add_argument('--metrics-port', type=int,
+                        help='运行期间在该端口提供 /metrics 接口')
+
     # 其他选项
+    parser.add_argument('--progress', action='store_true',
+                        help='打印采样等节点的步骤进度（需要WebSocket）')
+    parser.add_argument('--profile', action='store_true',
+                        help='结束时按节点类型打印执行耗时的平均值和p95（需要WebSocket）')
     parser.add_argument('--verbose', action='store_true',
                         help='显示详细信息')
     parser.add_argument('--test-only', action='store_true',
                         help='仅测试连接，不执行生成')
+    parser.add_argument('--no-validate', action='store_true',
+                        help='跳过提交前的本地工作流校验')
+    parser.add_argument('--check-server', action='store_true',
+                        help='按服务器的 /object_info 转换更新参数的类型，并校验节点类型、输入类型和可选值（结果缓存在本地）')
+    parser.add_argument('--refresh-object-info', action='store_true',
+                        help='忽略本地缓存，重新获取服务器的节点定义')
     parser.add_argument('--dry-run', action='store_true',
                         help='显示更新后的工作流，不执行')
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if not args.workflow and not args.resume and not args.chain:
+        parser.error("需要指定 -w/--workflow")
+    return args
+
+
+def parse_value(value: str) -> Any:
+    """将命令行中的参数值转换为bool/int/float/列表，无法转换时保持字符串
+
+    不知道目标输入的类型，只能按字面猜测；有服务器节点定义时按定义转换（见object_info.coerce_value）。
+    """
+    text = value.strip()
+    if text.lower() in ('true', 'false'):
+        return text.lower() == 'true'
+    # 下划线分隔的数字（1_000）和nan/inf按字符串处理，更可能是文件名或提示词
+    if text and '_' not in text:
+        try:
+            return int(text)
+        except ValueError:
+            pass
+        try:
+            number = float(text)
+            if math.isfinite(number):
+                return number
+        except ValueError:
+            pass
+    if text[:1] in ('[', '{'):
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            pass
+    return value
 
 
-def parse_updates(update_list: Optional[list]) -> Dict[str, Any]:
-    """解析更新参数"""
+def parse_updates(update_list: Optional[list], typed: bool = True) -> Dict[str, Any]:
+    """解析更新参数，typed为False时保留原始字符串（由节点定义转换类型）"""
     updates = {}
     if update_list:
         for update in update_list:
             if '=' in update:
                 key, value = update.split('=', 1)
-                # 尝试转换数据类型
-                try:
-                    if value.lower() in ['true', 'false']:
-                        value = value.lower() == 'true'
-                    elif value.isdigit():
-                        value = int(value)
-                    elif '.' in value and value.replace('.', '').replace('-', '').isdigit():
-                        value = float(value)
-                except:
-                    pass  # 保持字符串类型
-                updates[key] = value
+                updates[key] = parse_value(value) if typed else value
     return updates
 
 
+def fetch_object_info(args) -> Optional[Dict[str, Any]]:
+    """获取第一个服务器的节点定义（本地缓存），获取失败时返回None"""
+    from object_info import ObjectInfoCache
+
+    server = args.server.split(',')[0].strip()
+    api = ComfyUIAPI(server, timeout=args.timeout, use_websocket=False)
+    try:
+        object_info = ObjectInfoCache().get(api, refresh=args.refresh_object_info)
+    finally:
+        api.close()
+    if object_info is None:
+        print("⚠️  无法获取服务器节点定义，仅做本地校验")
+    return object_info
+
+
+def validate_before_submit(args, updates: Dict[str, Any], object_info: Optional[Dict[str, Any]] = None) -> bool:
+    """校验工作流和更新参数，有服务器节点定义时同时按定义校验"""
+    from validator import validate_workflow
+
+    try:
+        with open(args.workflow, 'r', encoding='utf-8') as f:
+            workflow = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"❌ 无法读取工作流: {e}")
+        return False
+
+    # 批量任务各自带有更新参数和图片，这里只校验工作流本身
+    report = validate_workflow(
+        workflow,
+        updates=None if args.batch else updates,
+        image_path=args.image,
+        object_info=object_info,
+        extra_update_keys=[spec.split('=', 1)[0] for spec in args.sweep or []]
+    )
+    report.show()
+    return report.ok
+
+
+def make_result_cache(args) -> Optional[ResultCache]:
+    """根据命令行参数创建结果缓存"""
+    if args.no_result_cache:
+        return None
+    return ResultCache(args.result_cache, max_bytes=args.result_cache_size * 1024 * 1024)
+
+
+def make_postprocessor(args):
+    """根据命令行参数创建后处理进程池，未指定--postprocess时返回None"""
+    if not args.postprocess:
+        return None
+    from postprocess import PostProcessor
+
+    steps = [step.strip() for step in args.postprocess.split(',') if step.strip()]
+    return PostProcessor(steps, options={'storage_dir': args.storage_dir}, max_workers=args.postprocess_workers)
+
+
+def postprocess_output(postprocessor, output_file: str) -> Optional[str]:
+    """单任务模式下直接等待后处理完成，返回处理后的文件路径，失败时返回None"""
+    from postprocess import print_result
+
+    result = postprocessor.process(output_file)
+    print_result(result)
+    return None if result['error'] else result['path']
+
+
+def export_metrics(args, metrics: Metrics):
+    """按命令行参数导出耗时指标和trace"""
+    if args.metrics_file:
+        metrics.write_prometheus(args.metrics_file)
+        print(f"指标已写入: {args.metrics_file}")
+    if args.trace_file:
+        metrics.write_trace(args.trace_file)
+        print(f"Trace已写入: {args.trace_file}")
+    if args.verbose or args.profile or args.metrics_file or args.trace_file or args.metrics_port:
+        metrics.print_summary()
+
+
+def _record_batch_result(entry: Dict[str, Any], outputs: List[str]):
+    """批量任务恢复后补写结果行，重新运行--batch时跳过该任务"""
+    from batch import write_result
+
+    record = {'id': entry['job_id'], 'status': 'success', 'prompt_id': entry['prompt_id'], 'outputs': outputs,
+              'error': None, 'resumed': True, 'timings': {'total': 0}}
+    with open(entry['results_path'], 'a', encoding='utf-8') as f:
+        write_result(f, record)
+
+
+def _resume_one(api: ComfyUIAPI, entry: Dict[str, Any], output_dir: str,
+                wait_timeout: Optional[float]) -> bool:
+    """恢复单个任务，返回输出是否已全部下载"""
+    prompt_id = entry['prompt_id']
+    journal = api.journal
+    try:
+        history = api.get_history(prompt_id)
+        if prompt_id in history:
+            history = history[prompt_id]
+        else:
+            queue = api.get_queue()
+            queued = queue.get('queue_running', []) + queue.get('queue_pending', [])
+            if not any(item[1] == prompt_id for item in queued):
+                print(f"❌ 服务器上找不到任务 {prompt_id}（服务器可能已重启）")
+                journal.record(prompt_id, 'lost')
+                return False
+            print(f"任务 {prompt_id} 仍在服务器上，继续等待")
+            history = api.wait_for_completion(prompt_id, timeout=wait_timeout)
+
+        if history.get('status', {}).get('status_str') == 'error':
+            print(f"❌ 任务 {prompt_id} 在服务器端执行失败")
+            journal.record(prompt_id, 'failed', error='服务器端执行失败')
+            return False
+
+        filenames = collect_output_filenames(history)
+        outputs = api.download_outputs(filenames, entry.get('output_dir') or output_dir)
+        if filenames and all(outputs):
+            api.mark_downloaded(prompt_id, outputs)
+            if entry.get('job_id') and entry.get('results_path'):
+                _record_batch_result(entry, outputs)
+            print(f"✅ 已恢复任务 {prompt_id}: {len(outputs)} 个文件")
+            return True
+        print(f"❌ 任务 {prompt_id} 的输出未能全部下载，下次--resume时重试")
+    except Exception as e:
+        print(f"❌ 恢复任务 {prompt_id} 失败: {e}")
+    return False
+
+
+def resume_jobs(journal: JobJournal, output_dir: str = "./output/", timeout: int = 30,
+                wait_timeout: Optional[float] = None, metrics: Optional[Metrics] = None) -> int:
+    """重新接上任务日志中未完成的任务：已结束的直接下载输出，仍在排队或执行的继续等待，返回退出码
+
+    原客户端的clientId已失效，收不到WebSocket事件，因此恢复时轮询任务状态。
+    """
+    pending = journal.pending()
+    if not pending:
+        print("没有需要恢复的任务")
+        return 0
+    print(f"需要恢复的任务: {len(pending)} 个")
+
+    apis: Dict[str, ComfyUIAPI] = {}
+    for entry in pending:
+        if entry['server'] not in apis:
+            apis[entry['server']] = ComfyUIAPI(entry['server'], timeout=timeout, use_websocket=False,
+                                               metrics=metrics, journal=journal)
+    try:
+        with ThreadPoolExecutor(max_workers=min(len(pending), 8)) as executor:
+            results = list(executor.map(
+                lambda entry: _resume_one(apis[entry['server']], entry, output_dir, wait_timeout), pending))
+    finally:
+        for api in apis.values():
+            api.close()
+        journal.compact()
+
+    print(f"恢复结束: 成功 {sum(results)} 个，失败 {len(results) - sum(results)} 个")
+    return 0 if all(results) else 1
+
+
+def run_priority_lanes(args, servers: List[str], metrics: Metrics, journal: Optional[JobJournal] = None,
+                       postprocessor=None, object_info: Optional[Dict[str, Any]] = None) -> int:
+    """优先级批量模式：本地按优先级和截止时间排队，保持各服务器队列很短"""
+    from dispatcher import run_priority_batch
+
+    upload_cache = None if args.no_upload_cache else UploadCache(args.upload_index)
+    apis = [ComfyUIAPI(server, timeout=args.timeout, use_websocket=not args.no_websocket,
+                       upload_cache=upload_cache, metrics=metrics, journal=journal,
+                       compress_requests=args.compress_requests) for server in servers]
+    try:
+        failed = run_priority_batch(apis, args.batch, args.workflow,
+                                    args.results or os.path.join(args.output, 'results.jsonl'),
+                                    output_dir=args.output, watermark=args.watermark,
+                                    wait_timeout=args.wait_timeout, result_cache=make_result_cache(args),
+                                    object_info=object_info, postprocessor=postprocessor)
+        return 0 if failed == 0 else 1
+    except KeyboardInterrupt:
+        print("\n⚠️  用户中断操作，重新运行将跳过已完成的任务")
+        return 1
+    finally:
+        for api in apis:
+            api.close()
+        export_metrics(args, metrics)
+
+
+def run_affinity_batch(args, servers: List[str], metrics: Metrics, journal: Optional[JobJournal] = None,
+                       postprocessor=None, image_preprocessor: Optional[ImagePreprocessor] = None,
+                       object_info: Optional[Dict[str, Any]] = None) -> int:
+    """多服务器批量模式：按模型签名把任务分组调度到各个Pod"""
+    from pool import ComfyUIPool
+    from scheduler import AffinityScheduler
+
+    pool = ComfyUIPool(servers, timeout=args.timeout, use_websocket=not args.no_websocket,
+                       upload_cache=None if args.no_upload_cache else UploadCache(args.upload_index),
+                       metrics=metrics, journal=journal, compress_requests=args.compress_requests)
+    try:
+        scheduler = AffinityScheduler(
+            pool,
+            workflow_path=args.workflow,
+            results_path=args.results or os.path.join(args.output, 'results.jsonl'),
+            output_dir=args.output,
+            per_pod_in_flight=args.max_in_flight,
+            wait_timeout=args.wait_timeout,
+            result_cache=make_result_cache(args),
+            postprocessor=postprocessor,
+            image_preprocessor=image_preprocessor,
+            object_info=object_info
+        )
+        return 0 if scheduler.run(args.batch) == 0 else 1
+    except KeyboardInterrupt:
+        print("\n⚠️  用户中断操作，重新运行将跳过已完成的任务")
+        return 1
+    finally:
+        pool.close()
+        export_metrics(args, metrics)
+
+
 def main():
     """主函数"""
     args = parse_arguments()
+    metrics = Metrics()
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+
+    journal = None
+    if not args.no_journal:
+        journal = JobJournal(args.journal)
+        atexit.register(journal.close)
+
+    # 恢复上次未完成的任务
+    if args.resume:
+        if journal is None:
+            print("错误: --resume 需要任务日志，不能与 --no-journal 同时使用")
+            return 1
+        try:
+            return resume_jobs(journal, output_dir=args.output, timeout=args.timeout,
+                               wait_timeout=args.wait_timeout, metrics=metrics)
+        except KeyboardInterrupt:
+            print("\n⚠️  用户中断操作，未完成的任务仍保留在任务日志中")
+            return 1
+        finally:
+            export_metrics(args, metrics)
+
+    # 多工作流串联
+    if args.chain:
+        import asyncio
+        from chain import run_chain
+
+        if not os.path.exists(args.chain):
+            print(f"错误: 串联文件不存在: {args.chain}")
+            return 1
+        try:
+            return asyncio.run(run_chain(
+                servers=[server.strip() for server in args.server.split(',') if server.strip()],
+                chain_path=args.chain,
+                results_path=args.results or os.path.join(args.output, 'chain_results.jsonl'),
+                output_dir=args.output,
+                timeout=args.timeout,
+                wait_timeout=args.wait_timeout,
+                use_websocket=not args.no_websocket,
+                upload_cache=None if args.no_upload_cache else UploadCache(args.upload_index),
+                metrics=metrics,
+                journal=journal,
+                object_info=fetch_object_info(args) if args.check_server else None,
+                compress_requests=args.compress_requests
+            ))
+        except KeyboardInterrupt:
+            print("\n⚠️  用户中断操作")
+            return 1
+        finally:
+            export_metrics(args, metrics)
 
     # 验证文件存在
     if not os.path.exists(args.workflow):
@@ -417,6 +1584,22 @@ def main():
         print(f"输出目录: {args.output}")
         print("================\n")
 
+    # 有服务器节点定义时，按每个输入的类型转换更新参数并检查范围
+    object_info = fetch_object_info(args) if args.check_server else None
+    if object_info is not None and updates:
+        from object_info import coerce_updates
+
+        try:
+            updates = coerce_updates(load_workflow_from_file(args.workflow),
+                                     parse_updates(args.update, typed=False), object_info)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return 1
+
+    # 提交前校验，避免无效的任务占用服务器队列
+    if not args.no_validate and not validate_before_submit(args, updates, object_info):
+        return 1
+
     # Dry run模式
     if args.dry_run:
         try:
@@ -430,9 +1613,143 @@ def main():
             print(f"Dry run失败: {e}")
             return 1
 
+    servers = [server.strip() for server in args.server.split(',') if server.strip()]
+
+    try:
+        postprocessor = make_postprocessor(args)
+    except ValueError as e:
+        print(f"错误: {e}")
+        return 1
+    if postprocessor:
+        atexit.register(postprocessor.close)
+
+    image_preprocessor = ImagePreprocessor(args.image_cache) if args.preprocess_image else None
+    if image_preprocessor and args.image and not args.batch:
+        try:
+            size = target_size(load_workflow_from_file(args.workflow), updates)
+        except Exception:
+            size = None  # 工作流错误在执行时报告
+        args.image = image_preprocessor.prepare(args.image, size)
+
+    # 批量模式
+    if args.batch:
+        import asyncio
+        from batch import run_batch
+
+        if not os.path.exists(args.batch):
+            print(f"错误: 任务文件不存在: {args.batch}")
+            return 1
+        if args.priority_lanes:
+            return run_priority_lanes(args, servers, metrics, journal, postprocessor, object_info)
+        if len(servers) > 1:
+            return run_affinity_batch(args, servers, metrics, journal, postprocessor, image_preprocessor, object_info)
+        try:
+            return asyncio.run(run_batch(
+                server_address=args.server,
+                jobs_path=args.batch,
+                workflow_path=args.workflow,
+                results_path=args.results or os.path.join(args.output, 'results.jsonl'),
+                output_dir=args.output,
+                max_in_flight=args.max_in_flight,
+                timeout=args.timeout,
+                wait_timeout=args.wait_timeout,
+                use_websocket=not args.no_websocket,
+                upload_cache=None if args.no_upload_cache else UploadCache(args.upload_index),
+                result_cache=make_result_cache(args),
+                metrics=metrics,
+                journal=journal,
+                postprocessor=postprocessor,
+                image_preprocessor=image_preprocessor,
+                object_info=object_info,
+                compress_requests=args.compress_requests
+            ))
+        except KeyboardInterrupt:
+            print("\n⚠️  用户中断操作，重新运行将跳过已完成的任务")
+            return 1
+        finally:
+            export_metrics(args, metrics)
+
+    # 参数扫描
+    if args.sweep:
+        import asyncio
+        from sweep import run_sweep
+
+        if len(servers) > 1:
+            print("错误: 参数扫描仅支持单个服务器地址")
+            return 1
+        try:
+            return asyncio.run(run_sweep(
+                server_address=args.server,
+                workflow_path=args.workflow,
+                sweep_specs=args.sweep,
+                results_path=args.results or os.path.join(args.output, 'sweep_results.jsonl'),
+                base_updates=updates,
+                image_path=args.image,
+                output_dir=args.output,
+                max_in_flight=args.max_in_flight,
+                timeout=args.timeout,
+                wait_timeout=args.wait_timeout,
+                use_websocket=not args.no_websocket,
+                upload_cache=None if args.no_upload_cache else UploadCache(args.upload_index),
+                result_cache=make_result_cache(args),
+                metrics=metrics,
+                journal=journal,
+                postprocessor=postprocessor,
+                object_info=object_info,
+                compress_requests=args.compress_requests
+            ))
+        except KeyboardInterrupt:
+            print("\n⚠️  用户中断操作，重新运行将跳过已完成的组合")
+            return 1
+        finally:
+            export_metrics(args, metrics)
+
+    # 多服务器负载均衡
+    if len(servers) > 1:
+        from pool import ComfyUIPool
+
+        pool = ComfyUIPool(servers, timeout=args.timeout, use_websocket=not args.no_websocket,
+                           upload_cache=None if args.no_upload_cache else UploadCache(args.upload_index),
+                           metrics=metrics, journal=journal, on_progress=print_progress if args.progress else None,
+                           compress_requests=args.compress_requests)
+        try:
+            if args.test_only:
+                pool.refresh()
+                healthy = [pod.api.server_address for pod in pool.pods if pod.healthy]
+                print(f"可用服务器: {len(healthy)}/{len(pool.pods)} {healthy}")
+                return 0 if healthy else 1
+
+            output_file = pool.execute_workflow(
+                workflow_path=args.workflow,
+                image_path=args.image,
+                updates=updates,
+                output_dir=args.output,
+                wait_timeout=args.wait_timeout,
+                result_cache=make_result_cache(args),
+                front=args.front
+            )
+            if output_file and postprocessor:
+                output_file = postprocess_output(postprocessor, output_file)
+            if output_file:
+                print(f"\n✅ 任务执行成功！")
+                print(f"📁 输出文件: {output_file}")
+                return 0
+            print("\n❌ 任务执行失败")
+            return 1
+        except KeyboardInterrupt:
+            print("\n⚠️  用户中断操作")
+            return 1
+        finally:
+            pool.close()
+            export_metrics(args, metrics)
+
     # 初始化API客户端
     try:
-        api = ComfyUIAPI(args.server, timeout=args.timeout)
+        upload_cache = None if args.no_upload_cache else UploadCache(args.upload_index)
+        api = ComfyUIAPI(args.server, timeout=args.timeout, use_websocket=not args.no_websocket,
+                         upload_cache=upload_cache, metrics=metrics, journal=journal,
+                         on_progress=print_progress if args.progress else None,
+                         compress_requests=args.compress_requests)
         print(f"连接到ComfyUI服务器: {args.server}")
 
         # 仅测试连接
@@ -450,13 +1767,41 @@ def main():
 
     # 执行工作流
     try:
+        if args.preview:
+            def confirm(preview_file: str) -> bool:
+                answer = input(f"预览已生成: {preview_file}\n是否继续完整渲染? [y/N] ")
+                return answer.strip().lower() in ('y', 'yes')
+
+            preview_file, output_file = execute_preview_then_final(
+                api=api,
+                workflow_path=args.workflow,
+                image_path=args.image,
+                updates=updates,
+                output_dir=args.output,
+                wait_timeout=args.wait_timeout,
+                result_cache=make_result_cache(args),
+                accept=None if args.preview_auto else confirm
+            )
+            if output_file and postprocessor:
+                output_file = postprocess_output(postprocessor, output_file)
+            if output_file:
+                print(f"\n✅ 任务执行成功！")
+                print(f"📁 输出文件: {output_file}")
+                return 0
+            return 0 if preview_file else 1
+
         output_file = execute_workflow(
             api=api,
             workflow_path=args.workflow,
             image_path=args.image,
             updates=updates,
-            output_dir=args.output
+            output_dir=args.output,
+            wait_timeout=args.wait_timeout,
+            result_cache=make_result_cache(args),
+            front=args.front
         )
+        if output_file and postprocessor:
+            output_file = postprocess_output(postprocessor, output_file)
 
         if output_file:
             print(f"\n✅ 任务执行成功！")
@@ -475,6 +1820,7 @@ def main():
     finally:
         # 清理资源
         api.close()
+        export_metrics(args, metrics)
 
 
 if __name__ == "__main__":
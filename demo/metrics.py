@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+客户端耗时统计
+记录execute_workflow各阶段和每个HTTP请求的耗时，导出为Prometheus文本格式和JSON trace
+（Chrome trace格式，可在 chrome://tracing 或 Perfetto 中查看）。
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, List, Tuple
+from urllib.parse import urlparse
+
+# 覆盖从毫秒级HTTP请求到数十分钟的GPU渲染
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def endpoint_label(url: str) -> str:
+    """将URL归一为低基数的接口名，如 /history/<id> -> /history"""
+    path = urlparse(url).path or '/'
+    if path.startswith('/history/'):
+        return '/history'
+    return path
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+        # 保留最近的样本用于计算分位数
+        self.samples = deque(maxlen=10000)
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += value
+        self.count += 1
+        self.samples.append(value)
+
+
+class Metrics:
+    """线程安全的指标注册表"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, max_spans: int = 100000):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = defaultdict(dict)
+        self._counters: Dict[str, Dict[LabelKey, float]] = defaultdict(lambda: defaultdict(float))
+        self._spans = deque(maxlen=max_spans)
+        self._origin = time.perf_counter()
+
+    def observe(self, name: str, value: float, **labels):
+        """记录一个耗时样本(秒)"""
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            histogram = self._histograms[name].get(key)
+            if histogram is None:
+                histogram = self._histograms[name][key] = _Histogram(self.buckets)
+            histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """计数器加一"""
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            self._counters[name][key] += amount
+
+    def record_span(self, stage: str, start: float, duration: float, trace_id: Optional[str] = None, **labels):
+        """记录一个阶段：写入直方图comfyui_client_stage_seconds并保存trace"""
+        self.observe('comfyui_client_stage_seconds', duration, stage=stage, **labels)
+        self.add_trace_event(stage, start, duration, trace_id, **labels)
+
+    def add_trace_event(self, name: str, start: float, duration: float, trace_id: Optional[str] = None, **labels):
+        """只写入trace，不计入阶段直方图（如服务器端各节点的执行时间）"""
+        with self._lock:
+            self._spans.append({
+                'name': name,
+                'ts': (start - self._origin) * 1e6,
+                'dur': duration * 1e6,
+                'tid': threading.get_ident(),
+                'args': dict(labels, trace_id=trace_id) if trace_id else dict(labels),
+            })
+
+    @contextmanager
+    def span(self, stage: str, trace_id: Optional[str] = None, **labels):
+        """计时上下文，异常时同样记录并标记error"""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            labels['error'] = 'true'
+            raise
+        finally:
+            self.record_span(stage, start, time.perf_counter() - start, trace_id, **labels)
+
+    def stage_timer(self, trace_id: Optional[str] = None, **labels):
+        """返回mark(stage)函数，将自上次mark以来的耗时记为一个阶段；stage为None时只重置起点"""
+        last = [time.perf_counter()]
+
+        def mark(stage: Optional[str]):
+            now = time.perf_counter()
+            if stage is not None:
+                self.record_span(stage, last[0], now - last[0], trace_id, **labels)
+            last[0] = now
+
+        return mark
+
+    def quantiles(self, name: str = 'comfyui_client_stage_seconds', label: str = 'stage',
+                  qs=(0.5, 0.95)) -> Dict[str, Dict[str, float]]:
+        """按某个标签汇总最近样本的分位数"""
+        grouped: Dict[str, List[float]] = defaultdict(list)
+        with self._lock:
+            for key, histogram in self._histograms.get(name, {}).items():
+                grouped[dict(key).get(label, '')].extend(histogram.samples)
+        result = {}
+        for value, samples in grouped.items():
+            samples.sort()
+            result[value] = {f"p{int(q * 100)}": samples[min(int(q * len(samples)), len(samples) - 1)] for q in qs}
+            result[value]['count'] = len(samples)
+            result[value]['mean'] = sum(samples) / len(samples)
+        return result
+
+    def counter_totals(self, name: str, *labels: str) -> Dict[Tuple[str, ...], float]:
+        """按指定标签汇总计数器"""
+        totals: Dict[Tuple[str, ...], float] = defaultdict(float)
+        with self._lock:
+            for key, value in self._counters.get(name, {}).items():
+                values = dict(key)
+                totals[tuple(values.get(label, '') for label in labels)] += value
+        return dict(totals)
+
+    def render_prometheus(self) -> str:
+        """导出Prometheus文本格式"""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(series.items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f"{name}_bucket{_format_labels(key + (('le', repr(float(bound))),))} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(key + (('le', '+Inf'),))} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.total}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str):
+        """写入Prometheus文本文件（可供node_exporter textfile采集）"""
+        _atomic_write(path, self.render_prometheus())
+
+    def write_trace(self, path: str):
+        """写入Chrome trace格式的JSON"""
+        with self._lock:
+            events = [dict(span, ph='X', pid=os.getpid()) for span in self._spans]
+        _atomic_write(path, json.dumps({'traceEvents': events}, ensure_ascii=False))
+
+    def serve(self, port: int, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+        """在后台线程提供 /metrics 接口"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"指标接口: http://{host}:{server.server_port}/metrics")
+        return server
+
+    def print_summary(self):
+        """打印各阶段耗时的p50/p95，有节点耗时时按class_type打印平均值和p95，有重试或熔断时打印次数"""
+        summary = self.quantiles()
+        if summary:
+            print("=== 阶段耗时 ===")
+            for stage, values in sorted(summary.items()):
+                print(f"{stage:<16} p50={values['p50']:.3f}s p95={values['p95']:.3f}s n={values['count']}")
+        nodes = self.quantiles('comfyui_node_execution_seconds', label='class_type')
+        if nodes:
+            print("=== 节点耗时 ===")
+            for class_type, values in sorted(nodes.items(), key=lambda item: item[1]['mean'], reverse=True):
+                print(f"{class_type:<28} mean={values['mean']:.3f}s p95={values['p95']:.3f}s n={values['count']}")
+        retries = self.counter_totals('comfyui_client_http_retries_total', 'operation', 'reason')
+        rejected = self.counter_totals('comfyui_client_circuit_rejected_total', 'server')
+        exhausted = self.counter_totals('comfyui_client_retry_budget_exhausted_total', 'server')
+        if retries or rejected or exhausted:
+            print("=== 重试与熔断 ===")
+            for (operation, reason), count in sorted(retries.items()):
+                print(f"重试 {operation:<10} {reason:<12} {count:.0f}")
+            for (server,), count in sorted(exhausted.items()):
+                print(f"重试预算耗尽 {server:<24} {count:.0f}")
+            for (server,), count in sorted(rejected.items()):
+                print(f"熔断拒绝 {server:<28} {count:.0f}")
+
+
+def _format_labels(key: LabelKey) -> str:
+    if not key:
+        return ''
+    escaped = (
+        '{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in key
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _atomic_write(path: str, content: str):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+服务器节点定义缓存与类型转换
+/object_info 返回所有节点类型的输入输出定义，装了自定义节点后有数MB且生成较慢。
+按服务器地址缓存到本地文件，在有效期内直接使用；过期后带ETag重新请求，未变化时只刷新有效期；
+服务器不可达时退回到过期的缓存。
+
+节点定义也用于转换更新参数的类型：命令行中的 "-5"、"1e-3"、"123" 按目标输入是INT、FLOAT
+还是STRING分别转换，并检查min/max和下拉选项，无效的任务在提交前就被拒绝。
+"""
+
+import json
+import os
+import re
+import time
+from typing import Optional, Dict, Any, List
+
+DEFAULT_OBJECT_INFO_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'comfyui-acs', 'object_info')
+
+
+class ObjectInfoCache:
+    """/object_info 的本地缓存，每个服务器一个文件"""
+
+    def __init__(self, cache_dir: str = DEFAULT_OBJECT_INFO_DIR, max_age: float = 24 * 3600):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+
+    def path(self, server_address: str) -> str:
+        return os.path.join(self.cache_dir, re.sub(r'[^A-Za-z0-9.-]', '_', server_address) + '.json')
+
+    def _read(self, path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def get(self, api, refresh: bool = False) -> Optional[Dict[str, Any]]:
+        """返回api所连服务器的节点定义，获取失败且没有缓存时返回None"""
+        path = self.path(api.server_address)
+        etag_path = f"{path}.etag"
+        cached = self._read(path)
+        if cached is not None and not refresh and time.time() - os.path.getmtime(path) < self.max_age:
+            return cached
+
+        etag = None
+        if cached is not None and not refresh and os.path.exists(etag_path):
+            with open(etag_path, 'r', encoding='utf-8') as f:
+                etag = f.read().strip() or None
+        try:
+            object_info, etag = api.get_object_info(etag)
+        except Exception as e:
+            if cached is not None:
+                print(f"⚠️  无法获取节点定义，使用过期的缓存: {e}")
+            return cached
+
+        if object_info is None:
+            # 304: 服务器上的定义没有变化，延长缓存有效期
+            os.utime(path)
+            return cached
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(object_info, f)
+        os.replace(tmp_path, path)
+        if etag:
+            with open(etag_path, 'w', encoding='utf-8') as f:
+                f.write(etag)
+        elif os.path.exists(etag_path):
+            os.remove(etag_path)
+        return object_info
+
+
+def input_specs(definition: Dict[str, Any]) -> Dict[str, Any]:
+    """节点类型的全部输入定义 {名称: [类型或选项列表, 参数]}"""
+    specs = {}
+    for group in ('required', 'optional'):
+        specs.update(definition.get('input', {}).get(group) or {})
+    return specs
+
+
+def input_spec(object_info: Dict[str, Any], class_type: str, name: str) -> Optional[List[Any]]:
+    definition = object_info.get(class_type)
+    return input_specs(definition).get(name) if definition is not None else None
+
+
+def _to_int(value: Any) -> int:
+    if isinstance(value, str):
+        text = value.strip()
+        try:
+            return int(text)
+        except ValueError:
+            value = float(text)  # 1e3、5.0
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError
+        return int(value)
+    if isinstance(value, int):
+        return value
+    raise ValueError
+
+
+_BOOLEANS = {'true': True, '1': True, 'yes': True, 'false': False, '0': False, 'no': False}
+
+
+def coerce_value(value: Any, spec: List[Any], where: str = '', is_image_input: bool = False) -> Any:
+    """按输入定义转换取值（命令行中的字符串或已解析的值），类型不符、超出范围或不在选项中时抛出ValueError
+
+    非基本类型（MODEL、LATENT等只能连线的输入）原样返回。
+    """
+    input_type = spec[0]
+    options = spec[1] if len(spec) > 1 and isinstance(spec[1], dict) else {}
+    choices = input_type if isinstance(input_type, list) else options.get('options') if input_type == 'COMBO' else None
+
+    if choices is not None:
+        # 上传的图片按内容哈希命名，提交前才上传，不在服务器返回的选项中
+        if is_image_input or options.get('image_upload') or value in choices:
+            return value
+        for choice in choices:
+            if str(choice) == str(value):
+                return choice
+        preview = ', '.join(map(str, choices[:5])) + (' ...' if len(choices) > 5 else '')
+        raise ValueError(f"{where} 的值 {value!r} 不在服务器可选项中 ({preview})")
+
+    if input_type in ('INT', 'FLOAT'):
+        try:
+            if isinstance(value, bool):
+                raise ValueError
+            number = _to_int(value) if input_type == 'INT' else float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{where} 应为{input_type}，实际为 {value!r}") from None
+        if 'min' in options and number < options['min']:
+            raise ValueError(f"{where} = {number} 小于最小值 {options['min']}")
+        if 'max' in options and number > options['max']:
+            raise ValueError(f"{where} = {number} 大于最大值 {options['max']}")
+        return number
+
+    if input_type == 'BOOLEAN':
+        if isinstance(value, bool):
+            return value
+        if str(value).strip().lower() in _BOOLEANS:
+            return _BOOLEANS[str(value).strip().lower()]
+        raise ValueError(f"{where} 应为布尔值，实际为 {value!r}")
+
+    if input_type == 'STRING':
+        # 提示词"123"保持字符串，不会被猜成整数
+        return value if isinstance(value, str) else json.dumps(value) if isinstance(value, (list, dict)) else str(value)
+    return value
+
+
+def coerce_updates(workflow: Dict[str, Any], updates: Dict[str, Any],
+                   object_info: Dict[str, Any]) -> Dict[str, Any]:
+    """按节点定义转换 node_<id>_inputs_<key> 更新的取值；服务器上没有定义的输入按字面猜测类型"""
+    from main import parse_value
+
+    coerced = {}
+    for key, value in updates.items():
+        parts = key.split('_', 3)
+        node = workflow.get(parts[1]) if len(parts) == 4 and parts[0] == 'node' else None
+        spec = None
+        if isinstance(node, dict) and parts[2] == 'inputs':
+            spec = input_spec(object_info, node.get('class_type'), parts[3])
+        if spec is None:
+            coerced[key] = parse_value(value) if isinstance(value, str) else value
+            continue
+        coerced[key] = coerce_value(value, spec, where=f"节点 {parts[1]}.{parts[3]}",
+                                    is_image_input=node.get('class_type') == 'LoadImage' and parts[3] == 'image')
+    return coerced
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+多ComfyUI Pod负载均衡客户端
+按 /queue 的实时队列深度选择最空闲的Pod，剔除连续失败或处于熔断状态的Pod，
+同一个prompt的后续调用（history、下载）固定发往执行它的Pod。
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Tuple
+
+import requests
+
+from main import (
+    ComfyUIAPI,
+    collect_output_filenames,
+    find_load_image_node,
+    load_workflow_from_file,
+    update_workflow_parameters,
+)
+from progress import print_node_profile
+from retry_policy import CircuitBreaker
+from result_cache import ResultCache, canonical_prompt_hash
+from upload_cache import file_digest, content_filename
+
+
+class PodState:
+    """单个Pod的健康状态和负载"""
+
+    def __init__(self, api: ComfyUIAPI):
+        self.api = api
+        self.healthy = True
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.queue_depth = 0
+        # 上次刷新队列后本地新提交、服务器端尚未体现的任务数
+        self.submitted_since_refresh = 0
+        self.in_flight = 0
+
+    @property
+    def load(self) -> int:
+        return self.queue_depth + self.submitted_since_refresh
+
+    def __repr__(self):
+        return (f"PodState({self.api.server_address}, healthy={self.healthy}, "
+                f"queue_depth={self.queue_depth}, in_flight={self.in_flight})")
+
+
+class ComfyUIPool:
+    """在多个ComfyUI服务器间分发任务，api_kwargs传给每个ComfyUIAPI（如共享的upload_cache、metrics）"""
+
+    def __init__(self, endpoints: List[str], timeout: int = 30, refresh_interval: float = 2.0,
+                 max_failures: int = 3, eject_seconds: float = 30.0, **api_kwargs):
+        if not endpoints:
+            raise ValueError("至少需要一个服务器地址")
+        self.refresh_interval = refresh_interval
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.pods = [PodState(ComfyUIAPI(endpoint, timeout=timeout, **api_kwargs)) for endpoint in endpoints]
+        self._pins: Dict[str, PodState] = {}
+        self._lock = threading.Lock()
+        self._last_refresh = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=len(self.pods))
+
+    def _check_pod(self, pod: PodState):
+        """查询单个Pod的队列深度，失败计数达到上限后剔除一段时间"""
+        try:
+            # 经过熔断器：熔断期间探测直接失败，冷却后的探测即为half_open的试探请求
+            response = pod.api._request('probe', 'GET', f"{pod.api.base_url}/queue", timeout=5)
+            response.raise_for_status()
+            queue = response.json()
+            depth = len(queue.get('queue_running', [])) + len(queue.get('queue_pending', []))
+        except Exception as e:
+            with self._lock:
+                pod.failures += 1
+                if pod.healthy and pod.failures >= self.max_failures:
+                    pod.healthy = False
+                    pod.ejected_until = time.monotonic() + self.eject_seconds
+                    print(f"❌ 剔除不可用的服务器 {pod.api.server_address}: {e}")
+                elif not pod.healthy:
+                    pod.ejected_until = time.monotonic() + self.eject_seconds
+            return
+
+        with self._lock:
+            if not pod.healthy:
+                print(f"✅ 服务器恢复: {pod.api.server_address}")
+            pod.healthy = True
+            pod.failures = 0
+            pod.queue_depth = depth
+            pod.submitted_since_refresh = 0
+
+    def refresh(self):
+        """并发刷新所有Pod的队列深度，已剔除的Pod冷却期结束后重新探测"""
+        now = time.monotonic()
+        targets = [pod for pod in self.pods if pod.healthy or pod.ejected_until <= now]
+        list(self._executor.map(self._check_pod, targets))
+        self._last_refresh = time.monotonic()
+
+    def pick(self) -> PodState:
+        """选择队列最短的健康Pod"""
+        if time.monotonic() - self._last_refresh >= self.refresh_interval:
+            self.refresh()
+        with self._lock:
+            candidates = [pod for pod in self.pods
+                          if pod.healthy and pod.api.breaker.state != CircuitBreaker.OPEN]
+            if not candidates:
+                raise ConnectionError("没有可用的ComfyUI服务器")
+            pod = min(candidates, key=lambda p: (p.load, p.in_flight))
+            self._claim(pod)
+            return pod
+
+    def _claim(self, pod: PodState):
+        pod.submitted_since_refresh += 1
+        pod.in_flight += 1
+
+    def _mark_failure(self, pod: PodState):
+        with self._lock:
+            pod.failures += 1
+            if pod.failures >= self.max_failures:
+                pod.healthy = False
+                pod.ejected_until = time.monotonic() + self.eject_seconds
+
+    def _finish(self, pod: PodState):
+        with self._lock:
+            pod.in_flight = max(pod.in_flight - 1, 0)
+
+    def api_for(self, prompt_id: str) -> ComfyUIAPI:
+        """返回执行该prompt的Pod的客户端"""
+        pod = self._pins.get(prompt_id)
+        if pod is None:
+            raise KeyError(f"未知的任务ID: {prompt_id}")
+        return pod.api
+
+    def prepare(self, workflow: Dict[str, Any], image_path: Optional[str] = None,
+                updates: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], Optional[str]]:
+        """生成最终prompt，返回(prompt, 图片内容哈希)
+
+        图片按内容哈希命名，prompt与最终选择哪个Pod无关。
+        """
+        updates = dict(updates) if updates else {}
+        image_digest = None
+        if image_path:
+            upload_cache = self.pods[0].api.upload_cache
+            image_digest = upload_cache.digest(image_path) if upload_cache else file_digest(image_path)
+            load_image_node = find_load_image_node(workflow)
+            if load_image_node:
+                updates[f'node_{load_image_node}_inputs_image'] = content_filename(image_digest, image_path)
+
+        prompt = update_workflow_parameters(workflow, updates) if updates else workflow
+        return prompt, image_digest
+
+    def submit(self, workflow: Dict[str, Any], image_path: Optional[str] = None,
+               updates: Optional[Dict[str, Any]] = None) -> str:
+        """选择Pod，上传图片并提交任务，返回prompt_id"""
+        prompt, _ = self.prepare(workflow, image_path, updates)
+        return self.submit_prompt(prompt, image_path)
+
+    def submit_prompt(self, prompt: Dict[str, Any], image_path: Optional[str] = None,
+                      pod: Optional[PodState] = None, front: bool = False,
+                      output_dir: Optional[str] = None, prompt_json: Optional[bytes] = None) -> str:
+        """将已生成的prompt提交到最空闲的Pod（或调用方指定的pod），image_path为prompt引用的输入图片
+
+        prompt_json为已序列化的prompt，提交到任一Pod时复用。
+        """
+        if pod is None:
+            pod = self.pick()
+        else:
+            with self._lock:
+                self._claim(pod)
+        try:
+            if image_path and not pod.api.ensure_image(image_path):
+                raise RuntimeError(f"图片上传失败: {image_path}")
+            result = pod.api.queue_prompt(prompt, front=front, output_dir=output_dir, prompt_json=prompt_json)
+            if 'prompt_id' not in result:
+                raise RuntimeError(f"提交任务失败: {result}")
+        except Exception as e:
+            if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+                self._mark_failure(pod)
+            self._finish(pod)
+            raise
+
+        prompt_id = result['prompt_id']
+        with self._lock:
+            self._pins[prompt_id] = pod
+        print(f"任务 {prompt_id} 已提交到 {pod.api.server_address}")
+        return prompt_id
+
+    def get_history(self, prompt_id: str) -> Dict[str, Any]:
+        return self.api_for(prompt_id).get_history(prompt_id)
+
+    def wait_for_completion(self, prompt_id: str, **kwargs) -> Dict[str, Any]:
+        return self.api_for(prompt_id).wait_for_completion(prompt_id, **kwargs)
+
+    def download_outputs(self, prompt_id: str, history: Dict[str, Any],
+                         output_path: str = "./output/") -> List[Optional[str]]:
+        api = self.api_for(prompt_id)
+        filenames = collect_output_filenames(history)
+        paths = api.download_outputs(filenames, output_path)
+        if filenames and all(paths):
+            api.mark_downloaded(prompt_id, paths)
+        return paths
+
+    def release(self, prompt_id: str):
+        """任务结束后解除固定并释放Pod的在途计数"""
+        with self._lock:
+            pod = self._pins.pop(prompt_id, None)
+        if pod is not None:
+            self._finish(pod)
+
+    def execute_workflow(self, workflow_path: str, image_path: Optional[str] = None,
+                         updates: Optional[Dict[str, Any]] = None, output_dir: str = "./output/",
+                         wait_timeout: Optional[float] = None,
+                         result_cache: Optional[ResultCache] = None, front: bool = False) -> Optional[str]:
+        """在最空闲的Pod上执行工作流，返回第一个输出文件，各阶段耗时记录在共享的metrics中"""
+        metrics = self.pods[0].api.metrics
+        trace_id = str(uuid.uuid4())
+        mark = metrics.stage_timer(trace_id)
+        started = time.perf_counter()
+        try:
+            workflow = load_workflow_from_file(workflow_path)
+            prompt, image_digest = self.prepare(workflow, image_path=image_path, updates=updates)
+            mark('prepare')
+
+            cache_key = None
+            if result_cache:
+                cache_key = canonical_prompt_hash(prompt, [image_digest] if image_digest else [])
+                cached_files = result_cache.lookup(cache_key, output_dir)
+                mark('cache_lookup')
+                if cached_files:
+                    print(f"命中结果缓存，跳过生成: {cache_key[:16]}")
+                    metrics.record_span('total', started, time.perf_counter() - started, trace_id, cached='true')
+                    return cached_files[0]
+
+            prompt_id = self.submit_prompt(prompt, image_path, front=front, output_dir=output_dir)
+            mark('submit')
+        except Exception as e:
+            print(f"执行工作流时出错: {e}")
+            return None
+
+        try:
+            try:
+                history = self.wait_for_completion(prompt_id, timeout=wait_timeout)
+            except TimeoutError:
+                self.api_for(prompt_id).cancel(prompt_id)
+                raise
+            mark(None)
+            print_node_profile(self.api_for(prompt_id).pop_node_profile(prompt_id))
+            filenames = collect_output_filenames(history)
+            output_files = [path for path in self.download_outputs(prompt_id, history, output_dir) if path]
+            mark('download')
+            metrics.record_span('total', started, time.perf_counter() - started, trace_id)
+            if result_cache and output_files and len(output_files) == len(filenames):
+                result_cache.store(cache_key, output_files)
+            if output_files:
+                print(f"生成了 {len(output_files)} 个文件")
+                return output_files[0]
+            print("未找到生成的文件")
+            return None
+        except Exception as e:
+            print(f"执行工作流时出错: {e}")
+            return None
+        finally:
+            self.release(prompt_id)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        for pod in self.pods:
+            pod.api.close()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+输出后处理
+下载完成的视频在有界的进程池中依次执行后处理步骤（缩略图、ffmpeg转封装/转码、校验和、
+归档到存储目录），与下一个任务的生成并行。进程池积压超过上限时提交会阻塞，形成背压。
+
+内置步骤:
+  checksum   计算sha256
+  thumbnail  用ffmpeg截取第一帧作为JPEG缩略图
+  remux      ffmpeg转封装为faststart的mp4（不重新编码）
+  transcode  ffmpeg以H.264重新编码（options: crf）
+  store      移动到 storage_dir/output/ 下，与OSS存储卷的output子目录结构一致
+
+自定义步骤为模块级函数 step(result, options)，修改result（result['path']为当前文件），
+通过register_step注册后即可在步骤列表中使用。步骤函数本身（按模块和名称引用）随任务传给子进程，
+spawn启动方式（macOS、Windows的默认方式）下子进程不会执行父进程中的register_step。
+"""
+
+import hashlib
+import os
+import pickle
+import shutil
+import subprocess
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Optional, Dict, Any, List, Callable, Tuple
+
+Step = Callable[[Dict[str, Any], Dict[str, Any]], None]
+
+
+def _ffmpeg(*args: str):
+    if shutil.which('ffmpeg') is None:
+        raise RuntimeError("未找到ffmpeg")
+    completed = subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', *args], capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"ffmpeg失败: {completed.stderr.strip()[-500:]}")
+
+
+def checksum(result: Dict[str, Any], options: Dict[str, Any]):
+    h = hashlib.sha256()
+    with open(result['path'], 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    result['sha256'] = h.hexdigest()
+    result['size'] = os.path.getsize(result['path'])
+
+
+def thumbnail(result: Dict[str, Any], options: Dict[str, Any]):
+    path = result['path']
+    thumb_path = f"{os.path.splitext(path)[0]}_thumb.jpg"
+    width = options.get('thumbnail_width', 320)
+    _ffmpeg('-i', path, '-frames:v', '1', '-vf', f'scale={width}:-2', thumb_path)
+    result['thumbnail'] = thumb_path
+
+
+def remux(result: Dict[str, Any], options: Dict[str, Any]):
+    path = result['path']
+    tmp_path = f"{path}.remux.mp4"
+    _ffmpeg('-i', path, '-c', 'copy', '-movflags', '+faststart', tmp_path)
+    os.replace(tmp_path, path)
+
+
+def transcode(result: Dict[str, Any], options: Dict[str, Any]):
+    path = result['path']
+    tmp_path = f"{path}.transcode.mp4"
+    _ffmpeg('-i', path, '-c:v', 'libx264', '-crf', str(options.get('crf', 23)), '-preset',
+            options.get('preset', 'medium'), '-pix_fmt', 'yuv420p', '-movflags', '+faststart',
+            '-c:a', 'copy', tmp_path)
+    os.replace(tmp_path, path)
+
+
+def store(result: Dict[str, Any], options: Dict[str, Any]):
+    storage_dir = options.get('storage_dir')
+    if not storage_dir:
+        raise RuntimeError("store步骤需要storage_dir")
+    target_dir = os.path.join(storage_dir, 'output')
+    os.makedirs(target_dir, exist_ok=True)
+    for key in ('path', 'thumbnail'):
+        if result.get(key):
+            target = os.path.join(target_dir, os.path.basename(result[key]))
+            # 跨文件系统（如ossfs挂载）时shutil.move会复制后删除
+            shutil.move(result[key], target)
+            result[key] = target
+
+
+STEPS: Dict[str, Step] = {
+    'checksum': checksum,
+    'thumbnail': thumbnail,
+    'remux': remux,
+    'transcode': transcode,
+    'store': store,
+}
+
+
+def register_step(name: str, step: Step):
+    """注册自定义步骤，step必须是模块级函数以便传给子进程，lambda或嵌套函数抛出ValueError"""
+    try:
+        pickle.dumps(step)
+    except (pickle.PicklingError, AttributeError, TypeError) as e:
+        raise ValueError(f"后处理步骤 {name} 必须是模块级函数: {e}") from None
+    STEPS[name] = step
+
+
+def run_steps(path: str, steps: List[Tuple[str, Step]], options: Dict[str, Any]) -> Dict[str, Any]:
+    """在子进程中依次执行各步骤(名称, 函数)，某一步失败时停止并记录错误"""
+    result = {'source': path, 'path': path, 'error': None}
+    for name, step in steps:
+        try:
+            step(result, options)
+        except Exception as e:
+            result['error'] = f"{name}: {e}"
+            break
+    return result
+
+
+class PostProcessor:
+    """在进程池中执行后处理，最多max_pending个文件排队或处理中，超过时submit阻塞"""
+
+    def __init__(self, steps: List[str], options: Optional[Dict[str, Any]] = None,
+                 max_workers: int = 2, max_pending: Optional[int] = None, mp_context=None):
+        unknown = [name for name in steps if name not in STEPS]
+        if unknown:
+            raise ValueError(f"未知的后处理步骤: {', '.join(unknown)}，可用: {', '.join(STEPS)}")
+        if 'store' in steps and not (options or {}).get('storage_dir'):
+            raise ValueError("store步骤需要指定存储目录")
+        if any(name in steps for name in ('thumbnail', 'remux', 'transcode')) and shutil.which('ffmpeg') is None:
+            print("⚠️  未找到ffmpeg，缩略图/转封装/转码步骤将失败")
+        self.steps = list(steps)
+        self._step_funcs = [(name, STEPS[name]) for name in steps]
+        self.options = dict(options or {})
+        self._executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context)
+        self._slots = threading.BoundedSemaphore(max_pending or max_workers * 2)
+        self.backpressure_waits = 0
+
+    def submit(self, path: str) -> Future:
+        """提交一个文件，积压已满时阻塞直到有文件处理完"""
+        if not self._slots.acquire(blocking=False):
+            self.backpressure_waits += 1
+            print(f"⏳ 后处理积压，等待空位: {os.path.basename(path)}")
+            self._slots.acquire()
+        try:
+            future = self._executor.submit(run_steps, path, self._step_funcs, self.options)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def process(self, path: str) -> Dict[str, Any]:
+        """提交并等待结果"""
+        return self.submit(path).result()
+
+    def close(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+def print_result(result: Dict[str, Any]):
+    if result['error']:
+        print(f"❌ 后处理失败 {os.path.basename(result['source'])}: {result['error']}")
+        return
+    details = [f"{key}={result[key]}" for key in ('thumbnail', 'sha256') if result.get(key)]
+    print(f"✅ 后处理完成: {result['path']} {' '.join(details)}")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+输入图片预处理
+工作流会把输入图片缩放到 generation_width x generation_height，上传几十MB的原图只会增加
+上传时间和服务器端解码开销。上传前按目标分辨率等比缩小（不小于目标尺寸，裁剪仍由工作流完成），
+不透明图片重新编码为JPEG，带透明通道的保持PNG（LoadImage用alpha作为遮罩）。
+
+处理结果按 (原图内容哈希, 目标尺寸, 编码参数) 缓存在本地目录，同一张图片只处理一次；
+输出是确定的，配合按内容寻址的上传，相同结果在服务器上也只有一份。
+需要Pillow，未安装时直接使用原图。
+"""
+
+import hashlib
+import mimetypes
+import os
+import threading
+from typing import Optional, Dict, Any, Tuple
+
+from upload_cache import file_digest
+
+try:
+    from PIL import Image, ImageOps  # Pillow，可选依赖，缺失时不做预处理
+except ImportError:
+    Image = None
+
+DEFAULT_IMAGE_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'comfyui-acs', 'images')
+
+# 修改处理逻辑时递增，使旧的缓存结果失效
+_PREPROCESS_VERSION = 1
+
+
+def guess_mime_type(path: str) -> str:
+    """按扩展名判断上传时的Content-Type"""
+    return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+def target_size(workflow: Dict[str, Any], updates: Optional[Dict[str, Any]] = None) -> Optional[Tuple[int, int]]:
+    """从工作流（及尚未应用的node_<id>_inputs_<key>更新）中读取生成分辨率，多个节点时取最大值"""
+    sizes: Dict[str, Dict[str, Any]] = {}
+    for node_id, node in workflow.items():
+        inputs = node.get('inputs', {})
+        for key in ('generation_width', 'generation_height'):
+            if key in inputs:
+                sizes.setdefault(node_id, {})[key] = inputs[key]
+    for key, value in (updates or {}).items():
+        parts = key.split('_', 3)
+        if len(parts) == 4 and parts[2] == 'inputs' and parts[3] in ('generation_width', 'generation_height'):
+            sizes.setdefault(parts[1], {})[parts[3]] = value
+
+    width = height = 0
+    for size in sizes.values():
+        w, h = size.get('generation_width'), size.get('generation_height')
+        # 连接到其他节点的输入（[node_id, index]）无法静态确定
+        if isinstance(w, int) and isinstance(h, int) and not isinstance(w, bool):
+            width, height = max(width, w), max(height, h)
+    return (width, height) if width and height else None
+
+
+class ImagePreprocessor:
+    """按目标分辨率缩小并重新编码输入图片，结果缓存在cache_dir"""
+
+    def __init__(self, cache_dir: str = DEFAULT_IMAGE_CACHE_DIR, jpeg_quality: int = 92):
+        self.cache_dir = cache_dir
+        self.jpeg_quality = jpeg_quality
+        self._lock = threading.Lock()
+        self._prepared: Dict[Tuple[str, int, int, Optional[Tuple[int, int]]], str] = {}
+        if Image is None:
+            print("⚠️  未安装Pillow，跳过图片预处理")
+
+    def prepare(self, image_path: str, size: Optional[Tuple[int, int]] = None) -> str:
+        """返回用于上传的图片路径；无需处理、无法处理或未安装Pillow时返回原路径"""
+        if Image is None or size is None or not os.path.exists(image_path):
+            return image_path
+        stat = os.stat(image_path)
+        memo_key = (os.path.abspath(image_path), stat.st_size, stat.st_mtime_ns, size)
+        with self._lock:
+            if memo_key in self._prepared:
+                return self._prepared[memo_key]
+
+        try:
+            prepared = self._prepare(image_path, size)
+        except Exception as e:
+            print(f"⚠️  图片预处理失败，使用原图: {e}")
+            prepared = image_path
+        with self._lock:
+            self._prepared[memo_key] = prepared
+        return prepared
+
+    def _prepare(self, image_path: str, size: Tuple[int, int]) -> str:
+        key = hashlib.sha256(
+            f"{file_digest(image_path)}:{size[0]}x{size[1]}:q{self.jpeg_quality}:v{_PREPROCESS_VERSION}".encode()
+        ).hexdigest()[:32]
+        for ext in ('.jpg', '.png'):
+            cached = os.path.join(self.cache_dir, key + ext)
+            if os.path.exists(cached):
+                return cached
+
+        with Image.open(image_path) as source:
+            original_size = source.size
+            # 手机照片常带EXIF方向信息，重新编码会丢失EXIF，先转正
+            rotated = source.getexif().get(0x0112, 1) != 1
+            image = ImageOps.exif_transpose(source)
+            # 等比缩小到刚好覆盖目标尺寸，不放大
+            scale = max(size[0] / image.width, size[1] / image.height)
+            if scale >= 1 and not rotated and source.format in ('JPEG', 'PNG'):
+                return image_path
+            if scale < 1:
+                image = image.resize((max(round(image.width * scale), 1), max(round(image.height * scale), 1)),
+                                     Image.LANCZOS)
+
+            has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+            os.makedirs(self.cache_dir, exist_ok=True)
+            output_path = os.path.join(self.cache_dir, key + ('.png' if has_alpha else '.jpg'))
+            tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            if has_alpha:
+                image.convert('RGBA').save(tmp_path, format='PNG', optimize=True)
+            else:
+                image.convert('RGB').save(tmp_path, format='JPEG', quality=self.jpeg_quality, optimize=True)
+            os.replace(tmp_path, output_path)
+
+        before, after = os.path.getsize(image_path), os.path.getsize(output_path)
+        print(f"图片预处理: {original_size[0]}x{original_size[1]} {before / 1024 / 1024:.2f} MB → "
+              f"{image.width}x{image.height} {after / 1024 / 1024:.2f} MB")
+        return output_path
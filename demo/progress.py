@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+执行进度与节点耗时
+服务器在执行过程中通过WebSocket依次发送 executing(node) / progress(value, max) 事件。
+两次executing之间的时间即为前一个节点的耗时（模型加载、文本编码、采样、视频合成……），
+按节点记录每个任务的耗时，并以class_type为标签汇总到Metrics的
+comfyui_node_execution_seconds 直方图，批量执行时可看到各类节点的平均值和p95。
+
+同时把事件整理为统一格式交给进度回调，前端无需额外轮询即可显示步骤级进度:
+  {'prompt_id', 'type': 'start'|'node'|'progress'|'done'|'error', 'node', 'class_type', 'value', 'max'}
+只有WebSocket模式下有这些事件，轮询模式下没有节点耗时。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Callable
+
+from metrics import Metrics
+
+ProgressCallback = Callable[[Dict[str, Any]], None]
+
+NODE_METRIC = 'comfyui_node_execution_seconds'
+
+
+class NodeProfiler:
+    """根据执行事件记录每个任务中各节点的耗时，只跟踪通过register登记的prompt"""
+
+    def __init__(self, metrics: Optional[Metrics] = None, max_finished: int = 1000):
+        self.metrics = metrics
+        self.max_finished = max_finished
+        self._lock = threading.Lock()
+        self._class_types: Dict[str, Dict[str, str]] = {}
+        self._current: Dict[str, tuple] = {}
+        self._profiles: Dict[str, List[Dict[str, Any]]] = {}
+        # 已结束但尚未被取走的任务，超过max_finished时丢弃最早的
+        self._finished: 'OrderedDict[str, List[Dict[str, Any]]]' = OrderedDict()
+
+    def register(self, prompt_id: str, prompt: Dict[str, Any]):
+        """登记已提交的prompt，记录节点ID到class_type的对应关系"""
+        with self._lock:
+            self._class_types[prompt_id] = {node_id: node.get('class_type', '')
+                                            for node_id, node in prompt.items() if isinstance(node, dict)}
+            self._profiles[prompt_id] = []
+
+    def handle(self, event_type: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """处理一个WebSocket事件，返回给进度回调的事件，与登记的任务无关时返回None"""
+        prompt_id = data.get('prompt_id')
+        now = time.perf_counter()
+        with self._lock:
+            class_types = self._class_types.get(prompt_id)
+            if class_types is None:
+                return None
+
+            if event_type == 'execution_start':
+                return {'prompt_id': prompt_id, 'type': 'start'}
+            if event_type == 'execution_cached':
+                for node_id in data.get('nodes') or []:
+                    self._profiles[prompt_id].append({'node': node_id, 'class_type': class_types.get(node_id, ''),
+                                                      'seconds': 0.0, 'cached': True})
+                return None
+            if event_type == 'executing':
+                self._close_node(prompt_id, now)
+                node_id = data.get('node')
+                if node_id is None:
+                    self._finish(prompt_id)
+                    return {'prompt_id': prompt_id, 'type': 'done'}
+                self._current[prompt_id] = (node_id, now)
+                return {'prompt_id': prompt_id, 'type': 'node', 'node': node_id,
+                        'class_type': class_types.get(node_id, '')}
+            if event_type == 'progress':
+                node_id = data.get('node') or (self._current.get(prompt_id) or (None,))[0]
+                return {'prompt_id': prompt_id, 'type': 'progress', 'node': node_id,
+                        'class_type': class_types.get(node_id, ''),
+                        'value': data.get('value'), 'max': data.get('max')}
+            if event_type in ('execution_success', 'execution_error', 'execution_interrupted'):
+                self._close_node(prompt_id, now)
+                if event_type == 'execution_success':
+                    return None  # 随后的executing(node=None)报告完成
+                self._finish(prompt_id)
+                return {'prompt_id': prompt_id, 'type': 'error', 'node': data.get('node_id'),
+                        'class_type': class_types.get(data.get('node_id'), '')}
+        return None
+
+    def _close_node(self, prompt_id: str, now: float):
+        current = self._current.pop(prompt_id, None)
+        if current is None:
+            return
+        node_id, started = current
+        class_type = self._class_types[prompt_id].get(node_id, '')
+        duration = now - started
+        self._profiles[prompt_id].append({'node': node_id, 'class_type': class_type, 'seconds': round(duration, 3)})
+        if self.metrics is not None:
+            self.metrics.observe(NODE_METRIC, duration, class_type=class_type)
+            self.metrics.add_trace_event(f"{class_type}#{node_id}", started, duration, prompt_id,
+                                         category='node')
+
+    def _finish(self, prompt_id: str):
+        self._class_types.pop(prompt_id, None)
+        self._finished[prompt_id] = self._profiles.pop(prompt_id, [])
+        while len(self._finished) > self.max_finished:
+            self._finished.popitem(last=False)
+
+    def pop(self, prompt_id: str) -> List[Dict[str, Any]]:
+        """取走任务的节点耗时列表（按执行顺序），未执行完的任务返回已记录的部分"""
+        with self._lock:
+            if prompt_id in self._finished:
+                return self._finished.pop(prompt_id)
+            self._class_types.pop(prompt_id, None)
+            self._current.pop(prompt_id, None)
+            return self._profiles.pop(prompt_id, [])
+
+
+def print_node_profile(profile: List[Dict[str, Any]], top: int = 5):
+    """打印单个任务中耗时最多的节点"""
+    executed = [entry for entry in profile if not entry.get('cached')]
+    if not executed:
+        return
+    total = sum(entry['seconds'] for entry in executed)
+    print("=== 节点耗时 ===")
+    for entry in sorted(executed, key=lambda e: e['seconds'], reverse=True)[:top]:
+        share = entry['seconds'] / total * 100 if total else 0
+        print(f"{entry['class_type'] or '?':<28} 节点 {entry['node']:<6} {entry['seconds']:8.3f}s {share:5.1f}%")
+
+
+def print_progress(event: Dict[str, Any]):
+    """命令行的进度回调：打印采样等节点的步骤进度（节点切换由客户端自身打印）"""
+    if event['type'] == 'progress' and event.get('max'):
+        print(f"  进度 {event['value']}/{event['max']} ({event['class_type'] or event['node'] or '?'})")
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+本地结果缓存
+以最终prompt图的规范化哈希（加上输入图片内容哈希）为键保存输出文件，
+相同的确定性任务再次提交时直接返回缓存的输出，不再占用GPU。
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Optional, Dict, Any, List, Iterable
+
+DEFAULT_RESULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'comfyui-acs', 'results')
+
+
+def canonical_prompt_hash(prompt: Dict[str, Any], image_digests: Iterable[str] = ()) -> str:
+    """计算prompt图的规范化哈希，忽略不影响结果的_meta字段"""
+    graph = {
+        node_id: {key: value for key, value in node.items() if key != '_meta'}
+        for node_id, node in prompt.items()
+    }
+    h = hashlib.sha256()
+    h.update(json.dumps(graph, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+    for digest in sorted(image_digests):
+        h.update(b'\0' + digest.encode('ascii'))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """磁盘结果缓存，总大小超过max_bytes时按最近使用时间淘汰"""
+
+    def __init__(self, cache_dir: str = DEFAULT_RESULT_CACHE_DIR, max_bytes: int = 5 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self._lock = threading.Lock()
+        # {key: {"files": [文件名], "size": 字节数, "last_used": 时间戳}}
+        self._index: Dict[str, Dict[str, Any]] = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"结果缓存索引损坏，已忽略: {e}")
+            return {}
+
+    def _save_locked(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def lookup(self, key: str, output_dir: str) -> Optional[List[str]]:
+        """命中时把缓存的输出复制到output_dir并返回文件路径，未命中返回None"""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            entry_dir = os.path.join(self.cache_dir, key)
+            cached = [os.path.join(entry_dir, name) for name in entry['files']]
+            if not all(os.path.exists(path) for path in cached):
+                # 缓存文件被外部删除
+                del self._index[key]
+                self._save_locked()
+                return None
+            entry['last_used'] = time.time()
+            self._save_locked()
+
+        os.makedirs(output_dir, exist_ok=True)
+        output_files = []
+        for path in cached:
+            target = os.path.join(output_dir, os.path.basename(path))
+            shutil.copyfile(path, target)
+            output_files.append(target)
+        return output_files
+
+    def store(self, key: str, output_files: List[str]):
+        """保存一次成功执行的输出文件"""
+        entry_dir = os.path.join(self.cache_dir, key)
+        os.makedirs(entry_dir, exist_ok=True)
+        size = 0
+        for path in output_files:
+            shutil.copyfile(path, os.path.join(entry_dir, os.path.basename(path)))
+            size += os.path.getsize(path)
+
+        with self._lock:
+            self._index[key] = {
+                'files': [os.path.basename(path) for path in output_files],
+                'size': size,
+                'last_used': time.time(),
+            }
+            self._evict_locked()
+            self._save_locked()
+
+    def _evict_locked(self):
+        total = sum(entry['size'] for entry in self._index.values())
+        for key in sorted(self._index, key=lambda k: self._index[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            total -= self._index.pop(key)['size']
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
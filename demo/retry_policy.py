@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+按操作类型的重试策略、重试预算与熔断
+不同接口的重试语义不同:
+  read      GET /history、/queue、/object_info、HEAD /view，幂等，可放心重试
+  submit    POST /prompt，非幂等：只有请求确定未送达（连接失败、429）时直接重试，
+            其余失败需先确认服务器上没有该prompt_id（见ComfyUIAPI.queue_prompt）
+  upload    按内容哈希命名并覆盖写入，重复上传无害
+  download  GET /view 大文件，由Range续传循环使用，从断点继续而不是从头下载
+  control   /interrupt、删除排队任务
+  probe     健康检查，不重试，失败由调用方（连接测试、负载均衡）处理
+退避时间使用full jitter（0到指数上限之间均匀随机），避免大量客户端同时重试。
+
+重试预算按服务器限制重试占请求的比例：服务器整体故障时，重试次数不会把请求量放大数倍。
+熔断器在连续失败（连接失败、超时、5xx）达到阈值后打开，期间请求立即失败而不是逐个等待超时；
+冷却时间后放行一个探测请求，成功则恢复。
+"""
+
+import random
+import threading
+import time
+from typing import Optional, Dict, Tuple
+
+from metrics import Metrics
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+# 请求确定没有被服务器处理的失败原因，任何操作都可以重试
+UNSENT_REASONS = ('connect', '429')
+
+
+class RetryPolicy:
+    """单个操作类型的重试参数"""
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 10.0,
+                 retry_statuses: Tuple[int, ...] = RETRYABLE_STATUSES):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = retry_statuses
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """第attempt次失败后的等待时间；服务器给出Retry-After时按其等待（不超过max_delay）"""
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+DEFAULT_POLICIES: Dict[str, RetryPolicy] = {
+    'read': RetryPolicy(max_attempts=4, base_delay=0.5, max_delay=8),
+    'submit': RetryPolicy(max_attempts=3, base_delay=1, max_delay=10),
+    'upload': RetryPolicy(max_attempts=3, base_delay=1, max_delay=10),
+    'download': RetryPolicy(max_attempts=5, base_delay=1, max_delay=15),
+    'control': RetryPolicy(max_attempts=2, base_delay=0.5, max_delay=2),
+    'probe': RetryPolicy(max_attempts=1),
+}
+
+
+class RetryBudget:
+    """令牌桶：每个请求存入ratio个令牌，每次重试消耗一个，令牌不超过max_tokens
+
+    空闲的客户端有max_tokens次重试可用；持续失败时重试最多约为请求数的ratio倍。
+    """
+
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 10):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class CircuitBreaker:
+    """单个服务器的熔断器: closed -> (连续failure_threshold次失败) open -> (reset_timeout后) half_open
+
+    half_open时只放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 metrics: Optional[Metrics] = None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """是否放行一个请求；放行后必须调用record_success或record_failure"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._transition(self.HALF_OPEN)
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            if self._state != self.CLOSED:
+                self._transition(self.CLOSED)
+                print(f"✅ 服务器 {self.name} 已恢复，关闭熔断")
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == self.HALF_OPEN or (self._state == self.CLOSED
+                                                 and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._transition(self.OPEN)
+                print(f"⚠️  服务器 {self.name} 连续 {self._failures} 次请求失败，熔断 {self.reset_timeout:.0f}s")
+
+    def _transition(self, state: str):
+        self._state = state
+        if self.metrics is not None:
+            self.metrics.inc('comfyui_client_circuit_transitions_total', server=self.name, state=state)
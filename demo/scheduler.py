@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+模型亲和调度
+文生视频和图生视频使用不同的14B检查点，同一个Pod在两者之间来回切换会反复加载模型。
+调度器根据每个任务的加载器节点计算模型签名，让每个Pod尽量连续执行同一组模型的任务，
+本组任务做完后再切换到剩余任务最多、且没有其他Pod在处理的模型组。
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Optional, Dict, Any, List, Tuple
+
+import requests
+
+from batch import load_jobs, load_completed_ids
+from main import collect_output_filenames, find_load_image_node
+from pool import ComfyUIPool, PodState
+from postprocess import PostProcessor
+from preprocess import ImagePreprocessor, target_size
+from result_cache import ResultCache, canonical_prompt_hash
+from upload_cache import file_digest, content_filename
+from workflow_template import WorkflowTemplate
+
+MODEL_EXTENSIONS = ('.safetensors', '.ckpt', '.pt', '.pth', '.bin', '.gguf', '.sft')
+
+ModelSignature = Tuple[Tuple[str, str, str], ...]
+
+
+def model_signature(prompt: Dict[str, Any]) -> ModelSignature:
+    """提取prompt中所有加载模型文件的节点及其参数，作为模型组的标识
+
+    精度、量化等参数不同也需要重新加载，因此加载器节点的非连线输入全部计入签名。
+    """
+    signature = set()
+    for node in prompt.values():
+        inputs = node.get('inputs', {})
+        if not any(isinstance(value, str) and value.lower().endswith(MODEL_EXTENSIONS)
+                   for value in inputs.values()):
+            continue
+        for key, value in inputs.items():
+            if not isinstance(value, list):
+                signature.add((node.get('class_type', ''), key, str(value)))
+    return tuple(sorted(signature))
+
+
+def describe_signature(signature: ModelSignature) -> str:
+    """签名的简短描述：模型文件名"""
+    names = sorted({os.path.basename(value) for _, _, value in signature
+                    if value.lower().endswith(MODEL_EXTENSIONS)})
+    return ', '.join(names) or '(无模型)'
+
+
+def fifo_switches(signatures: List[ModelSignature], pods: int) -> int:
+    """按提交顺序轮流分配给pods个Pod执行时的模型切换次数（各Pod首次加载不计）"""
+    loaded: List[Optional[ModelSignature]] = [None] * pods
+    switches = 0
+    for index, signature in enumerate(signatures):
+        pod = index % pods
+        if loaded[pod] is not None and loaded[pod] != signature:
+            switches += 1
+        loaded[pod] = signature
+    return switches
+
+
+class AffinityScheduler:
+    """在ComfyUIPool之上按模型签名分组调度批量任务"""
+
+    def __init__(self, pool: ComfyUIPool, workflow_path: str, results_path: str,
+                 output_dir: str = "./output/", per_pod_in_flight: int = 2,
+                 wait_timeout: Optional[float] = None, result_cache: Optional[ResultCache] = None,
+                 max_skips: int = 50, postprocessor: Optional[PostProcessor] = None,
+                 image_preprocessor: Optional[ImagePreprocessor] = None,
+                 object_info: Optional[Dict[str, Any]] = None):
+        self.pool = pool
+        self.workflow_path = workflow_path
+        self.results_path = results_path
+        self.output_dir = output_dir
+        self.per_pod_in_flight = per_pod_in_flight
+        self.wait_timeout = wait_timeout
+        self.result_cache = result_cache
+        # 最早的任务被跳过max_skips次后强制执行，避免少数模型组的任务饿死
+        self.max_skips = max_skips
+        self.postprocessor = postprocessor
+        self.image_preprocessor = image_preprocessor
+        self.object_info = object_info
+        self._postprocessing: List[threading.Thread] = []
+        self._templates: Dict[str, WorkflowTemplate] = {}
+        self._pending: 'OrderedDict[ModelSignature, deque]' = OrderedDict()
+        self._loaded: Dict[int, Optional[ModelSignature]] = {id(pod): None for pod in pool.pods}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._sequence = 0
+        self.switches = 0
+        # 已分派任务的提交序号到模型签名，用于估算按提交顺序执行时的切换次数
+        self._dispatched: Dict[int, ModelSignature] = {}
+        self.succeeded = 0
+        self.failed = 0
+
+    def _get_template(self, workflow_path: str) -> WorkflowTemplate:
+        if workflow_path not in self._templates:
+            self._templates[workflow_path] = WorkflowTemplate.from_file(workflow_path, object_info=self.object_info)
+        return self._templates[workflow_path]
+
+    def prepare(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """生成最终prompt和模型签名，图片按内容哈希命名"""
+        if job.get('invalid'):
+            raise ValueError(job['invalid'])
+        template = self._get_template(job.get('workflow') or self.workflow_path)
+        updates = dict(job['updates'])
+        for key in updates:
+            template.slot(key)
+
+        image_path = job.get('image')
+        image_digest = None
+        if image_path and self.image_preprocessor:
+            image_path = job['image'] = self.image_preprocessor.prepare(image_path,
+                                                                        target_size(template.workflow, updates))
+        if image_path:
+            upload_cache = self.pool.pods[0].api.upload_cache
+            image_digest = upload_cache.digest(image_path) if upload_cache else file_digest(image_path)
+            load_image_node = find_load_image_node(template.workflow)
+            if load_image_node:
+                updates[f'node_{load_image_node}_inputs_image'] = content_filename(image_digest, image_path)
+
+        prompt = template.render(updates)
+        job['prompt'] = prompt
+        job['prompt_json'] = template.encode(prompt)
+        job['signature'] = model_signature(prompt)
+        job['image_digests'] = [image_digest] if image_digest else []
+        return job
+
+    def _enqueue(self, job: Dict[str, Any]):
+        with self._lock:
+            if 'seq' not in job:
+                job['seq'] = self._sequence
+                self._sequence += 1
+                job['skips'] = 0
+            self._pending.setdefault(job['signature'], deque()).append(job)
+
+    def _requeue(self, job: Dict[str, Any]):
+        """Pod故障时把任务放回队首"""
+        with self._lock:
+            self._pending.setdefault(job['signature'], deque()).appendleft(job)
+
+    def _next_job(self, pod: PodState) -> Optional[Dict[str, Any]]:
+        """为pod选择下一个任务：优先已加载的模型组，否则切换到最值得切换的组"""
+        with self._lock:
+            groups = [(signature, jobs) for signature, jobs in self._pending.items() if jobs]
+            if not groups:
+                return None
+            head_signature, head_jobs = min(groups, key=lambda group: group[1][0]['seq'])
+            loaded = self._loaded[id(pod)]
+
+            if head_jobs[0]['skips'] >= self.max_skips:
+                signature = head_signature
+            elif loaded in self._pending and self._pending[loaded]:
+                signature = loaded
+            else:
+                # 剩余任务多、且没有其他Pod在处理的组优先；相同时取最早提交的组
+                others = [sig for key, sig in self._loaded.items() if key != id(pod)]
+                signature = min(groups, key=lambda group: (-len(group[1]) / (1 + others.count(group[0])),
+                                                           group[1][0]['seq']))[0]
+
+            job = self._pending[signature].popleft()
+            if not self._pending[signature]:
+                del self._pending[signature]
+            if signature != head_signature:
+                head_jobs[0]['skips'] += 1
+            self._dispatched[job['seq']] = signature
+            if loaded is not None and signature != loaded:
+                self.switches += 1
+                print(f"🔄 {pod.api.server_address} 切换模型: {describe_signature(signature)}")
+            self._loaded[id(pod)] = signature
+            return job
+
+    @property
+    def avoided_switches(self) -> int:
+        """相比按提交顺序执行同一批任务少切换的次数，为负表示切换更多"""
+        with self._lock:
+            signatures = [self._dispatched[seq] for seq in sorted(self._dispatched)]
+        return fifo_switches(signatures, len(self.pool.pods)) - self.switches
+
+    def run_job(self, pod: PodState, job: Dict[str, Any]) -> Dict[str, Any]:
+        """在指定Pod上执行任务，返回结果记录"""
+        metrics = pod.api.metrics
+        timings = {}
+        record = {'id': job['id'], 'status': 'failed', 'prompt_id': None, 'outputs': [], 'error': None,
+                  'server': pod.api.server_address}
+        started = time.perf_counter()
+        mark = metrics.stage_timer(job['id'])
+        stage_started = [started]
+
+        def stage(name):
+            now = time.perf_counter()
+            timings[name] = round(now - stage_started[0], 3)
+            stage_started[0] = now
+            mark(name if name != 'wait' else None)
+
+        prompt_id = None
+        try:
+            prompt_id = self.pool.submit_prompt(job['prompt'], job.get('image'), pod=pod,
+                                              output_dir=job.get('output') or self.output_dir,
+                                              prompt_json=job.get('prompt_json'))
+            record['prompt_id'] = prompt_id
+            stage('submit')
+            history = self.pool.wait_for_completion(prompt_id, timeout=self.wait_timeout)
+            stage('wait')
+            nodes = self.pool.api_for(prompt_id).pop_node_profile(prompt_id)
+            if nodes:
+                record['nodes'] = nodes
+            filenames = collect_output_filenames(history)
+            record['outputs'] = [path for path in self.pool.download_outputs(
+                prompt_id, history, job.get('output') or self.output_dir) if path]
+            stage('download')
+            if len(record['outputs']) != len(filenames) or not filenames:
+                raise RuntimeError("未找到生成的文件或部分文件下载失败")
+            record['status'] = 'success'
+            if self.result_cache:
+                self.result_cache.store(job['cache_key'], record['outputs'])
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            record['error'] = str(e)
+            record['retry'] = prompt_id is None
+        except Exception as e:
+            record['error'] = str(e)
+        finally:
+            if prompt_id:
+                self.pool.release(prompt_id)
+            elapsed = time.perf_counter() - started
+            timings['total'] = round(elapsed, 3)
+            record['timings'] = timings
+            metrics.record_span('total', started, elapsed, job['id'], status=record['status'])
+        return record
+
+    def _write_result(self, f, record: Dict[str, Any]):
+        with self._write_lock:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+            if record['status'] == 'success':
+                self.succeeded += 1
+                print(f"✅ [{record['id']}] 完成，用时 {record['timings']['total']}s")
+            else:
+                self.failed += 1
+                print(f"❌ [{record['id']}] 失败: {record['error']}")
+
+    def _worker(self, pod: PodState, f):
+        while pod.healthy:
+            job = self._next_job(pod)
+            if job is None:
+                return
+            record = self.run_job(pod, job)
+            # 提交阶段连接失败的任务交给其他Pod重试一次
+            if record.pop('retry', False) and job.get('attempts', 0) < 1:
+                job['attempts'] = job.get('attempts', 0) + 1
+                self._requeue(job)
+                continue
+            self._complete(f, record)
+
+    def _complete(self, f, record: Dict[str, Any]):
+        """成功的任务（包括命中结果缓存的）先后处理再写结果，其余直接写结果"""
+        if self.postprocessor and record['status'] == 'success':
+            # 后处理在进程池中进行，Pod继续执行下一个任务；积压时submit阻塞
+            futures = [self.postprocessor.submit(path) for path in record['outputs']]
+            thread = threading.Thread(target=self._finish_postprocess, args=(f, record, futures), daemon=True)
+            thread.start()
+            self._postprocessing.append(thread)
+        else:
+            self._write_result(f, record)
+
+    def _finish_postprocess(self, f, record: Dict[str, Any], futures: List[Future]):
+        """后处理完成后再写结果，续跑时未完成后处理的任务会重新执行"""
+        record['postprocess'] = []
+        for future in futures:
+            try:
+                record['postprocess'].append(future.result())
+            except Exception as e:
+                record['postprocess'].append({'error': str(e)})
+        errors = [result['error'] for result in record['postprocess'] if result.get('error')]
+        if errors:
+            record.update(status='failed', error=f"后处理失败: {'; '.join(errors)}")
+        else:
+            record['outputs'] = [result['path'] for result in record['postprocess']]
+        self._write_result(f, record)
+
+    def run(self, jobs_path: str) -> int:
+        """执行任务文件中的全部任务，返回失败任务数"""
+        completed = load_completed_ids(self.results_path)
+        if completed:
+            print(f"跳过已完成的任务: {len(completed)} 个")
+
+        results_dir = os.path.dirname(self.results_path)
+        if results_dir:
+            os.makedirs(results_dir, exist_ok=True)
+
+        with open(self.results_path, 'a', encoding='utf-8') as f:
+            for job in load_jobs(jobs_path):
+                if job['id'] in completed:
+                    continue
+                record = {'id': job['id'], 'status': 'failed', 'prompt_id': None, 'outputs': [], 'error': None}
+                try:
+                    self.prepare(job)
+                    if self.result_cache:
+                        job['cache_key'] = canonical_prompt_hash(job['prompt'], job['image_digests'])
+                        cached_files = self.result_cache.lookup(job['cache_key'], job.get('output') or self.output_dir)
+                        if cached_files:
+                            record.update(status='success', outputs=cached_files, cached=True, timings={'total': 0})
+                            self._complete(f, record)
+                            continue
+                except Exception as e:
+                    record.update(error=str(e), timings={'total': 0})
+                    self._write_result(f, record)
+                    continue
+                self._enqueue(job)
+
+            for signature, jobs in self._pending.items():
+                print(f"模型组 [{describe_signature(signature)}]: {len(jobs)} 个任务")
+
+            self.pool.refresh()
+            threads = [threading.Thread(target=self._worker, args=(pod, f), daemon=True)
+                       for pod in self.pool.pods for _ in range(self.per_pod_in_flight)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            for thread in self._postprocessing:
+                thread.join()
+
+            # 所有Pod都不可用时剩余任务记为失败
+            for jobs in list(self._pending.values()):
+                for job in jobs:
+                    self._write_result(f, {'id': job['id'], 'status': 'failed', 'prompt_id': None, 'outputs': [],
+                                           'error': "没有可用的ComfyUI服务器", 'timings': {'total': 0}})
+            self._pending.clear()
+
+        print(f"批量执行结束: 成功 {self.succeeded} 个，失败 {self.failed} 个")
+        avoided = self.avoided_switches
+        if avoided >= 0:
+            print(f"模型切换 {self.switches} 次，相比按提交顺序执行避免了 {avoided} 次切换")
+        else:
+            print(f"模型切换 {self.switches} 次，比按提交顺序执行多 {-avoided} 次切换")
+        return self.failed
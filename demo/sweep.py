@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+参数扫描
+为任意 node_<id>_inputs_<key> 参数指定取值列表或范围，按笛卡尔积逐个生成任务
+（生成器按需展开，不在内存中构造整个网格），交给批量执行器并发执行，最后输出
+参数组合 → 输出文件 → 耗时 的结果表。
+
+取值格式:
+  node_27_inputs_seed=1,2,3          列表
+  node_27_inputs_seed=1..100         闭区间整数范围
+  node_27_inputs_cfg=5..7..0.5       带步长的范围
+"""
+
+import hashlib
+import itertools
+import json
+import os
+from decimal import Decimal
+from typing import Optional, Dict, Any, Iterable, Iterator, List, Tuple
+
+from async_client import AsyncComfyUIAPI
+from batch import BatchRunner
+from journal import JobJournal
+from metrics import Metrics
+from postprocess import PostProcessor
+from main import parse_value
+from result_cache import ResultCache
+from upload_cache import UploadCache
+
+
+class SweepRange:
+    """闭区间等差范围，迭代时逐个计算，不展开成列表"""
+
+    def __init__(self, start: Any, stop: Any, step: Any = 1):
+        self.start = Decimal(str(start))
+        self.stop = Decimal(str(stop))
+        self.step = Decimal(str(step))
+        if self.step == 0 or (self.stop - self.start) * self.step < 0:
+            raise ValueError(f"无效的范围: {start}..{stop}..{step}")
+        # 起止和步长都是整数时生成int，否则生成float
+        self.integral = all(isinstance(value, int) for value in (start, stop, step))
+
+    def __len__(self) -> int:
+        return int((self.stop - self.start) / self.step) + 1
+
+    def __iter__(self) -> Iterator[Any]:
+        for i in range(len(self)):
+            value = self.start + self.step * i
+            yield int(value) if self.integral else float(value)
+
+    def __repr__(self):
+        return f"SweepRange({self.start}..{self.stop}..{self.step})"
+
+
+def parse_sweep(spec: str) -> Tuple[str, Iterable[Any]]:
+    """解析 key=取值 格式的扫描参数，返回(key, 取值序列)"""
+    if '=' not in spec:
+        raise ValueError(f"扫描参数格式应为 node_ID_section_key=取值: {spec}")
+    key, text = spec.split('=', 1)
+    if '..' in text and ',' not in text:
+        bounds = [parse_value(part) for part in text.split('..')]
+        if len(bounds) not in (2, 3) or not all(isinstance(b, (int, float)) and not isinstance(b, bool)
+                                                for b in bounds):
+            raise ValueError(f"范围格式应为 start..stop 或 start..stop..step: {text}")
+        return key, SweepRange(*bounds)
+    # 列表中的重复值只保留一次
+    return key, list(dict.fromkeys(parse_value(part) for part in text.split(',')))
+
+
+def _product(axes: List[Iterable[Any]]) -> Iterator[Tuple[Any, ...]]:
+    """与itertools.product顺序相同，但每个维度按需重新迭代，不会先把范围展开成元组"""
+    if not axes:
+        yield ()
+        return
+    for head in axes[0]:
+        for rest in _product(axes[1:]):
+            yield (head,) + rest
+
+
+def expand_sweep(axes: Dict[str, Iterable[Any]], base_updates: Optional[Dict[str, Any]] = None
+                 ) -> Iterator[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """按笛卡尔积逐个生成(参数组合, 叠加在base_updates之上的完整更新)
+
+    每个维度的取值已去重，因此生成的组合互不相同；
+    同一个参数在base_updates和axes中同时出现时以扫描值为准。
+    """
+    keys = list(axes)
+    for values in _product([axes[key] for key in keys]):
+        params = dict(zip(keys, values))
+        updates = dict(base_updates or {})
+        updates.update(params)
+        yield params, updates
+
+
+def sweep_size(axes: Dict[str, Iterable[Any]]) -> int:
+    total = 1
+    for values in axes.values():
+        total *= len(values)
+    return total
+
+
+def build_axes(specs: List[str]) -> Dict[str, Iterable[Any]]:
+    """解析全部扫描参数；同一个key多次出现时合并为一个去重后的列表"""
+    axes: Dict[str, Iterable[Any]] = {}
+    for spec in specs:
+        key, values = parse_sweep(spec)
+        if key in axes:
+            axes[key] = list(dict.fromkeys(itertools.chain(axes[key], values)))
+        else:
+            axes[key] = values
+    return axes
+
+
+def sweep_config_id(workflow_path: str, base_updates: Optional[Dict[str, Any]] = None,
+                    image_path: Optional[str] = None) -> str:
+    """工作流内容、基础更新和输入图片的摘要，配置不同的扫描即使写入同一个结果文件也不会互相跳过"""
+    with open(workflow_path, 'rb') as f:
+        workflow_digest = hashlib.sha1(f.read()).hexdigest()
+    config = {'workflow': workflow_digest, 'updates': base_updates or {}, 'image': image_path}
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:8]
+
+
+def sweep_jobs(axes: Dict[str, Iterable[Any]], base_updates: Optional[Dict[str, Any]] = None,
+               image_path: Optional[str] = None, output_dir: Optional[str] = None,
+               config_id: str = '') -> Iterator[Dict[str, Any]]:
+    """生成批量执行器使用的任务，任务ID由配置(sweep_config_id)和参数组合决定，重新运行时跳过已完成的组合"""
+    prefix = f"sweep-{config_id}-" if config_id else "sweep-"
+    for params, updates in expand_sweep(axes, base_updates):
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+        job = {'id': f"{prefix}{digest}", 'params': params, 'updates': updates}
+        if image_path:
+            job['image'] = image_path
+        if output_dir:
+            job['output'] = output_dir
+        yield job
+
+
+def print_sweep_table(records: List[Dict[str, Any]], keys: List[str]):
+    """打印 参数组合 → 输出文件 → 耗时 的结果表"""
+    short_keys = [key.split('_inputs_', 1)[-1] for key in keys]
+    rows = []
+    for record in records:
+        params = record.get('params') or {}
+        outputs = record.get('outputs') or []
+        rows.append([str(params.get(key, '')) for key in keys] + [
+            os.path.basename(outputs[0]) if outputs else f"({record.get('error') or record['status']})",
+            f"{record.get('timings', {}).get('total', 0):.1f}s",
+        ])
+    header = short_keys + ['输出文件', '耗时']
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows)]
+    print("=== 扫描结果 ===")
+    for row in [header] + rows:
+        print('  '.join(str(cell).ljust(width) for cell, width in zip(row, widths)))
+
+
+async def run_sweep(
+        server_address: str,
+        workflow_path: str,
+        sweep_specs: List[str],
+        results_path: str,
+        base_updates: Optional[Dict[str, Any]] = None,
+        image_path: Optional[str] = None,
+        output_dir: str = "./output/",
+        max_in_flight: int = 4,
+        timeout: int = 30,
+        wait_timeout: Optional[float] = None,
+        use_websocket: bool = True,
+        upload_cache: Optional[UploadCache] = None,
+        result_cache: Optional[ResultCache] = None,
+        metrics: Optional[Metrics] = None,
+        journal: Optional[JobJournal] = None,
+        postprocessor: Optional[PostProcessor] = None,
+        object_info: Optional[Dict[str, Any]] = None,
+        compress_requests: bool = False
+) -> int:
+    """展开参数网格并发执行，返回退出码"""
+    try:
+        axes = build_axes(sweep_specs)
+        config_id = sweep_config_id(workflow_path, base_updates, image_path)
+    except (OSError, ValueError) as e:
+        print(f"错误: {e}")
+        return 1
+    print(f"扫描参数: {', '.join(f'{key}({len(values)})' for key, values in axes.items())}，"
+          f"共 {sweep_size(axes)} 个组合")
+
+    async with AsyncComfyUIAPI(server_address, timeout=timeout, use_websocket=use_websocket,
+                               max_connections=max(max_in_flight * 2, 10),
+                               upload_cache=upload_cache, metrics=metrics, journal=journal,
+                               compress_requests=compress_requests) as api:
+        if not await api.test_connection():
+            print("无法连接到ComfyUI服务器")
+            return 1
+
+        runner = BatchRunner(api, workflow_path, results_path, output_dir=output_dir,
+                             max_in_flight=max_in_flight, wait_timeout=wait_timeout,
+                             result_cache=result_cache, postprocessor=postprocessor,
+                             object_info=object_info)
+        failed = await runner.run_jobs(sweep_jobs(axes, base_updates, image_path, config_id=config_id))
+
+    # 结果表包括之前相同配置的运行中已完成的组合，同一组合只取最后一条记录
+    records = {}
+    with open(results_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if (record.get('params') is not None and set(record['params']) == set(axes)
+                    and record['id'].startswith(f"sweep-{config_id}-")):
+                records[record['id']] = record
+    print_sweep_table(list(records.values()), list(axes))
+    return 0 if failed == 0 else 1
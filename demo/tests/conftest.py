@@ -0,0 +1,142 @@
+"""
+测试共用的模拟ComfyUI服务器
+在后台线程的事件循环中运行 benchmarks/fake_server.py 的FakeComfyUI，
+ScriptedComfyUI 在其基础上增加可控的故障：执行失败、断开WebSocket、丢失事件、接口返回5xx。
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import pytest
+from aiohttp import web
+
+DEMO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DEMO_DIR)
+sys.path.insert(0, os.path.join(DEMO_DIR, 'benchmarks'))
+
+from fake_server import FakeComfyUI  # noqa: E402
+
+# 包含该节点类型的prompt执行时发送execution_error
+FAILING_NODE = 'FailingNode'
+
+
+class ScriptedComfyUI(FakeComfyUI):
+    """可注入故障的FakeComfyUI
+
+    failing为True时所有HTTP接口返回500（WebSocket除外）；silent为True时不发送任何WebSocket事件；
+    prompt中含FAILING_NODE节点时按ComfyUI的格式发送execution_error并写入失败的history。
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.failing = False
+        self.silent = False
+
+    def build_app(self) -> web.Application:
+        app = super().build_app()
+        app.middlewares.append(self._inject_failure)
+        return app
+
+    @web.middleware
+    async def _inject_failure(self, request, handler):
+        if self.failing and request.path != '/ws':
+            return web.json_response({'error': '模拟的服务器故障'}, status=500)
+        return await handler(request)
+
+    async def _send(self, client_id: Optional[str], event_type: str, data: Dict[str, Any]):
+        if not self.silent:
+            await super()._send(client_id, event_type, data)
+
+    async def _execute(self, item: Dict[str, Any]):
+        prompt = item['prompt']
+        failing = [node_id for node_id, node in prompt.items() if node.get('class_type') == FAILING_NODE]
+        if not failing:
+            await super()._execute(item)
+            return
+
+        prompt_id, client_id = item['prompt_id'], item['client_id']
+        base = {'prompt_id': prompt_id}
+        self.running[prompt_id] = item
+        await self._send(client_id, 'execution_start', dict(base, timestamp=int(time.time() * 1000)))
+        await self._send(client_id, 'executing', dict(base, node=failing[0], display_node=failing[0]))
+        await asyncio.sleep(self.delay)
+        self.running.pop(prompt_id, None)
+        error = dict(base, node_id=failing[0], node_type=FAILING_NODE, executed=[],
+                     exception_message='CUDA out of memory', exception_type='torch.OutOfMemoryError')
+        self.history[prompt_id] = {
+            'prompt': [item['number'], prompt_id, prompt, {}, []],
+            'outputs': {},
+            'status': {'status_str': 'error', 'completed': False,
+                       'messages': [['execution_error', error]]},
+        }
+        await self._send(client_id, 'execution_error', error)
+
+    async def drop_sockets(self):
+        """服务器端关闭所有WebSocket连接"""
+        for ws in list(self.sockets.values()):
+            await ws.close()
+
+
+class ServerThread:
+    """在独立线程的事件循环中运行模拟服务器，监听随机端口"""
+
+    def __init__(self, server: FakeComfyUI):
+        self.server = server
+        self.loop = asyncio.new_event_loop()
+        self.port = None
+        self._runner = None
+        self._ready = threading.Event()
+
+    @property
+    def address(self) -> str:
+        return f"127.0.0.1:{self.port}"
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        if not self._ready.wait(10):
+            raise RuntimeError("模拟服务器启动超时")
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self._runner = web.AppRunner(self.server.build_app())
+        self.loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        self.loop.run_until_complete(site.start())
+        self.port = self._runner.addresses[0][1]
+        self._ready.set()
+        self.loop.run_forever()
+
+    def call(self, coro, timeout: float = 5):
+        """在服务器的事件循环中执行协程并返回结果"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def stop(self):
+        self.call(self.server.drop_sockets())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+@pytest.fixture
+def server_factory():
+    """启动若干个ScriptedComfyUI，测试结束后关闭"""
+    started = []
+
+    def start(**kwargs) -> ServerThread:
+        kwargs.setdefault('delay', 0.2)
+        kwargs.setdefault('output_size', 1024)
+        thread = ServerThread(ScriptedComfyUI(**kwargs))
+        thread.start()
+        started.append(thread)
+        return thread
+
+    yield start
+    for thread in started:
+        thread.stop()
+
+
+@pytest.fixture
+def fake_server(server_factory) -> ServerThread:
+    return server_factory()
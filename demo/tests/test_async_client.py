@@ -0,0 +1,37 @@
+"""AsyncComfyUIAPI 的WebSocket等待：漏掉完成事件时靠定期确认history完成"""
+
+import asyncio
+import os
+import time
+
+from async_client import AsyncComfyUIAPI
+
+WORKFLOW = {
+    '1': {'class_type': 'EmptyLatentImage', 'inputs': {'width': 512, 'height': 512, 'batch_size': 1}},
+    '2': {'class_type': 'SaveImage', 'inputs': {'images': ['1', 0], 'filename_prefix': 'async'}},
+}
+
+
+def test_missed_completion_event_rechecks_history(fake_server):
+    # 连接正常但收不到任何事件（如代理丢帧），等待不应拖到整体超时
+    fake_server.server.silent = True
+
+    async def run():
+        async with AsyncComfyUIAPI(fake_server.address, timeout=0.5) as api:
+            result = await api.queue_prompt(WORKFLOW)
+            start = time.monotonic()
+            history = await api.wait_for_completion(result['prompt_id'], timeout=10)
+            return history, time.monotonic() - start
+
+    history, elapsed = asyncio.run(run())
+    assert history['status']['status_str'] == 'success'
+    assert elapsed < 3
+
+
+def test_download_output(fake_server, tmp_path):
+    async def run():
+        async with AsyncComfyUIAPI(fake_server.address, timeout=5, use_websocket=False) as api:
+            return await api.download_output('ComfyUI_00001_.png', str(tmp_path))
+
+    path = asyncio.run(run())
+    assert os.path.getsize(path) == fake_server.server.output_size
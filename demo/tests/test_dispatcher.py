@@ -0,0 +1,92 @@
+"""PriorityDispatcher / run_priority_batch：截止时间、等待超时、结果缓存和任务日志"""
+
+import json
+import time
+
+import pytest
+
+from dispatcher import PriorityDispatcher, run_priority_batch
+from journal import JobJournal
+from main import ComfyUIAPI
+from result_cache import ResultCache
+
+WORKFLOW = {
+    '1': {'class_type': 'EmptyLatentImage', 'inputs': {'width': 512, 'height': 512, 'batch_size': 1}},
+    '2': {'class_type': 'SaveImage', 'inputs': {'images': ['1', 0], 'filename_prefix': 'lane'}},
+}
+
+
+@pytest.fixture
+def api(fake_server):
+    client = ComfyUIAPI(fake_server.address, timeout=5, use_websocket=False)
+    yield client
+    client.close()
+
+
+def test_expired_job_behind_blocked_head_is_pruned(api, fake_server):
+    fake_server.server.delay = 0.6
+    dispatcher = PriorityDispatcher(api, watermark=1, poll_interval=0.05)
+    try:
+        first = dispatcher.submit(WORKFLOW)
+        second = dispatcher.submit(WORKFLOW)
+        # head因水位线在本地等待，排在它后面的任务截止时间先到
+        head = dispatcher.submit(WORKFLOW, priority=1)
+        expiring = dispatcher.submit(WORKFLOW, priority=5, deadline=0.1)
+
+        start = time.monotonic()
+        with pytest.raises(TimeoutError):
+            expiring.result(timeout=5)
+        assert time.monotonic() - start < 0.5
+        assert not head.done()
+        assert dispatcher.expired == 1
+        for future in (first, second, head):
+            future.result(timeout=10)
+    finally:
+        dispatcher.close()
+
+
+def test_wait_timeout_cancels_job(api, fake_server):
+    fake_server.server.delay = 3
+    dispatcher = PriorityDispatcher(api, wait_timeout=0.3, poll_interval=0.05)
+    try:
+        future = dispatcher.submit(WORKFLOW)
+        with pytest.raises(TimeoutError):
+            future.result(timeout=5)
+        # 没有截止时间，不计入expired
+        assert dispatcher.expired == 0
+    finally:
+        dispatcher.close()
+
+
+def test_priority_batch_uses_cache_and_journal(tmp_path, fake_server):
+    workflow_path = tmp_path / 'workflow.json'
+    workflow_path.write_text(json.dumps(WORKFLOW))
+    jobs_path = tmp_path / 'jobs.jsonl'
+    jobs_path.write_text(''.join(
+        json.dumps({'id': f'job-{index}', 'updates': {'node_2_inputs_filename_prefix': f'lane{index}'},
+                    'priority': index}) + '\n' for index in range(3)))
+    journal = JobJournal(str(tmp_path / 'journal.jsonl'))
+    cache = ResultCache(str(tmp_path / 'cache'))
+    api = ComfyUIAPI(fake_server.address, timeout=5, use_websocket=False, journal=journal)
+    try:
+        results_path = str(tmp_path / 'results.jsonl')
+        failed = run_priority_batch([api], str(jobs_path), str(workflow_path), results_path,
+                                    output_dir=str(tmp_path / 'out'), wait_timeout=10, result_cache=cache)
+        assert failed == 0
+        # 任务日志带job_id和结果文件，--resume可以补写结果行
+        journaled = journal.jobs(api.base_url)
+        assert set(journaled) == {'job-0', 'job-1', 'job-2'}
+        assert all(entry['state'] == 'downloaded' for entry in journaled.values())
+
+        # 第二次运行（新的结果文件）全部命中结果缓存，不再提交
+        submitted = fake_server.server.number
+        rerun_path = str(tmp_path / 'rerun.jsonl')
+        failed = run_priority_batch([api], str(jobs_path), str(workflow_path), rerun_path,
+                                    output_dir=str(tmp_path / 'out2'), result_cache=cache)
+        assert failed == 0
+        assert fake_server.server.number == submitted
+        with open(rerun_path, encoding='utf-8') as f:
+            assert all(json.loads(line).get('cached') for line in f)
+    finally:
+        api.close()
+        journal.close()
@@ -0,0 +1,72 @@
+"""HistoryTracker.poll：只在任务离开队列时读取history，条数按离开队列的任务数取"""
+
+from history_tracker import HistoryTracker
+
+
+class StubAPI:
+    """按脚本返回 /queue 和 /history 的客户端，记录每次请求的max_items"""
+
+    def __init__(self):
+        self.queue = {'queue_running': [], 'queue_pending': []}
+        self.history = {}
+        self.max_items = []
+        self.single = []
+
+    def set_queue(self, running, pending=()):
+        self.queue = {'queue_running': [[0, prompt_id] for prompt_id in running],
+                      'queue_pending': [[0, prompt_id] for prompt_id in pending]}
+
+    def complete(self, prompt_id):
+        self.history[prompt_id] = {'status': {'status_str': 'success'}, 'outputs': {}}
+
+    def get_queue(self):
+        return self.queue
+
+    def get_recent_history(self, max_items):
+        self.max_items.append(max_items)
+        return dict(list(self.history.items())[-max_items:])
+
+    def get_history(self, prompt_id):
+        self.single.append(prompt_id)
+        return {prompt_id: self.history[prompt_id]} if prompt_id in self.history else {}
+
+
+def test_history_sized_by_departures():
+    api = StubAPI()
+    tracker = HistoryTracker(api)
+    finished_ids = []
+    tracker._finish = lambda finished: finished_ids.extend(finished)
+    prompt_ids = [f'p{index}' for index in range(200)]
+
+    # 全部在队列中：只请求 /queue
+    api.set_queue(prompt_ids[:1], prompt_ids[1:])
+    tracker.poll(prompt_ids)
+    assert api.max_items == []
+
+    # 200个在途任务中两个完成，history只读取新写入的两条
+    api.set_queue(prompt_ids[2:3], prompt_ids[3:])
+    api.complete('p0')
+    api.complete('p1')
+    tracker.poll(prompt_ids)
+    assert api.max_items == [2]
+    assert sorted(finished_ids) == ['p0', 'p1']
+    assert api.single == []
+
+
+def test_pushed_out_prompt_checked_individually():
+    api = StubAPI()
+    tracker = HistoryTracker(api)
+    finished_ids = []
+    tracker._finish = lambda finished: finished_ids.extend(finished)
+
+    api.set_queue(['mine'])
+    tracker.poll(['mine'])
+    # 两次轮询之间其他客户端提交并完成的任务把mine挤出了最近history
+    api.set_queue([])
+    api.complete('mine')
+    api.complete('other')
+    tracker.poll(['mine'])
+
+    assert api.max_items == [1]
+    assert api.single == ['mine']
+    assert finished_ids == ['mine']
@@ -0,0 +1,40 @@
+"""JobJournal：多进程共用日志时的压缩，以及按提交时间选择批量任务的最后一次提交"""
+
+from journal import JobJournal
+
+SERVER = 'http://127.0.0.1:8188'
+
+
+def test_compaction_does_not_lose_other_writers(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    # 两个实例模拟两个进程，各自持有日志的文件句柄
+    first = JobJournal(path)
+    second = JobJournal(path)
+    try:
+        first.record('p1', 'submitted', server=SERVER)
+        second.record('p2', 'submitted', server=SERVER)
+        second.record('p2', 'downloaded')
+        second.compact()
+        # first仍持有压缩前的文件，写入必须落到新文件中
+        first.record('p3', 'submitted', server=SERVER)
+
+        entries = first.replay()
+        assert set(entries) == {'p1', 'p3'}
+        assert [entry['prompt_id'] for entry in second.pending()] == ['p1', 'p3']
+    finally:
+        first.close()
+        second.close()
+
+
+def test_jobs_prefers_latest_submission(tmp_path):
+    journal = JobJournal(str(tmp_path / 'journal.jsonl'))
+    try:
+        journal.record('old', 'submitted', server=SERVER, job_id='job-1')
+        journal.record('new', 'submitted', server=SERVER, job_id='job-1')
+        # 旧提交的状态更新晚于新提交，不应覆盖
+        journal.record('old', 'lost')
+
+        jobs = journal.jobs(SERVER)
+        assert jobs['job-1']['prompt_id'] == 'new'
+    finally:
+        journal.close()
@@ -0,0 +1,102 @@
+"""命令行取值的解析：parse_value按字面猜测类型，coerce_updates按 /object_info 的节点定义转换"""
+
+import pytest
+
+from main import parse_updates, parse_value
+from object_info import coerce_updates
+
+OBJECT_INFO = {
+    'KSampler': {'input': {
+        'required': {
+            'seed': ['INT', {'default': 0, 'min': 0, 'max': 0xffffffffffffffff}],
+            'steps': ['INT', {'default': 20, 'min': 1, 'max': 10000}],
+            'cfg': ['FLOAT', {'default': 8.0, 'min': 0.0, 'max': 100.0}],
+            'sampler_name': [['euler', 'euler_ancestral', 'dpmpp_2m'], {}],
+            'denoise': ['FLOAT', {'default': 1.0, 'min': 0.0, 'max': 1.0}],
+            'model': ['MODEL'],
+        },
+        'optional': {'add_noise': ['BOOLEAN', {'default': True}]},
+    }},
+    'CLIPTextEncode': {'input': {'required': {'text': ['STRING', {'multiline': True}], 'clip': ['CLIP']}}},
+    'LoadImage': {'input': {'required': {'image': [['example.png'], {'image_upload': True}]}}},
+}
+
+WORKFLOW = {
+    '3': {'class_type': 'KSampler', 'inputs': {'seed': 1, 'steps': 20, 'cfg': 8.0, 'model': ['4', 0]}},
+    '6': {'class_type': 'CLIPTextEncode', 'inputs': {'text': 'a cat', 'clip': ['4', 1]}},
+    '10': {'class_type': 'LoadImage', 'inputs': {'image': 'example.png'}},
+}
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('42', 42),
+    ('-5', -5),
+    ('-0.5', -0.5),
+    ('1e-3', 0.001),
+    ('1E3', 1000.0),
+    (' 7 ', 7),
+    ('true', True),
+    ('False', False),
+    ('[1, 2.5, "a"]', [1, 2.5, 'a']),
+    ('{"width": 512}', {'width': 512}),
+    ('1_000', '1_000'),
+    ('nan', 'nan'),
+    ('inf', 'inf'),
+    ('cat.png', 'cat.png'),
+    ('[broken', '[broken'),
+    ('', ''),
+])
+def test_parse_value(text, expected):
+    value = parse_value(text)
+    assert value == expected
+    assert type(value) is type(expected)
+
+
+def test_parse_updates_splits_on_first_equals():
+    updates = parse_updates(['node_6_inputs_text=a=b', 'node_3_inputs_seed=-1', 'ignored'])
+    assert updates == {'node_6_inputs_text': 'a=b', 'node_3_inputs_seed': -1}
+    assert parse_updates(['node_3_inputs_seed=7'], typed=False) == {'node_3_inputs_seed': '7'}
+
+
+def test_coerce_updates_by_schema():
+    raw = parse_updates([
+        'node_3_inputs_seed=1e3',
+        'node_3_inputs_cfg=7',
+        'node_3_inputs_sampler_name=dpmpp_2m',
+        'node_3_inputs_add_noise=no',
+        'node_6_inputs_text=123',
+        'node_10_inputs_image=upload_ab12.png',
+        'node_3_inputs_extra=-2',
+        'node_99_inputs_seed=5',
+    ], typed=False)
+
+    coerced = coerce_updates(WORKFLOW, raw, OBJECT_INFO)
+
+    assert coerced == {
+        'node_3_inputs_seed': 1000,
+        'node_3_inputs_cfg': 7.0,
+        'node_3_inputs_sampler_name': 'dpmpp_2m',
+        'node_3_inputs_add_noise': False,
+        # 提示词保持字符串
+        'node_6_inputs_text': '123',
+        # 上传的图片不在服务器选项中
+        'node_10_inputs_image': 'upload_ab12.png',
+        # 没有定义的输入和节点按字面猜测
+        'node_3_inputs_extra': -2,
+        'node_99_inputs_seed': 5,
+    }
+    assert type(coerced['node_3_inputs_seed']) is int
+    assert type(coerced['node_3_inputs_cfg']) is float
+
+
+@pytest.mark.parametrize('key, value', [
+    ('node_3_inputs_steps', '0'),
+    ('node_3_inputs_denoise', '1.5'),
+    ('node_3_inputs_seed', '5.5'),
+    ('node_3_inputs_seed', 'abc'),
+    ('node_3_inputs_sampler_name', 'bogus'),
+    ('node_3_inputs_add_noise', 'maybe'),
+])
+def test_coerce_updates_rejects_invalid(key, value):
+    with pytest.raises(ValueError):
+        coerce_updates(WORKFLOW, {key: value}, OBJECT_INFO)
@@ -0,0 +1,94 @@
+"""ComfyUIPool：剔除返回错误的服务器、冷却后重新接纳，以及prompt固定到执行它的服务器"""
+
+import time
+
+import pytest
+
+from pool import ComfyUIPool
+
+WORKFLOW = {
+    '1': {'class_type': 'LoadImage', 'inputs': {'image': 'input.png'}},
+    '2': {'class_type': 'SaveImage', 'inputs': {'images': ['1', 0], 'filename_prefix': 'pool'}},
+}
+
+
+@pytest.fixture
+def servers(server_factory):
+    # 执行较慢，提交的任务会留在队列中体现为负载
+    return server_factory(delay=0.5), server_factory(delay=0.5)
+
+
+def make_pool(servers, **kwargs) -> ComfyUIPool:
+    kwargs.setdefault('refresh_interval', 0)
+    return ComfyUIPool([server.address for server in servers], timeout=5, use_websocket=False, **kwargs)
+
+
+def pod_for(pool: ComfyUIPool, server):
+    return next(pod for pod in pool.pods if pod.api.server_address == server.address)
+
+
+def test_failing_server_ejected_and_readmitted(servers):
+    good, bad = servers
+    pool = make_pool(servers, max_failures=2, eject_seconds=0.5)
+    try:
+        bad.server.failing = True
+        pool.refresh()
+        assert pod_for(pool, bad).healthy, "一次失败不应剔除"
+        pool.refresh()
+        assert not pod_for(pool, bad).healthy
+
+        # 剔除期间任务全部发往正常的服务器，也不再探测故障服务器
+        probes = bad.server.requests
+        prompt_ids = [pool.submit_prompt(WORKFLOW) for _ in range(4)]
+        assert all(pool.api_for(prompt_id).server_address == good.address for prompt_id in prompt_ids)
+        assert bad.server.number == 0
+        assert bad.server.requests == probes
+
+        # 服务器恢复，冷却期结束后的探测成功即重新接纳
+        bad.server.failing = False
+        time.sleep(0.6)
+        pool.refresh()
+        assert pod_for(pool, bad).healthy
+        assert pod_for(pool, bad).failures == 0
+
+        # 正常的服务器队列中仍有任务，新任务发往恢复的服务器
+        prompt_id = pool.submit_prompt(WORKFLOW)
+        assert pool.api_for(prompt_id).server_address == bad.address
+        assert bad.server.number == 1
+    finally:
+        pool.close()
+
+
+def test_all_servers_ejected(servers):
+    pool = make_pool(servers, max_failures=1, eject_seconds=30)
+    try:
+        for server in servers:
+            server.server.failing = True
+        with pytest.raises(ConnectionError):
+            pool.submit_prompt(WORKFLOW)
+    finally:
+        pool.close()
+
+
+def test_prompt_pinned_to_executing_server(servers):
+    pool = make_pool(servers)
+    try:
+        prompt_ids = [pool.submit_prompt(WORKFLOW) for _ in range(4)]
+        by_address = {server.address: server for server in servers}
+        used = {pool.api_for(prompt_id).server_address for prompt_id in prompt_ids}
+        assert used == set(by_address), "任务应分散到两个服务器"
+
+        for prompt_id in prompt_ids:
+            # history只存在于执行它的服务器，通过池查询必须发往同一台
+            history = pool.wait_for_completion(prompt_id, check_interval=0.1, timeout=10)
+            assert history['status']['status_str'] == 'success'
+            owner = pool.api_for(prompt_id).server_address
+            for address, server in by_address.items():
+                assert (prompt_id in server.server.history) == (address == owner)
+            pool.release(prompt_id)
+            with pytest.raises(KeyError):
+                pool.api_for(prompt_id)
+
+        assert all(pod.in_flight == 0 for pod in pool.pods)
+    finally:
+        pool.close()
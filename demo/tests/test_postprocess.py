@@ -0,0 +1,34 @@
+"""PostProcessor：运行时注册的自定义步骤在spawn启动的子进程中也能执行"""
+
+import multiprocessing
+
+import pytest
+
+from postprocess import PostProcessor, register_step
+
+
+def mark_processed(result, options):
+    result['marked'] = options.get('tag')
+
+
+def test_registered_step_runs_under_spawn(tmp_path):
+    register_step('mark', mark_processed)
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(b'\0' * 16)
+
+    # spawn的子进程重新导入模块，不会执行父进程中的register_step
+    processor = PostProcessor(['checksum', 'mark'], {'tag': 'spawned'}, max_workers=1,
+                              mp_context=multiprocessing.get_context('spawn'))
+    try:
+        result = processor.process(str(path))
+    finally:
+        processor.close()
+
+    assert result['error'] is None
+    assert result['marked'] == 'spawned'
+    assert result['size'] == 16
+
+
+def test_register_step_rejects_lambda():
+    with pytest.raises(ValueError):
+        register_step('inline', lambda result, options: None)
@@ -0,0 +1,53 @@
+"""AffinityScheduler 的模型组选择和切换次数统计"""
+
+import pytest
+
+from pool import ComfyUIPool
+from scheduler import AffinityScheduler, fifo_switches
+
+MODEL_A = (('UNETLoader', 'unet_name', 'wan2.1_t2v_14B.safetensors'),)
+MODEL_B = (('UNETLoader', 'unet_name', 'wan2.1_i2v_14B.safetensors'),)
+
+
+@pytest.fixture
+def scheduler(tmp_path):
+    # 只调用_next_job，不会访问服务器
+    pool = ComfyUIPool(['127.0.0.1:1'], use_websocket=False)
+    yield AffinityScheduler(pool, 'unused.json', str(tmp_path / 'results.jsonl'))
+    pool.close()
+
+
+def drain(scheduler, signatures):
+    for index, signature in enumerate(signatures):
+        scheduler._enqueue({'id': f'job-{index}', 'signature': signature})
+    pod = scheduler.pool.pods[0]
+    order = []
+    while True:
+        job = scheduler._next_job(pod)
+        if job is None:
+            return order
+        order.append(job['signature'])
+
+
+def test_fifo_switches():
+    assert fifo_switches([MODEL_A, MODEL_B, MODEL_B], 1) == 1
+    assert fifo_switches([MODEL_A, MODEL_B, MODEL_A, MODEL_B], 1) == 3
+    # 两个Pod轮流执行时各自只跑一个模型
+    assert fifo_switches([MODEL_A, MODEL_B, MODEL_A, MODEL_B], 2) == 0
+
+
+def test_no_avoided_switch_when_fifo_switches_as_often(scheduler):
+    order = drain(scheduler, [MODEL_A, MODEL_B, MODEL_B])
+
+    assert order == [MODEL_B, MODEL_B, MODEL_A]
+    assert scheduler.switches == 1
+    # 按提交顺序A,B,B同样只切换一次
+    assert scheduler.avoided_switches == 0
+
+
+def test_avoided_switches_when_grouping(scheduler):
+    order = drain(scheduler, [MODEL_A, MODEL_B, MODEL_A, MODEL_B])
+
+    assert order == [MODEL_A, MODEL_A, MODEL_B, MODEL_B]
+    assert scheduler.switches == 1
+    assert scheduler.avoided_switches == 2
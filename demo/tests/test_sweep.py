@@ -0,0 +1,88 @@
+"""参数扫描：取值解析、按需展开的笛卡尔积、稳定的配置ID和任务ID"""
+
+import itertools
+import time
+
+import pytest
+
+from sweep import (SweepRange, build_axes, expand_sweep, parse_sweep, sweep_config_id, sweep_jobs,
+                   sweep_size)
+
+SEED = 'node_52_inputs_seed'
+CFG = 'node_52_inputs_cfg'
+
+
+def test_parse_list_deduplicates():
+    key, values = parse_sweep(f'{SEED}=3,1,3,2')
+    assert key == SEED
+    assert values == [3, 1, 2]
+    assert parse_sweep('node_54_inputs_format=video/h264-mp4,video/webm')[1] == ['video/h264-mp4', 'video/webm']
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('1..5', [1, 2, 3, 4, 5]),
+    ('-2..2..2', [-2, 0, 2]),
+    ('10..1..-3', [10, 7, 4, 1]),
+    ('5..7..0.5', [5.0, 5.5, 6.0, 6.5, 7.0]),
+    ('0.1..0.3..0.1', [0.1, 0.2, 0.3]),
+])
+def test_parse_range(text, expected):
+    _, values = parse_sweep(f'{CFG}={text}')
+    assert isinstance(values, SweepRange)
+    assert list(values) == expected
+    assert len(values) == len(expected)
+    assert all(type(value) is type(expected[0]) for value in values)
+
+
+@pytest.mark.parametrize('spec', [f'{SEED}=1..5..0', f'{SEED}=5..1', f'{SEED}=a..b', f'{SEED}=1..2..3..4', SEED])
+def test_parse_invalid(spec):
+    with pytest.raises(ValueError):
+        parse_sweep(spec)
+
+
+def test_expand_is_lazy():
+    axes = build_axes([f'{SEED}=1..1000000000000', f'{CFG}=5,6'])
+    assert sweep_size(axes) == 2 * 10 ** 12
+
+    start = time.monotonic()
+    first = list(itertools.islice(expand_sweep(axes), 3))
+    assert time.monotonic() - start < 1
+    assert [params for params, _ in first] == [{SEED: 1, CFG: 5}, {SEED: 1, CFG: 6}, {SEED: 2, CFG: 5}]
+
+
+def test_expand_overrides_base_updates():
+    axes = build_axes([f'{SEED}=1,2'])
+    combos = list(expand_sweep(axes, {SEED: 99, 'node_52_inputs_steps': 4}))
+    assert [updates for _, updates in combos] == [
+        {SEED: 1, 'node_52_inputs_steps': 4},
+        {SEED: 2, 'node_52_inputs_steps': 4},
+    ]
+
+
+def test_build_axes_merges_repeated_keys():
+    axes = build_axes([f'{SEED}=1,2', f'{SEED}=2..4'])
+    assert axes[SEED] == [1, 2, 3, 4]
+
+
+def test_config_id_stable(tmp_path):
+    workflow = tmp_path / 'workflow.json'
+    workflow.write_text('{"1": {"class_type": "KSampler", "inputs": {}}}')
+    base = sweep_config_id(str(workflow), {'a': 1, 'b': 2}, 'cat.png')
+
+    assert sweep_config_id(str(workflow), {'b': 2, 'a': 1}, 'cat.png') == base
+    assert sweep_config_id(str(workflow), {'a': 1, 'b': 3}, 'cat.png') != base
+    assert sweep_config_id(str(workflow), {'a': 1, 'b': 2}, 'dog.png') != base
+    workflow.write_text('{"1": {"class_type": "KSampler", "inputs": {"seed": 1}}}')
+    assert sweep_config_id(str(workflow), {'a': 1, 'b': 2}, 'cat.png') != base
+
+
+def test_job_ids_stable_and_unique():
+    axes = build_axes([f'{SEED}=1..3', f'{CFG}=5,6'])
+    first = [job['id'] for job in sweep_jobs(axes, config_id='abcd1234')]
+    second = [job['id'] for job in sweep_jobs(build_axes([f'{SEED}=1..3', f'{CFG}=5,6']), config_id='abcd1234')]
+
+    assert first == second
+    assert len(set(first)) == 6
+    assert all(job_id.startswith('sweep-abcd1234-') for job_id in first)
+    other = {job['id'] for job in sweep_jobs(axes, config_id='ffff0000')}
+    assert other.isdisjoint(first)
@@ -0,0 +1,107 @@
+"""工作流校验：更新键、连线、环和按 /object_info 的检查"""
+
+import copy
+
+import pytest
+
+from validator import validate_workflow
+
+OBJECT_INFO = {
+    'CheckpointLoaderSimple': {
+        'input': {'required': {'ckpt_name': [['sd15.safetensors', 'sdxl.safetensors'], {}]}},
+        'output': ['MODEL', 'CLIP', 'VAE'],
+    },
+    'CLIPTextEncode': {
+        'input': {'required': {'text': ['STRING', {'multiline': True}], 'clip': ['CLIP']}},
+        'output': ['CONDITIONING'],
+    },
+    'KSampler': {
+        'input': {'required': {'model': ['MODEL'], 'positive': ['CONDITIONING'],
+                               'seed': ['INT', {'min': 0, 'max': 2 ** 32}],
+                               'steps': ['INT', {'min': 1, 'max': 100}]}},
+        'output': ['LATENT'],
+    },
+    'SaveLatent': {'input': {'required': {'samples': ['LATENT']}}, 'output': [], 'output_node': True},
+}
+
+WORKFLOW = {
+    '1': {'class_type': 'CheckpointLoaderSimple', 'inputs': {'ckpt_name': 'sd15.safetensors'}},
+    '2': {'class_type': 'CLIPTextEncode', 'inputs': {'text': 'a cat', 'clip': ['1', 1]}},
+    '3': {'class_type': 'KSampler', 'inputs': {'model': ['1', 0], 'positive': ['2', 0], 'seed': 1, 'steps': 20}},
+    '4': {'class_type': 'SaveLatent', 'inputs': {'samples': ['3', 0]}},
+}
+
+
+def workflow_with(node_id, name, value):
+    workflow = copy.deepcopy(WORKFLOW)
+    workflow[node_id]['inputs'][name] = value
+    return workflow
+
+
+def test_valid_workflow():
+    report = validate_workflow(WORKFLOW, {'node_3_inputs_seed': 42}, object_info=OBJECT_INFO)
+    assert report.ok, report.errors
+    assert report.warnings == []
+
+
+@pytest.mark.parametrize('key', ['node_9_inputs_seed', 'seed=1', 'node_3'])
+def test_update_targets_missing_node_or_bad_key(key):
+    report = validate_workflow(WORKFLOW, {key: 1})
+    assert not report.ok
+
+
+def test_update_bad_input_name():
+    # 没有节点定义时新增输入只是警告，有定义时是错误
+    assert validate_workflow(WORKFLOW, {'node_3_inputs_sead': 1}).ok
+    assert validate_workflow(WORKFLOW, {'node_3_inputs_sead': 1}).warnings
+    report = validate_workflow(WORKFLOW, {'node_3_inputs_sead': 1}, object_info=OBJECT_INFO)
+    assert any('sead' in error for error in report.errors)
+
+
+def test_extra_update_keys_checked():
+    report = validate_workflow(WORKFLOW, extra_update_keys=['node_8_inputs_seed'])
+    assert any('不存在节点 8' in error for error in report.errors)
+
+
+def test_dangling_link():
+    report = validate_workflow(workflow_with('3', 'model', ['7', 0]))
+    assert any('不存在的节点 7' in error for error in report.errors)
+
+
+def test_negative_output_index():
+    assert not validate_workflow(workflow_with('3', 'model', ['1', -1])).ok
+
+
+def test_cycle():
+    workflow = workflow_with('2', 'clip', ['3', 0])
+    report = validate_workflow(workflow)
+    assert any('环' in error for error in report.errors)
+
+
+def test_missing_class_type():
+    workflow = copy.deepcopy(WORKFLOW)
+    del workflow['4']['class_type']
+    assert not validate_workflow(workflow).ok
+
+
+def test_object_info_checks():
+    # 连线类型不匹配
+    report = validate_workflow(workflow_with('3', 'model', ['1', 2]), object_info=OBJECT_INFO)
+    assert any('需要 MODEL' in error for error in report.errors)
+    # 输出序号超出范围
+    report = validate_workflow(workflow_with('3', 'model', ['1', 5]), object_info=OBJECT_INFO)
+    assert any('只有 3 个输出' in error for error in report.errors)
+    # 数值范围和下拉选项
+    assert not validate_workflow(WORKFLOW, {'node_3_inputs_steps': 0}, object_info=OBJECT_INFO).ok
+    assert not validate_workflow(WORKFLOW, {'node_1_inputs_ckpt_name': 'missing.safetensors'},
+                                 object_info=OBJECT_INFO).ok
+    # 缺少必填输入
+    workflow = copy.deepcopy(WORKFLOW)
+    del workflow['3']['inputs']['positive']
+    report = validate_workflow(workflow, object_info=OBJECT_INFO)
+    assert any('positive' in error for error in report.errors)
+    # 服务器上没有的节点类型
+    workflow = copy.deepcopy(WORKFLOW)
+    workflow['4']['class_type'] = 'VHS_VideoCombine'
+    report = validate_workflow(workflow, object_info=OBJECT_INFO)
+    assert any('VHS_VideoCombine' in error for error in report.errors)
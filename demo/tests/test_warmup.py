@@ -0,0 +1,36 @@
+"""预热：已就绪的服务器在一个检查间隔内重启（/queue仍可访问）也要撤销就绪"""
+
+import os
+
+import pytest
+
+from main import ComfyUIAPI
+from warmup import restart_reason, warm_server
+
+WORKFLOW_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             'workflows', 'text_to_video_workflow.json')
+
+
+@pytest.fixture
+def api(fake_server):
+    client = ComfyUIAPI(fake_server.address, timeout=5)
+    yield client
+    client.close()
+
+
+def test_restart_detected_by_history_marker(api, fake_server):
+    fake_server.server.delay = 0.05
+    results = warm_server(api, [WORKFLOW_PATH], passes=2, wait_timeout=10)
+    marker = results[-1]['prompt_id']
+    assert results[0]['warm'] is not None
+    assert restart_reason(api, marker) is None
+
+    # 重启后的ComfyUI history为空，/queue照常可访问
+    fake_server.server.history.clear()
+    assert restart_reason(api, marker) is not None
+
+
+def test_unreachable_server_raises(api, fake_server):
+    fake_server.server.failing = True
+    with pytest.raises(Exception):
+        restart_reason(api, 'any')
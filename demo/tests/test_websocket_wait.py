@@ -0,0 +1,126 @@
+"""ComfyUIAPI.wait_for_completion 的WebSocket等待路径：正常完成、执行失败、断线退化为轮询、整体超时"""
+
+import threading
+import time
+
+import pytest
+
+from conftest import FAILING_NODE
+from main import ComfyUIAPI, ComfyUIExecutionError
+from retry_policy import CircuitBreaker, RetryPolicy
+
+WORKFLOW = {
+    '1': {'class_type': 'LoadImage', 'inputs': {'image': 'input.png'}},
+    '2': {'class_type': 'SaveImage', 'inputs': {'images': ['1', 0], 'filename_prefix': 'test'}},
+}
+
+FAILING_WORKFLOW = {
+    '1': {'class_type': 'LoadImage', 'inputs': {'image': 'input.png'}},
+    '2': {'class_type': FAILING_NODE, 'inputs': {'image': ['1', 0]}},
+}
+
+
+@pytest.fixture
+def api(fake_server):
+    client = ComfyUIAPI(fake_server.address, timeout=5)
+    assert client.use_websocket, "需要安装websocket-client"
+    yield client
+    client.close()
+
+
+def submit(api: ComfyUIAPI, workflow) -> str:
+    result = api.queue_prompt(workflow)
+    assert 'prompt_id' in result
+    return result['prompt_id']
+
+
+def test_completes_via_websocket(api, fake_server):
+    prompt_id = submit(api, WORKFLOW)
+
+    history = api.wait_for_completion(prompt_id, timeout=10)
+
+    assert history['status']['status_str'] == 'success'
+    assert history['outputs']['2']['images'][0]['filename'].startswith('test_')
+    # 完成通知来自WebSocket，没有启动轮询
+    assert api._tracker is None
+
+
+def test_execution_error_raises(api, fake_server):
+    prompt_id = submit(api, FAILING_WORKFLOW)
+
+    with pytest.raises(ComfyUIExecutionError) as info:
+        api.wait_for_completion(prompt_id, timeout=10)
+
+    assert info.value.prompt_id == prompt_id
+    assert info.value.node_id == '2'
+    assert 'CUDA out of memory' in str(info.value)
+
+
+def test_falls_back_to_polling_when_socket_drops(api, fake_server):
+    fake_server.server.delay = 1.5
+    prompt_id = submit(api, WORKFLOW)
+
+    result = {}
+    waiting = threading.Thread(
+        target=lambda: result.update(history=api.wait_for_completion(prompt_id, check_interval=0.2, timeout=10)))
+    waiting.start()
+    # 等待者登记后、任务完成前由服务器断开连接
+    deadline = time.monotonic() + 5
+    while prompt_id not in api._waiters:
+        assert time.monotonic() < deadline, "等待者没有登记"
+        time.sleep(0.01)
+    fake_server.call(fake_server.server.drop_sockets())
+    waiting.join(15)
+
+    assert not waiting.is_alive()
+    assert result['history']['status']['status_str'] == 'success'
+    # 断线后由轮询拿到结果
+    assert api._tracker is not None
+    assert prompt_id not in api._waiters
+
+
+def test_history_errors_do_not_abort_wait(fake_server):
+    # 不重试、熔断很快恢复，让故障期间的每次history查询都直接失败
+    api = ComfyUIAPI(fake_server.address, timeout=5,
+                     retry_policies={'read': RetryPolicy(max_attempts=1)},
+                     breaker=CircuitBreaker(fake_server.address, reset_timeout=0.1))
+    try:
+        fake_server.server.delay = 1.0
+        prompt_id = submit(api, WORKFLOW)
+        # 服务器的HTTP接口暂时返回500（如Pod重启），WebSocket仍然连着
+        fake_server.server.failing = True
+
+        result = {}
+        waiting = threading.Thread(
+            target=lambda: result.update(history=api.wait_for_completion(prompt_id, timeout=15)))
+        waiting.start()
+        time.sleep(2)
+        assert waiting.is_alive(), "查询history失败不应中断等待"
+        fake_server.server.failing = False
+        waiting.join(15)
+
+        assert result['history']['status']['status_str'] == 'success'
+    finally:
+        api.close()
+
+
+def test_overall_timeout(api, fake_server):
+    fake_server.server.delay = 5
+    prompt_id = submit(api, WORKFLOW)
+
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        api.wait_for_completion(prompt_id, timeout=0.5)
+
+    assert time.monotonic() - start < 3
+    assert prompt_id not in api._waiters
+
+
+def test_node_profile_complete_on_idle_server(api, fake_server):
+    fake_server.server.delay = 0.05
+    for _ in range(5):
+        # 空闲的服务器在/prompt返回前就开始执行，最初的executing事件不能丢失
+        prompt_id = submit(api, WORKFLOW)
+        api.wait_for_completion(prompt_id, timeout=10)
+        profile = api.pop_node_profile(prompt_id)
+        assert [entry['node'] for entry in profile] == ['1', '2']
@@ -0,0 +1,63 @@
+"""WorkflowTemplate.render/encode 与 update_workflow_parameters + json序列化的结果一致"""
+
+import copy
+import json
+import os
+
+import pytest
+
+from main import dumps_compact, load_workflow_from_file, update_workflow_parameters
+from workflow_template import WorkflowTemplate
+
+WORKFLOW_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             'workflows', 'image_to_video_workflow.json')
+
+UPDATES = [
+    {},
+    {'node_52_inputs_seed': 12345, 'node_52_inputs_steps': 4},
+    {'node_49_inputs_positive_prompt': '一只猫在雨中奔跑，电影感，' * 40,
+     'node_42_inputs_image': 'upload_3f2a.png [output]'},
+    # 新增的输入、浮点数、布尔值和列表
+    {'node_52_inputs_cfg': 5.5, 'node_54_inputs_save_output': False,
+     'node_52_inputs_extra': [1, 2.5, 'x'], 'node_53_inputs_tile_x': 272},
+]
+
+
+@pytest.fixture(scope='module')
+def workflow():
+    return load_workflow_from_file(WORKFLOW_PATH)
+
+
+@pytest.mark.parametrize('updates', UPDATES)
+def test_render_and_encode_match_reference(workflow, updates):
+    template = WorkflowTemplate.from_file(WORKFLOW_PATH)
+    expected = update_workflow_parameters(workflow, updates)
+
+    prompt = template.render(updates)
+    assert prompt == expected
+    assert template.encode(prompt) == dumps_compact(expected)
+    # 片段缓存后再次编码结果不变
+    assert template.encode(template.render(updates)) == dumps_compact(expected)
+
+
+def test_jobs_do_not_share_modified_nodes(workflow):
+    template = WorkflowTemplate(copy.deepcopy(workflow))
+    original = copy.deepcopy(template.workflow)
+
+    first = template.render({'node_52_inputs_seed': 1})
+    second = template.render({'node_52_inputs_seed': 2})
+
+    assert template.workflow == original
+    assert first['52']['inputs']['seed'] == 1
+    assert second['52']['inputs']['seed'] == 2
+    # 未修改的节点与模板共享，不做复制
+    assert first['48'] is template.workflow['48']
+    assert json.loads(template.encode(second))['52']['inputs']['seed'] == 2
+    assert json.loads(template.encode(first))['52']['inputs']['seed'] == 1
+
+
+@pytest.mark.parametrize('key', ['node_999_inputs_seed', 'seed', 'node_52'])
+def test_invalid_update_key(workflow, key):
+    template = WorkflowTemplate(workflow)
+    with pytest.raises(ValueError):
+        template.render({key: 1})
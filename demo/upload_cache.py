@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+按内容寻址的图片上传缓存
+服务器端文件名由文件内容的哈希生成，本地索引记录每个服务器已有的文件，
+相同图片重复提交时无需再次上传。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional, Dict, Tuple
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'comfyui-acs', 'uploads.json')
+
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """计算文件内容的sha256"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def content_filename(digest: str, image_path: str) -> str:
+    """由内容哈希生成服务器端文件名，保留原扩展名"""
+    ext = os.path.splitext(image_path)[1].lower() or '.png'
+    return f"{digest[:32]}{ext}"
+
+
+class UploadCache:
+    """记录各服务器已有的上传文件，按最近使用时间淘汰"""
+
+    def __init__(self, index_path: str = DEFAULT_INDEX_PATH, max_entries: int = 1000):
+        self.index_path = index_path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._digests: Dict[Tuple[str, int, int], str] = {}
+        # {server_address: {digest: {"name": 服务器端文件名, "last_used": 时间戳}}}
+        self._index: Dict[str, Dict[str, Dict]] = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, Dict]]:
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"上传索引损坏，已忽略: {e}")
+            return {}
+
+    def digest(self, image_path: str) -> str:
+        """计算文件哈希，文件未修改时复用进程内结果"""
+        stat = os.stat(image_path)
+        key = (os.path.abspath(image_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if key in self._digests:
+                return self._digests[key]
+        digest = file_digest(image_path)
+        with self._lock:
+            self._digests[key] = digest
+        return digest
+
+    def lookup(self, server: str, digest: str) -> Optional[str]:
+        """返回服务器上已记录的文件名，没有记录时返回None"""
+        with self._lock:
+            entry = self._index.get(server, {}).get(digest)
+            if entry is None:
+                return None
+            entry['last_used'] = time.time()
+            return entry['name']
+
+    def record(self, server: str, digest: str, name: str):
+        """记录一次成功上传并持久化"""
+        with self._lock:
+            entries = self._index.setdefault(server, {})
+            entries[digest] = {'name': name, 'last_used': time.time()}
+            if len(entries) > self.max_entries:
+                oldest = sorted(entries, key=lambda d: entries[d]['last_used'])
+                for stale in oldest[:len(entries) - self.max_entries]:
+                    del entries[stale]
+            self._save_locked()
+
+    def forget(self, server: str, digest: str):
+        """服务器上文件已不存在（如Pod重建），删除记录"""
+        with self._lock:
+            if self._index.get(server, {}).pop(digest, None) is not None:
+                self._save_locked()
+
+    def save(self):
+        """持久化索引（包括最近使用时间）"""
+        with self._lock:
+            self._save_locked()
+
+    def _save_locked(self):
+        os.makedirs(os.path.dirname(self.index_path) or '.', exist_ok=True)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.index_path)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+工作流校验
+提交前在本地检查prompt图：更新参数指向的节点是否存在、连线 ["46", 0] 是否指向存在的节点、
+LoadImage的图片输入、是否有环。提供服务器的 /object_info 时进一步检查节点类型、必填输入、
+连线两端的类型、数值范围和下拉选项（如模型文件是否存在于服务器上）。
+这些错误原本要到任务进入GPU队列后才会暴露。
+"""
+
+from typing import Optional, Dict, Any, List, Tuple
+
+from object_info import coerce_value, input_specs
+
+
+class ValidationReport:
+    """校验结果，errors会导致服务器拒绝或执行失败，warnings仅提示"""
+
+    def __init__(self):
+        self.errors: List[str] = []
+        self.warnings: List[str] = []
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def show(self):
+        for error in self.errors:
+            print(f"❌ {error}")
+        for warning in self.warnings:
+            print(f"⚠️  {warning}")
+        if self.ok:
+            print(f"✅ 工作流校验通过{f' ({len(self.warnings)} 个警告)' if self.warnings else ''}")
+
+
+def is_link(value: Any) -> bool:
+    """连线输入的格式为 [源节点ID, 输出序号]"""
+    return (isinstance(value, list) and len(value) == 2 and isinstance(value[0], str)
+            and isinstance(value[1], int) and not isinstance(value[1], bool))
+
+
+def _parse_update_key(key: str) -> Optional[Tuple[str, str, str]]:
+    parts = key.split('_', 3)
+    if len(parts) < 4 or parts[0] != 'node':
+        return None
+    return parts[1], parts[2], parts[3]
+
+
+def check_updates(workflow: Dict[str, Any], update_keys, report: ValidationReport,
+                  object_info: Optional[Dict[str, Any]] = None):
+    """检查更新键的格式和目标节点"""
+    for key in update_keys:
+        parsed = _parse_update_key(key)
+        if parsed is None:
+            report.errors.append(f"无效的参数格式: {key}，应为 node_ID_section_key")
+            continue
+        node_id, section, param_key = parsed
+        node = workflow.get(node_id)
+        if not isinstance(node, dict):
+            report.errors.append(f"工作流中不存在节点 {node_id}: {key}")
+            continue
+        if section != 'inputs':
+            continue
+        definition = (object_info or {}).get(node.get('class_type'))
+        if definition is not None:
+            if param_key not in input_specs(definition):
+                report.errors.append(f"节点 {node_id} ({node.get('class_type')}) 没有输入 {param_key}: {key}")
+        elif param_key not in node.get('inputs', {}):
+            report.warnings.append(f"节点 {node_id} 原本没有输入 {param_key}，将新增: {key}")
+
+
+def apply_updates(workflow: Dict[str, Any], updates: Dict[str, Any]) -> Dict[str, Any]:
+    """不打印日志地应用更新，只复制被修改的节点，忽略无效的键（由check_updates报告）"""
+    prompt = dict(workflow)
+    for key, value in updates.items():
+        parsed = _parse_update_key(key)
+        if parsed is None or not isinstance(prompt.get(parsed[0]), dict):
+            continue
+        node_id, section, param_key = parsed
+        node = prompt[node_id] = dict(prompt[node_id])
+        node[section] = dict(node.get(section) or {})
+        node[section][param_key] = value
+    return prompt
+
+
+def _find_cycle(prompt: Dict[str, Any]) -> Optional[List[str]]:
+    """沿连线做深度优先搜索，返回环上的节点ID"""
+    edges = {node_id: [value[0] for value in node.get('inputs', {}).values()
+                       if is_link(value) and value[0] in prompt]
+             for node_id, node in prompt.items() if isinstance(node, dict)}
+    state: Dict[str, int] = {}  # 1: 在当前路径上, 2: 已完成
+    for start in edges:
+        if start in state:
+            continue
+        path = [start]
+        stack = [iter(edges[start])]
+        state[start] = 1
+        while stack:
+            upstream = next(stack[-1], None)
+            if upstream is None:
+                state[path.pop()] = 2
+                stack.pop()
+            elif state.get(upstream) == 1:
+                return path[path.index(upstream):] + [upstream]
+            elif upstream not in state:
+                state[upstream] = 1
+                path.append(upstream)
+                stack.append(iter(edges.get(upstream, [])))
+    return None
+
+
+def check_graph(prompt: Dict[str, Any], report: ValidationReport, image_path: Optional[str] = None):
+    """不依赖服务器的结构检查"""
+    if not prompt:
+        report.errors.append("工作流为空")
+        return
+    load_image_nodes = []
+    for node_id, node in prompt.items():
+        if not isinstance(node, dict) or not isinstance(node.get('class_type'), str):
+            report.errors.append(f"节点 {node_id} 缺少class_type（工作流需为API格式导出）")
+            continue
+        inputs = node.get('inputs', {})
+        if not isinstance(inputs, dict):
+            report.errors.append(f"节点 {node_id} 的inputs不是对象")
+            continue
+        for name, value in inputs.items():
+            if not is_link(value):
+                continue
+            if value[0] not in prompt:
+                report.errors.append(f"节点 {node_id}.{name} 连接到不存在的节点 {value[0]}")
+            elif value[1] < 0:
+                report.errors.append(f"节点 {node_id}.{name} 的输出序号无效: {value[1]}")
+        if node['class_type'] == 'LoadImage':
+            load_image_nodes.append(node_id)
+            image = inputs.get('image')
+            if not (isinstance(image, str) and image) and not is_link(image):
+                report.errors.append(f"LoadImage节点 {node_id} 没有指定图片")
+
+    if image_path and not load_image_nodes:
+        report.warnings.append("工作流中没有LoadImage节点，输入图片不会被使用")
+    elif not image_path:
+        for node_id in load_image_nodes:
+            report.warnings.append(f"LoadImage节点 {node_id} 使用工作流中的图片 "
+                                   f"{prompt[node_id]['inputs'].get('image')}，服务器input目录中需已有此文件")
+
+    cycle = _find_cycle(prompt)
+    if cycle:
+        report.errors.append(f"工作流存在环: {' -> '.join(cycle)}")
+
+
+def _types_match(output_type: str, input_type: str) -> bool:
+    if '*' in (output_type, input_type):
+        return True
+    return bool(set(output_type.split(',')) & set(input_type.split(',')))
+
+
+def check_object_info(prompt: Dict[str, Any], object_info: Dict[str, Any], report: ValidationReport):
+    """按服务器的节点定义检查节点类型、输入和连线类型"""
+    has_output = False
+    for node_id, node in prompt.items():
+        if not isinstance(node, dict) or not isinstance(node.get('inputs', {}), dict):
+            continue
+        class_type = node.get('class_type')
+        definition = object_info.get(class_type)
+        if definition is None:
+            report.errors.append(f"节点 {node_id}: 服务器上没有节点类型 {class_type}（自定义节点未安装？）")
+            continue
+        has_output = has_output or bool(definition.get('output_node'))
+        inputs = node.get('inputs', {})
+        specs = input_specs(definition)
+
+        for name in (definition.get('input', {}).get('required') or {}):
+            if name not in inputs:
+                report.errors.append(f"节点 {node_id} ({class_type}) 缺少必填输入 {name}")
+        for name, value in inputs.items():
+            spec = specs.get(name)
+            if spec is None:
+                report.warnings.append(f"节点 {node_id} ({class_type}) 的输入 {name} 不在服务器定义中，将被忽略")
+                continue
+            if not is_link(value):
+                try:
+                    coerce_value(value, spec, where=f"节点 {node_id}.{name}",
+                                 is_image_input=class_type == 'LoadImage' and name == 'image')
+                except ValueError as e:
+                    report.errors.append(str(e))
+                continue
+            source = prompt.get(value[0])
+            source_definition = object_info.get(source.get('class_type')) if isinstance(source, dict) else None
+            if source_definition is None:
+                continue  # 已报告
+            outputs = source_definition.get('output') or []
+            if value[1] >= len(outputs):
+                report.errors.append(f"节点 {node_id}.{name} 连接到 {value[0]} 的第 {value[1]} 个输出，"
+                                     f"但 {source['class_type']} 只有 {len(outputs)} 个输出")
+                continue
+            output_type = outputs[value[1]]
+            if isinstance(spec[0], str) and isinstance(output_type, str) and not _types_match(output_type, spec[0]):
+                report.errors.append(f"节点 {node_id}.{name} 需要 {spec[0]}，"
+                                     f"但连接的 {value[0]} 输出为 {output_type}")
+
+    if not has_output:
+        report.errors.append("工作流没有输出节点，服务器不会执行")
+
+
+def validate_workflow(workflow: Dict[str, Any], updates: Optional[Dict[str, Any]] = None,
+                      image_path: Optional[str] = None, object_info: Optional[Dict[str, Any]] = None,
+                      extra_update_keys=()) -> ValidationReport:
+    """校验工作流及要应用的更新；extra_update_keys为尚未确定取值的更新键（如参数扫描的维度）"""
+    report = ValidationReport()
+    check_updates(workflow, list(updates or {}) + list(extra_update_keys), report, object_info)
+    prompt = apply_updates(workflow, updates or {})
+    check_graph(prompt, report, image_path)
+    if object_info is not None:
+        check_object_info(prompt, object_info, report)
+    return report
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Pod预热
+新调度的comfyui Pod在 /queue 可访问时还不能马上出图：第一个真实任务要承担模型加载和
+WanVideoTorchCompileSettings 的inductor编译。预热工具向每个服务器提交各工作流的最小版本
+（低分辨率、少量帧和采样步数，输出写入 warmup/ 子目录），第一次为冷启动，之后为热启动，
+报告两者的耗时和冷启动中最慢的节点。
+
+就绪检查只在预热完成后通过，负载均衡不会把真实流量提前发给Pod:
+  --serve-ready 8189   提供 GET /ready（预热完成前返回503），可作为readinessProbe的httpGet；隐含--watch
+  --ready-file PATH    预热完成后创建文件，可作为exec探针 test -f PATH
+  --watch              持续检查服务器，Pod内ComfyUI重启后撤销就绪并重新预热
+
+重启可能在一个检查间隔内完成，/queue 仍可访问。ComfyUI的history只保存在内存中，
+因此每次检查还确认最后一个预热任务仍在 /history 中，找不到即视为已重启。
+
+注意：torch.compile按输入形状缓存编译结果，低分辨率预热只能提前完成模型加载和部分编译；
+需要完整预热编译时使用 --keep-size（保持分辨率和帧数，只减少采样步数）。
+
+用法（在demo目录下）:
+  python warmup.py --server 127.0.0.1:8188 -w workflows/text_to_video_workflow.json
+  python warmup.py -w workflows/image_to_video_workflow.json --keep-size --serve-ready 8189 --watch
+"""
+
+import argparse
+import json
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any, List
+
+from main import ComfyUIAPI, PREVIEW_SIZE_KEYS, find_load_image_node
+from metrics import Metrics
+from progress import print_node_profile
+from workflow_template import WorkflowTemplate
+
+SEED_KEYS = ('seed', 'noise_seed')
+
+
+def warmup_updates(workflow: Dict[str, Any], scale: float = 0.25, min_size: int = 64, max_frames: int = 5,
+                   steps: int = 2, keep_size: bool = False) -> Dict[str, Any]:
+    """生成最小版本的参数更新：分辨率取16的倍数且不小于min_size，帧数取4n+1，输出写入warmup/子目录"""
+    updates = {}
+    for node_id, node in workflow.items():
+        for key, value in node.get('inputs', {}).items():
+            name = f'node_{node_id}_inputs_{key}'
+            if key == 'filename_prefix' and isinstance(value, str):
+                updates[name] = f"warmup/{value}"
+                continue
+            if isinstance(value, bool) or not isinstance(value, int):
+                continue
+            if key in PREVIEW_SIZE_KEYS and not keep_size:
+                new_value = max(int(value * scale) // 16 * 16, min_size)
+            elif key == 'num_frames' and not keep_size:
+                new_value = (min(value, max_frames) - 1) // 4 * 4 + 1
+            elif key == 'steps':
+                new_value = min(value, steps)
+            else:
+                continue
+            if new_value != value:
+                updates[name] = new_value
+    return updates
+
+
+def _seed_updates(workflow: Dict[str, Any]) -> Dict[str, Any]:
+    """每次预热使用新的种子，否则服务器直接返回缓存的节点输出，测不到热启动耗时"""
+    return {f'node_{node_id}_inputs_{key}': random.randrange(2 ** 32)
+            for node_id, node in workflow.items()
+            for key, value in node.get('inputs', {}).items()
+            if key in SEED_KEYS and isinstance(value, int)}
+
+
+def write_blank_png(path: str, width: int = 64, height: int = 64):
+    """写入纯灰色PNG，工作流需要输入图片而未指定时使用（不依赖Pillow）"""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    rows = b''.join(b'\x00' + b'\x80' * (width * 3) for _ in range(height))
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(rows)))
+        f.write(chunk(b'IEND', b''))
+
+
+class WarmupState:
+    """各服务器的预热状态，全部预热完成后才算就绪"""
+
+    def __init__(self, servers: List[str], ready_file: Optional[str] = None):
+        self.ready_file = ready_file
+        self._lock = threading.Lock()
+        self._servers = {server: {'ready': False, 'results': []} for server in servers}
+        self._sync_ready_file()  # 清除上次运行留下的就绪文件
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return all(state['ready'] for state in self._servers.values())
+
+    def is_ready(self, server: str) -> bool:
+        with self._lock:
+            return self._servers[server]['ready']
+
+    def set(self, server: str, ready: bool, results: Optional[List[Dict[str, Any]]] = None):
+        with self._lock:
+            self._servers[server]['ready'] = ready
+            if results is not None:
+                self._servers[server]['results'] = results
+        self._sync_ready_file()
+
+    def _sync_ready_file(self):
+        if self.ready_file:
+            if self.ready:
+                os.makedirs(os.path.dirname(self.ready_file) or '.', exist_ok=True)
+                with open(self.ready_file, 'w', encoding='utf-8') as f:
+                    f.write(str(time.time()))
+            elif os.path.exists(self.ready_file):
+                os.remove(self.ready_file)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'ready': all(state['ready'] for state in self._servers.values()),
+                    'servers': json.loads(json.dumps(self._servers))}
+
+
+def serve_readiness(state: WarmupState, port: int, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+    """在后台线程提供 GET /ready，预热完成前返回503"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/ready':
+                self.send_error(404)
+                return
+            snapshot = state.snapshot()
+            body = json.dumps(snapshot, ensure_ascii=False).encode('utf-8')
+            self.send_response(200 if snapshot['ready'] else 503)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"就绪检查接口: http://{host}:{server.server_port}/ready")
+    return server
+
+
+def run_once(api: ComfyUIAPI, template: WorkflowTemplate, updates: Dict[str, Any],
+             wait_timeout: Optional[float]) -> Dict[str, Any]:
+    """提交一次预热任务并等待完成（不下载输出），返回耗时和各节点耗时"""
+    prompt = template.render(dict(updates, **_seed_updates(template.workflow)))
+    started = time.perf_counter()
+    result = api.queue_prompt(prompt, prompt_json=template.encode(prompt))
+    if 'prompt_id' not in result:
+        raise RuntimeError(f"提交预热任务失败: {result}")
+    prompt_id = result['prompt_id']
+    try:
+        api.wait_for_completion(prompt_id, timeout=wait_timeout)
+    except TimeoutError:
+        api.cancel(prompt_id)
+        raise
+    return {'seconds': round(time.perf_counter() - started, 3), 'nodes': api.pop_node_profile(prompt_id),
+            'prompt_id': prompt_id}
+
+
+def warm_server(api: ComfyUIAPI, workflow_paths: List[str], passes: int = 2, image_path: Optional[str] = None,
+                keep_size: bool = False, steps: int = 2, wait_timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+    """对一个服务器依次预热各工作流，第一次为冷启动，其余为热启动；任一次失败时抛出异常"""
+    results = []
+    for workflow_path in workflow_paths:
+        template = WorkflowTemplate.from_file(workflow_path)
+        updates = warmup_updates(template.workflow, steps=steps, keep_size=keep_size)
+
+        load_image_node = find_load_image_node(template.workflow)
+        if load_image_node:
+            path = image_path
+            if path is None:
+                path = os.path.join(tempfile.gettempdir(), 'comfyui_warmup.png')
+                write_blank_png(path)
+            server_filename = api.ensure_image(path)
+            if not server_filename:
+                raise RuntimeError(f"预热图片上传失败: {path}")
+            updates[f'node_{load_image_node}_inputs_image'] = server_filename
+
+        timings = []
+        for attempt in range(passes):
+            label = '冷启动' if attempt == 0 else '热启动'
+            print(f"[{api.server_address}] {os.path.basename(workflow_path)} {label}预热...")
+            run = run_once(api, template, updates, wait_timeout)
+            print(f"[{api.server_address}] {label}耗时 {run['seconds']:.1f}s")
+            if attempt == 0:
+                print_node_profile(run['nodes'])
+            timings.append(run['seconds'])
+        results.append({'workflow': workflow_path, 'cold': timings[0],
+                        'warm': min(timings[1:]) if len(timings) > 1 else None, 'prompt_id': run['prompt_id']})
+    return results
+
+
+def restart_reason(api: ComfyUIAPI, marker: Optional[str]) -> Optional[str]:
+    """已就绪的服务器是否已重启，返回原因，未重启时返回None；无法连接时抛出异常
+
+    marker为最后一个预热任务的prompt_id，服务器重启后history清空，找不到该任务。
+    """
+    api.get_queue()
+    if marker and marker not in api.get_history(marker):
+        return f"history中找不到预热任务 {marker}，服务器已重启"
+    return None
+
+
+def print_report(server: str, results: List[Dict[str, Any]]):
+    print(f"=== 预热结果 {server} ===")
+    for result in results:
+        warm = result['warm']
+        detail = f" 热启动 {warm:.1f}s 冷启动多 {result['cold'] - warm:.1f}s" if warm is not None else ''
+        print(f"{os.path.basename(result['workflow']):<36} 冷启动 {result['cold']:.1f}s{detail}")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='预热ComfyUI Pod：加载模型、完成编译后才报告就绪')
+    parser.add_argument('--server', default='127.0.0.1:8188',
+                        help='ComfyUI服务器地址，多个地址用逗号分隔 (默认: 127.0.0.1:8188)')
+    parser.add_argument('--workflow', '-w', action='append', required=True,
+                        help='要预热的工作流文件，可多次指定')
+    parser.add_argument('--image', '-i', help='需要输入图片的工作流使用的图片（默认生成纯灰色图片）')
+    parser.add_argument('--passes', type=int, default=2, help='每个工作流的预热次数，第一次为冷启动 (默认: 2)')
+    parser.add_argument('--steps', type=int, default=2, help='预热时的采样步数 (默认: 2)')
+    parser.add_argument('--keep-size', action='store_true',
+                        help='保持原分辨率和帧数（torch.compile按形状编译，完整预热需要与真实任务相同的形状）')
+    parser.add_argument('--timeout', type=int, default=30, help='请求超时时间(秒) (默认: 30)')
+    parser.add_argument('--wait-timeout', type=float, default=None, help='每次预热任务的最长等待时间(秒)')
+    parser.add_argument('--serve-ready', type=int, metavar='PORT',
+                        help='在该端口提供 GET /ready 就绪检查，隐含--watch，进程持续运行')
+    parser.add_argument('--ready-file', help='预热完成后创建的文件，撤销就绪时删除')
+    parser.add_argument('--watch', action='store_true', help='持续检查服务器，ComfyUI重启后重新预热')
+    parser.add_argument('--interval', type=float, default=10, help='--watch的检查间隔(秒) (默认: 10)')
+    args = parser.parse_args()
+    # 就绪检查需要一直可访问，预热完成后进程不能退出
+    if args.serve_ready:
+        args.watch = True
+    return args
+
+
+def main():
+    args = parse_arguments()
+    servers = [server.strip() for server in args.server.split(',') if server.strip()]
+    state = WarmupState(servers, ready_file=args.ready_file)
+    if args.serve_ready:
+        serve_readiness(state, args.serve_ready)
+
+    metrics = Metrics()
+    apis = {server: ComfyUIAPI(server, timeout=args.timeout, metrics=metrics) for server in servers}
+    # 各服务器最后一个预热任务的prompt_id
+    markers: Dict[str, Optional[str]] = {}
+    try:
+        while True:
+            for server, api in list(apis.items()):
+                if state.is_ready(server):
+                    # 已就绪的服务器只确认没有重启过，ComfyUI重启后模型和编译缓存都已丢失
+                    try:
+                        reason = restart_reason(api, markers.get(server))
+                    except Exception:
+                        reason = "连接丢失"
+                    if reason:
+                        print(f"⚠️  [{server}] {reason}，撤销就绪")
+                        state.set(server, False)
+                        # 丢弃旧连接（包括WebSocket监听），重启后的服务器用新的客户端预热
+                        api.close()
+                        apis[server] = ComfyUIAPI(server, timeout=args.timeout, metrics=metrics)
+                    continue
+                if not api.test_connection():
+                    continue
+                try:
+                    results = warm_server(api, args.workflow, passes=args.passes, image_path=args.image,
+                                          keep_size=args.keep_size, steps=args.steps,
+                                          wait_timeout=args.wait_timeout)
+                except Exception as e:
+                    print(f"❌ [{server}] 预热失败: {e}")
+                    continue
+                print_report(server, results)
+                markers[server] = results[-1]['prompt_id'] if results else None
+                state.set(server, True, results)
+                print(f"✅ [{server}] 预热完成")
+
+            if not args.watch:
+                return 0 if state.ready else 1
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        print("\n⚠️  用户中断操作")
+        return 0 if state.ready else 1
+    finally:
+        for api in apis.values():
+            api.close()
+
+
+if __name__ == "__main__":
+    exit(main())
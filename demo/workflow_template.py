@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+预编译的工作流模板
+加载一次工作流并解析更新键(node_<id>_<section>_<key>)，之后每个任务只复制被修改的节点，
+未修改的节点在各任务间共享，避免对整个工作流做深拷贝。
+提供服务器节点定义(object_info)时，render()按每个输入的类型转换取值并检查范围。
+
+encode()把render()的结果序列化为提交用的JSON：未修改的节点和输入使用缓存的片段拼接，
+只序列化新的取值；批量任务中重复出现的长提示词只编码一次。
+"""
+
+from functools import lru_cache
+from typing import Optional, Dict, Any, Iterable, List, Tuple
+
+from main import load_workflow_from_file, dumps_compact
+from object_info import coerce_value, input_spec
+from validator import ValidationReport, check_graph
+
+
+# 短于此长度的字符串直接编码，更长的（提示词）经过缓存
+_TEXT_CACHE_MIN_LENGTH = 256
+_MISSING = object()
+
+
+@lru_cache(maxsize=256)
+def _encode_text(text: str) -> bytes:
+    return dumps_compact(text)
+
+
+@lru_cache(maxsize=1024)
+def _encode_key(key: str) -> bytes:
+    """节点ID与输入名，带冒号"""
+    return dumps_compact(key) + b':'
+
+
+def _encode_value(value: Any) -> bytes:
+    if isinstance(value, str) and len(value) >= _TEXT_CACHE_MIN_LENGTH:
+        return _encode_text(value)
+    return dumps_compact(value)
+
+
+class WorkflowTemplate:
+    """工作流模板，render()生成的prompt与模板共享未修改的节点，调用方不应原地修改"""
+
+    def __init__(self, workflow: Dict[str, Any], update_keys: Optional[Iterable[str]] = None,
+                 object_info: Optional[Dict[str, Any]] = None):
+        self.workflow = workflow
+        self.object_info = object_info
+        self._slots: Dict[str, Tuple[str, str, str]] = {}
+        self._specs: Dict[str, Optional[List[Any]]] = {}
+        # 已序列化的片段: 节点ID -> 整个节点，(节点ID, 分区, 键) -> 单个输入
+        self._fragments: Dict[Any, bytes] = {}
+        for key in update_keys or ():
+            self.slot(key)
+
+    @classmethod
+    def from_file(cls, workflow_path: str, update_keys: Optional[Iterable[str]] = None,
+                  object_info: Optional[Dict[str, Any]] = None) -> 'WorkflowTemplate':
+        """从JSON文件加载工作流并编译模板，图结构有错误（断开的连线、环等）时抛出ValueError"""
+        workflow = load_workflow_from_file(workflow_path)
+        report = ValidationReport()
+        check_graph(workflow, report)
+        if not report.ok:
+            raise ValueError(f"工作流校验失败: {'; '.join(report.errors)}")
+        return cls(workflow, update_keys, object_info)
+
+    def slot(self, key: str) -> Tuple[str, str, str]:
+        """解析并校验更新键，返回(node_id, section, param_key)，结果缓存"""
+        slot = self._slots.get(key)
+        if slot is not None:
+            return slot
+
+        parts = key.split('_', 3)
+        if len(parts) < 4 or parts[0] != 'node':
+            raise ValueError(f"无效的参数格式: {key}，应为 node_ID_section_key")
+        node_id, section, param_key = parts[1], parts[2], parts[3]
+        if node_id not in self.workflow:
+            raise ValueError(f"工作流中不存在节点 {node_id}: {key}")
+
+        slot = (node_id, section, param_key)
+        self._slots[key] = slot
+        if self.object_info is not None and section == 'inputs':
+            self._specs[key] = input_spec(self.object_info, self.workflow[node_id].get('class_type'), param_key)
+        return slot
+
+    def render(self, updates: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """生成单个任务的prompt，只复制被修改的节点和分区；取值不符合节点定义时抛出ValueError"""
+        prompt = dict(self.workflow)
+        copied = set()
+        for key, value in (updates or {}).items():
+            node_id, section, param_key = self.slot(key)
+            spec = self._specs.get(key)
+            if spec is not None:
+                value = coerce_value(value, spec, where=f"节点 {node_id}.{param_key}",
+                                     is_image_input=prompt[node_id].get('class_type') == 'LoadImage'
+                                     and param_key == 'image')
+            if node_id not in copied:
+                prompt[node_id] = dict(prompt[node_id])
+                copied.add(node_id)
+            node = prompt[node_id]
+            if (node_id, section) not in copied:
+                node[section] = dict(node.get(section) or {})
+                copied.add((node_id, section))
+            node[section][param_key] = value
+        return prompt
+
+    def _fragment(self, key, name: str, value: Any) -> bytes:
+        fragment = self._fragments.get(key)
+        if fragment is None:
+            fragment = self._fragments[key] = _encode_key(name) + _encode_value(value)
+        return fragment
+
+    def _encode_section(self, node_id: str, name: str, section: Any, original: Any) -> bytes:
+        if section is original:
+            return self._fragment((node_id, name), name, section)
+        if not isinstance(section, dict) or not isinstance(original, dict):
+            return _encode_key(name) + _encode_value(section)
+        items = [self._fragment((node_id, name, key), key, value)
+                 if original.get(key, _MISSING) is value
+                 else _encode_key(key) + _encode_value(value)
+                 for key, value in section.items()]
+        return _encode_key(name) + b'{' + b','.join(items) + b'}'
+
+    def encode(self, prompt: Dict[str, Any]) -> bytes:
+        """将render()生成的prompt序列化为紧凑的UTF-8 JSON，与模板共享的部分使用缓存的片段"""
+        parts = []
+        for node_id, node in prompt.items():
+            original = self.workflow.get(node_id)
+            if node is original:
+                parts.append(self._fragment(node_id, node_id, node))
+            elif isinstance(node, dict) and isinstance(original, dict):
+                sections = [self._encode_section(node_id, name, section, original.get(name))
+                            for name, section in node.items()]
+                parts.append(_encode_key(node_id) + b'{' + b','.join(sections) + b'}')
+            else:
+                parts.append(_encode_key(node_id) + _encode_value(node))
+        return b'{' + b','.join(parts) + b'}'